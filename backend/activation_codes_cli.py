@@ -0,0 +1,204 @@
+"""Activation code management: mint codes in bulk and export unused ones.
+
+    python activation_codes_cli.py mint 1000000 --batch-size 10000 --label distributor-x
+    python activation_codes_cli.py export unused_codes.csv --label distributor-x
+
+populate_activation_codes.py and export_unused_codes.py are kept as shortcuts to these commands.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import string
+import secrets
+import argparse
+from datetime import datetime
+
+import certifi
+from dotenv import load_dotenv
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
+
+from repositories import ActivationCodeRepository, mongo_client_options
+
+CODE_ALPHABET = string.ascii_letters + string.digits
+CODE_LENGTH = 12
+DEFAULT_BATCH_SIZE = 10000
+# Rounds of regenerating codes that hit the unique index before giving up on a batch
+MAX_COLLISION_RETRIES = 5
+DUPLICATE_KEY_ERROR = 11000
+EXPORT_FORMATS = ("txt", "csv", "jsonl")
+
+
+def generate_random_code(length=CODE_LENGTH):
+    """Generates a random alphanumeric code from a cryptographically secure source."""
+    return ''.join(secrets.choice(CODE_ALPHABET) for _ in range(length))
+
+
+def get_activation_codes_collection(mongo_uri=None):
+    """Returns (client, activation_codes collection) using MONGO_URI from .env by default."""
+    load_dotenv()
+    mongo_uri = mongo_uri or os.getenv("MONGO_URI")
+    if not mongo_uri:
+        raise RuntimeError("MONGO_URI not found in .env file.")
+    client = MongoClient(mongo_uri, tlsCAFile=certifi.where(), **mongo_client_options())
+    db = client['voicememos_db']
+    return client, db["activation_codes"]
+
+
+class ProgressReporter:
+    """Prints done/total and throughput at most every `interval` seconds."""
+
+    def __init__(self, action, total=None, interval=2.0):
+        self.action = action
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.started = time.perf_counter()
+        self._last_report = self.started
+
+    def advance(self, count):
+        self.done += count
+        now = time.perf_counter()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            self.report()
+
+    def report(self, final=False):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        progress = f"{self.done}/{self.total}" if self.total else str(self.done)
+        prefix = "Done:" if final else "Progress:"
+        print(f"{prefix} {self.action} {progress} codes in {elapsed:.1f}s ({self.done / elapsed:,.0f} codes/s)")
+
+
+def _insert_batch(collection, codes, label, created_at):
+    """Insert codes unordered; returns (inserted, codes that collided with existing ones)."""
+    documents = []
+    for code in codes:
+        document = {"code": code, "used": False, "created_at": created_at}
+        if label:
+            document["batch"] = label
+        documents.append(document)
+    try:
+        result = collection.insert_many(documents, ordered=False)
+        return len(result.inserted_ids), []
+    except BulkWriteError as e:
+        details = e.details
+        collided = [codes[err["index"]] for err in details.get("writeErrors", []) if err.get("code") == DUPLICATE_KEY_ERROR]
+        other_errors = [err for err in details.get("writeErrors", []) if err.get("code") != DUPLICATE_KEY_ERROR]
+        if other_errors:
+            raise
+        return details.get("nInserted", len(codes) - len(collided)), collided
+
+
+def mint_codes(collection, count, batch_size=DEFAULT_BATCH_SIZE, label=None, length=CODE_LENGTH):
+    """Generate and insert `count` new unused codes, replacing any that collide with existing codes."""
+    # Collisions are only detected (and retried) if the unique index exists
+    ActivationCodeRepository(collection).ensure_indexes()
+    progress = ProgressReporter("inserted", total=count)
+    collisions = 0
+    created_at = datetime.utcnow()
+
+    remaining = count
+    while remaining > 0:
+        wanted = min(batch_size, remaining)
+        codes = set()
+        while len(codes) < wanted:
+            codes.add(generate_random_code(length))
+        codes = list(codes)
+
+        for _ in range(MAX_COLLISION_RETRIES + 1):
+            inserted, collided = _insert_batch(collection, codes, label, created_at)
+            progress.advance(inserted)
+            remaining -= inserted
+            if not collided:
+                break
+            collisions += len(collided)
+            codes = list({generate_random_code(length) for _ in collided})
+        else:
+            raise RuntimeError(f"Codes kept colliding after {MAX_COLLISION_RETRIES} retries; use a longer code length")
+
+    progress.report(final=True)
+    if collisions:
+        print(f"Regenerated {collisions} codes that collided with existing ones.")
+    return progress.done
+
+
+def _export_format(output_path, fmt=None):
+    fmt = fmt or os.path.splitext(output_path)[1].lstrip(".").lower() or "txt"
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format '{fmt}' (use one of {', '.join(EXPORT_FORMATS)})")
+    return fmt
+
+
+def export_codes(collection, output_path, fmt=None, label=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Stream unused codes to a TXT, CSV or JSONL file without loading them all in memory."""
+    fmt = _export_format(output_path, fmt)
+    cursor = ActivationCodeRepository(collection).unused(label, batch_size)
+    progress = ProgressReporter("exported")
+
+    with open(output_path, "w", newline="") as f:
+        writer = None
+        if fmt == "csv":
+            writer = csv.writer(f)
+            writer.writerow(["code", "batch", "created_at"])
+        for doc in cursor:
+            code = doc.get("code")
+            if not code:
+                continue
+            if fmt == "txt":
+                f.write(code + "\n")
+            elif fmt == "csv":
+                created_at = doc.get("created_at")
+                writer.writerow([code, doc.get("batch", ""), created_at.isoformat() if created_at else ""])
+            else:
+                f.write(json.dumps({"code": code, "batch": doc.get("batch"), "created_at": doc.get("created_at")}, default=str) + "\n")
+            progress.advance(1)
+
+    progress.report(final=True)
+    return progress.done
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Activation code management")
+    parser.add_argument("--uri", help="MongoDB URI (defaults to MONGO_URI from .env)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    mint_parser = subparsers.add_parser("mint", help="Generate and insert new activation codes")
+    mint_parser.add_argument("count", type=int)
+    mint_parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    mint_parser.add_argument("--length", type=int, default=CODE_LENGTH)
+    mint_parser.add_argument("--label", help="Batch label stored with each code (e.g. the distributor's order)")
+
+    export_parser = subparsers.add_parser("export", help="Export unused activation codes")
+    export_parser.add_argument("output", nargs="?", default="unused_activation_codes.txt")
+    export_parser.add_argument("--format", choices=EXPORT_FORMATS, help="Defaults to the output file extension")
+    export_parser.add_argument("--label", help="Only export codes minted with this batch label")
+    export_parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+
+    args = parser.parse_args(argv)
+
+    try:
+        client, collection = get_activation_codes_collection(args.uri)
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        return 1
+
+    try:
+        print(f"Connected to MongoDB. Database: {collection.database.name}, Collection: {collection.name}")
+        if args.command == "mint":
+            mint_codes(collection, args.count, batch_size=args.batch_size, label=args.label, length=args.length)
+        else:
+            export_codes(collection, args.output, fmt=args.format, label=args.label, batch_size=args.batch_size)
+        return 0
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return 1
+    finally:
+        client.close()
+        print("MongoDB connection closed.")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
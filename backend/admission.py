@@ -0,0 +1,219 @@
+import os
+import math
+import time
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from pymongo import ReturnDocument
+from metrics import REGISTRY
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").strip().lower() in ("true", "1")
+# "local" keeps the buckets in each worker; "mongo" shares them between workers and machines
+ADMISSION_BACKEND = os.getenv("ADMISSION_BACKEND", "local").strip().lower()
+# Behind a reverse proxy the client address comes from X-Forwarded-For (only trust it behind one)
+ADMISSION_TRUST_FORWARDED_FOR = os.getenv("ADMISSION_TRUST_FORWARDED_FOR", "false").strip().lower() in ("true", "1")
+# Requests per worker allowed to be waiting on Gemini/ElevenLabs at once, and how many may queue for a slot
+ADMISSION_MAX_UPSTREAM_REQUESTS = int(os.getenv("ADMISSION_MAX_UPSTREAM_REQUESTS", "24"))
+ADMISSION_MAX_WAITING = int(os.getenv("ADMISSION_MAX_WAITING", "8"))
+ADMISSION_WAIT_SECONDS = float(os.getenv("ADMISSION_WAIT_SECONDS", "2"))
+ADMISSION_LOCAL_MAX_BUCKETS = int(os.getenv("ADMISSION_LOCAL_MAX_BUCKETS", "100000"))
+
+_PERIODS = {"s": 1, "sec": 1, "second": 1, "min": 60, "minute": 60, "h": 3600, "hour": 3600}
+
+ADMISSION_REJECTED = REGISTRY.counter(
+    "voicememos_admission_rejected_total",
+    "Requests refused by admission control, by limit (rate limits answer 429, shedding 503)",
+    ("limit",))
+
+
+def parse_rate(spec):
+    """'6/min:3' -> (0.1 tokens per second, burst 3). Without ':burst' the burst is the per-period count."""
+    rate_part, _, burst_part = spec.partition(":")
+    count, _, period = rate_part.partition("/")
+    rate = float(count) / _PERIODS[period.strip().lower() or "s"]
+    burst = float(burst_part) if burst_part else max(1.0, float(count))
+    return rate, burst
+
+
+class LocalBucketBackend:
+    """Token buckets in this process's memory (each gunicorn worker limits on its own)."""
+
+    def __init__(self, max_buckets=ADMISSION_LOCAL_MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost=1.0):
+        """Remove `cost` tokens if available. Returns (allowed, seconds until it would be).
+
+        A cost above the burst is admitted with a full bucket and leaves it in debt, so the key
+        waits until the whole cost has been refilled.
+        """
+        now = time.monotonic()
+        needed = min(cost, burst)
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            allowed = tokens >= needed
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_buckets:
+                # Least recently used first: long idle buckets would be full again anyway
+                self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (needed - tokens) / rate
+
+    def stats(self):
+        with self._lock:
+            return {"backend": "local", "buckets": len(self._buckets)}
+
+
+class MongoBucketBackend:
+    """Token buckets in a Mongo collection, refilled and drawn in one atomic pipeline update."""
+
+    def __init__(self, collection, idle_seconds=3600):
+        self.collection = collection
+        self.idle_seconds = idle_seconds
+
+    def ensure_indexes(self):
+        # A bucket left alone this long is full again: the document can go
+        self.collection.create_index("updated_at", expireAfterSeconds=self.idle_seconds)
+
+    def take(self, key, rate, burst, cost=1.0):
+        now = datetime.utcnow()
+        needed = min(cost, burst)  # Same debt rule as LocalBucketBackend
+        elapsed = {"$divide": [{"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}, 1000]}
+        refilled = {"$min": [burst, {"$add": [{"$ifNull": ["$tokens", burst]}, {"$multiply": [elapsed, rate]}]}]}
+        bucket = self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "updated_at": now}},
+                {"$set": {
+                    "granted": {"$gte": ["$tokens", needed]},
+                    "tokens": {"$cond": [{"$gte": ["$tokens", needed]}, {"$subtract": ["$tokens", cost]}, "$tokens"]},
+                }},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if bucket["granted"]:
+            return True, 0.0
+        return False, (needed - bucket["tokens"]) / rate
+
+    def stats(self):
+        return {"backend": "mongo", "collection": self.collection.name}
+
+
+class UpstreamGate:
+    """Caps the requests of this worker that are waiting on Gemini/ElevenLabs.
+
+    A request that finds every slot taken may wait up to `wait_seconds` if fewer than `max_waiting`
+    are already waiting; otherwise it is shed at once, so a burst costs a quick 503 instead of a
+    worker thread stuck behind a slow upstream.
+    """
+
+    def __init__(self, max_in_flight=ADMISSION_MAX_UPSTREAM_REQUESTS, max_waiting=ADMISSION_MAX_WAITING,
+                 wait_seconds=ADMISSION_WAIT_SECONDS):
+        self.max_in_flight = max_in_flight
+        self.max_waiting = max_waiting
+        self.wait_seconds = wait_seconds
+        self._condition = threading.Condition()
+        self.in_flight = 0
+        self.waiting = 0
+        self.shed = 0
+
+    def acquire(self):
+        with self._condition:
+            if self.in_flight >= self.max_in_flight:
+                if self.waiting >= self.max_waiting:
+                    self.shed += 1
+                    return False
+                self.waiting += 1
+                try:
+                    deadline = time.monotonic() + self.wait_seconds
+                    while self.in_flight >= self.max_in_flight:
+                        left = deadline - time.monotonic()
+                        if left <= 0:
+                            self.shed += 1
+                            return False
+                        self._condition.wait(left)
+                finally:
+                    self.waiting -= 1
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def stats(self):
+        with self._condition:
+            return {"max_in_flight": self.max_in_flight, "in_flight": self.in_flight,
+                    "max_waiting": self.max_waiting, "waiting": self.waiting, "shed": self.shed}
+
+
+class AdmissionController:
+    """Token-bucket limits per user / IP / account plus the upstream gate.
+
+    If the bucket backend fails (e.g. Mongo unreachable) requests are let through: the limiter
+    must not become the outage.
+    """
+
+    def __init__(self, backend, gate=None, enabled=ADMISSION_ENABLED):
+        self.backend = backend
+        self.gate = gate or UpstreamGate()
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.rejected = {}
+        self.backend_errors = 0
+
+    def check(self, limit, key, rate, burst, cost=1.0):
+        """Seconds the caller must wait (Retry-After) under `limit` for `key`, or 0 when admitted."""
+        if not self.enabled or key is None:
+            return 0
+        try:
+            allowed, retry_after = self.backend.take(f"{limit}:{key}", rate, burst, cost)
+        except Exception as e:
+            print(f"Admission backend error ({limit}), letting the request through: {e}")
+            with self._lock:
+                self.backend_errors += 1
+            return 0
+        if allowed:
+            return 0
+        self._count_rejection(limit)
+        return max(1, math.ceil(retry_after))
+
+    def _count_rejection(self, limit):
+        ADMISSION_REJECTED.inc(limit=limit)
+        with self._lock:
+            self.rejected[limit] = self.rejected.get(limit, 0) + 1
+
+    def acquire_upstream(self):
+        if not self.enabled:
+            return True
+        if self.gate.acquire():
+            return True
+        self._count_rejection("upstream_shed")
+        return False
+
+    def release_upstream(self):
+        if self.enabled:
+            self.gate.release()
+
+    def stats(self):
+        with self._lock:
+            rejected = dict(self.rejected)
+            backend_errors = self.backend_errors
+        return {"enabled": self.enabled, **self.backend.stats(), "upstream": self.gate.stats(),
+                "rejected": rejected, "backend_errors": backend_errors}
+
+
+def make_backend(db):
+    """The bucket backend selected by ADMISSION_BACKEND."""
+    if ADMISSION_BACKEND == "mongo":
+        return MongoBucketBackend(db.admission_buckets)
+    if ADMISSION_BACKEND != "local":
+        print(f"Unknown ADMISSION_BACKEND '{ADMISSION_BACKEND}', using local buckets")
+    return LocalBucketBackend()
@@ -0,0 +1,127 @@
+import io
+import os
+import tempfile
+import threading
+import numpy as np
+
+try:
+    import av  # PyAV: FFmpeg's codecs in-process, no ffmpeg binary or subprocess per request
+except ImportError:
+    av = None
+
+# Off by default: mixing means an MP3 re-encode of the whole memo (about 100-350 ms of CPU per uncached memo),
+# far above the few milliseconds it may add. With it off, add_background_sound is ignored and TTS MP3 is sent as is.
+BACKGROUND_MIX_ENABLED = os.getenv("BACKGROUND_MIX_ENABLED", "false").strip().lower() in ("true", "1")
+AMBIENCE_FILE = os.getenv("AMBIENCE_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "fan.mp3"))
+# Mixing happens on 16-bit mono PCM at this rate. TTS is requested directly as pcm_<rate>,
+# so the voice never needs a decode either.
+MIX_SAMPLE_RATE = int(os.getenv("MIX_SAMPLE_RATE", "24000"))
+MIX_MP3_BITRATE = os.getenv("MIX_MP3_BITRATE", "128k")
+# LAME algorithm quality, 0 (slowest) - 9 (fastest). At 128k mono speech 7 is indistinguishable from the
+# default 3 and takes about half the CPU
+MIX_MP3_QUALITY = os.getenv("MIX_MP3_QUALITY", "7")
+# Decoded ambience shared by every worker through a memory-mapped .npy file
+AMBIENCE_PCM_CACHE = os.getenv(
+    "AMBIENCE_PCM_CACHE",
+    os.path.join(tempfile.gettempdir(), f"voicememos_ambience_{MIX_SAMPLE_RATE}.npy"),
+)
+
+
+class AmbienceMixer:
+    """Mixes a looping background ambience under TTS speech using a pre-decoded PCM buffer."""
+
+    def __init__(self, source_path=AMBIENCE_FILE, sample_rate=MIX_SAMPLE_RATE, cache_path=AMBIENCE_PCM_CACHE):
+        self.source_path = source_path
+        self.sample_rate = sample_rate
+        self.cache_path = cache_path
+        self.pcm = None  # int16 mono samples (np.memmap once loaded)
+        self._lock = threading.Lock()
+
+    @property
+    def output_format(self):
+        """ElevenLabs output_format that yields raw PCM ready to mix."""
+        return f"pcm_{self.sample_rate}"
+
+    @property
+    def ready(self):
+        return self.pcm is not None
+
+    def load(self):
+        """Decode the ambience once (or reuse another worker's decode) and memory-map it."""
+        with self._lock:
+            if self.pcm is not None:
+                return True
+            if av is None:
+                # Without the in-process encoder every mix would fail: serve the voice alone instead
+                print("Background ambience disabled: PyAV (av) is not installed")
+                return False
+            try:
+                if not self._cache_is_fresh():
+                    self._decode_to_cache()
+                self.pcm = np.load(self.cache_path, mmap_mode="r")
+                print(f"Background ambience loaded: {len(self.pcm) / self.sample_rate:.1f}s at {self.sample_rate} Hz from {self.cache_path}")
+                return True
+            except Exception as e:
+                print(f"Could not load background ambience {self.source_path}: {e}")
+                return False
+
+    def _cache_is_fresh(self):
+        try:
+            return os.path.getmtime(self.cache_path) >= os.path.getmtime(self.source_path)
+        except OSError:
+            return False
+
+    def _decode_to_cache(self):
+        # One pass straight to 16-bit mono PCM at the mixing rate
+        resampler = av.AudioResampler(format="s16", layout="mono", rate=self.sample_rate)
+        chunks = []
+        with av.open(self.source_path) as container:
+            for frame in container.decode(audio=0):
+                chunks += [resampled.to_ndarray().reshape(-1) for resampled in resampler.resample(frame)]
+        chunks += [resampled.to_ndarray().reshape(-1) for resampled in resampler.resample(None)]
+        samples = np.concatenate(chunks).astype(np.int16) if chunks else np.zeros(0, dtype=np.int16)
+
+        # Write to a temp file and rename so concurrent workers never map a half-written cache
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.cache_path) or ".", suffix=".npy")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, samples)
+            os.replace(tmp_path, self.cache_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def mix(self, voice_pcm, gain):
+        """Mix 16-bit mono PCM speech with the looping ambience at `gain` (0.0-1.0) and return int16 samples."""
+        voice = np.frombuffer(voice_pcm[:len(voice_pcm) - len(voice_pcm) % 2], dtype=np.int16)
+        if gain <= 0 or self.pcm is None or len(self.pcm) == 0:
+            return voice
+        mixed = voice.astype(np.float32)
+        bed = np.resize(self.pcm, len(voice))  # Loops the ambience to the speech length
+        mixed += bed.astype(np.float32) * float(gain)
+        np.clip(mixed, -32768, 32767, out=mixed)
+        return mixed.astype(np.int16)
+
+    def encode_mp3(self, samples):
+        """Encode int16 mono samples to MP3 (the single encode of the request), in-process with libmp3lame."""
+        out = io.BytesIO()
+        with av.open(out, "w", format="mp3") as container:
+            stream = container.add_stream("libmp3lame", rate=self.sample_rate, layout="mono",
+                                          options={"compression_level": MIX_MP3_QUALITY})
+            stream.bit_rate = _bitrate(MIX_MP3_BITRATE)
+            if len(samples):
+                frame = av.AudioFrame.from_ndarray(np.ascontiguousarray(samples, dtype=np.int16).reshape(1, -1),
+                                                   format="s16", layout="mono")
+                frame.sample_rate = self.sample_rate
+                for packet in stream.encode(frame):
+                    container.mux(packet)
+            for packet in stream.encode(None):
+                container.mux(packet)
+        return out.getvalue()
+
+
+def _bitrate(value):
+    """'128k' -> 128000"""
+    value = str(value).strip().lower()
+    return int(float(value[:-1]) * 1000) if value.endswith("k") else int(value)
@@ -0,0 +1,211 @@
+import os
+import re
+import json
+import time
+import hashlib
+import secrets
+import tempfile
+import threading
+
+ARTIFACTS_ENABLED = os.getenv("ARTIFACTS_ENABLED", "true").strip().lower() in ("true", "1")
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", os.path.join(tempfile.gettempdir(), "voicememos_artifacts"))
+ARTIFACT_TTL_SECONDS = int(os.getenv("ARTIFACT_TTL_SECONDS", str(24 * 3600)))
+ARTIFACT_GC_INTERVAL_SECONDS = int(os.getenv("ARTIFACT_GC_INTERVAL_SECONDS", "600"))
+
+AUDIO_SUFFIX = ".mp3"
+META_SUFFIX = ".json"
+TMP_SUFFIX = ".tmp"
+ARTIFACT_ID_RE = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+
+
+def _write_atomic(directory, path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=TMP_SUFFIX)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class ArtifactWriter:
+    """Collects a streamed artifact chunk by chunk; nothing is visible until commit()."""
+
+    def __init__(self, store, artifact_id, owner_id, mimetype):
+        self.store = store
+        self.artifact_id = artifact_id
+        self.owner_id = owner_id
+        self.mimetype = mimetype
+        self.size = 0
+        self._digest = hashlib.sha256()
+        fd, self._tmp_path = tempfile.mkstemp(dir=store.directory, suffix=TMP_SUFFIX)
+        self._file = os.fdopen(fd, "wb")
+        self.closed = False
+
+    def write(self, chunk):
+        self._file.write(chunk)
+        self._digest.update(chunk)
+        self.size += len(chunk)
+
+    def commit(self):
+        """Publish the artifact and return its metadata (None if nothing was written)."""
+        if self.closed:
+            return None
+        self.closed = True
+        self._file.close()
+        if not self.size:
+            self._discard()
+            return None
+        os.replace(self._tmp_path, self.store.audio_path(self.artifact_id))
+        return self.store._write_meta(self.artifact_id, self.owner_id, self._digest.hexdigest(), self.size, self.mimetype)
+
+    def abort(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._file.close()
+        self._discard()
+
+    def _discard(self):
+        try:
+            os.remove(self._tmp_path)
+        except OSError:
+            pass
+
+
+class ArtifactStore:
+    """Generated audio kept on disk for a while under an opaque ID so clients can fetch it again.
+
+    Each artifact is an audio file plus a JSON sidecar (owner, ETag, expiry) in a directory that
+    every worker process shares. A background collector deletes expired artifacts and abandoned
+    temporary files.
+    """
+
+    def __init__(self, directory=ARTIFACT_DIR, ttl_seconds=ARTIFACT_TTL_SECONDS):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.saved = 0
+        self.collected = 0
+        self._lock = threading.Lock()
+        self._gc_thread = None
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def new_id():
+        return secrets.token_urlsafe(18)
+
+    @staticmethod
+    def is_valid_id(artifact_id):
+        return bool(artifact_id and ARTIFACT_ID_RE.match(artifact_id))
+
+    def audio_path(self, artifact_id):
+        return os.path.join(self.directory, artifact_id + AUDIO_SUFFIX)
+
+    def _meta_path(self, artifact_id):
+        return os.path.join(self.directory, artifact_id + META_SUFFIX)
+
+    def _write_meta(self, artifact_id, owner_id, etag, size, mimetype):
+        now = time.time()
+        meta = {
+            "id": artifact_id,
+            "owner": str(owner_id),
+            "etag": etag,
+            "size": size,
+            "mimetype": mimetype,
+            "created_at": now,
+            "expires_at": now + self.ttl_seconds,
+        }
+        # The sidecar is written last: an artifact exists once its metadata does
+        _write_atomic(self.directory, self._meta_path(artifact_id), json.dumps(meta).encode("utf-8"))
+        with self._lock:
+            self.saved += 1
+        return meta
+
+    def save(self, owner_id, data, artifact_id=None, mimetype="audio/mpeg"):
+        """Store complete audio bytes and return the artifact metadata."""
+        artifact_id = artifact_id or self.new_id()
+        _write_atomic(self.directory, self.audio_path(artifact_id), data)
+        return self._write_meta(artifact_id, owner_id, hashlib.sha256(data).hexdigest(), len(data), mimetype)
+
+    def writer(self, owner_id, artifact_id=None, mimetype="audio/mpeg"):
+        """Start a streamed artifact whose ID is known before any audio exists (for response headers)."""
+        return ArtifactWriter(self, artifact_id or self.new_id(), owner_id, mimetype)
+
+    def get(self, artifact_id):
+        """Metadata of a live artifact, or None if unknown or expired."""
+        if not self.is_valid_id(artifact_id):
+            return None
+        try:
+            with open(self._meta_path(artifact_id), "rb") as f:
+                meta = json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+        if meta.get("expires_at", 0) <= time.time() or not os.path.exists(self.audio_path(artifact_id)):
+            return None
+        return meta
+
+    def delete(self, artifact_id):
+        for path in (self._meta_path(artifact_id), self.audio_path(artifact_id)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def collect_garbage(self, now=None):
+        """Delete expired artifacts, orphaned audio files and stale temp files. Returns how many were removed."""
+        now = now or time.time()
+        removed = 0
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return 0
+        for name in names:
+            path = os.path.join(self.directory, name)
+            artifact_id, suffix = os.path.splitext(name)
+            try:
+                if suffix == META_SUFFIX:
+                    with open(path, "rb") as f:
+                        expires_at = json.loads(f.read()).get("expires_at", 0)
+                    if expires_at <= now:
+                        self.delete(artifact_id)
+                        removed += 1
+                elif suffix in (AUDIO_SUFFIX, TMP_SUFFIX):
+                    # Audio without metadata (crash between the two writes) or abandoned partial writes
+                    if os.path.getmtime(path) + self.ttl_seconds <= now and not os.path.exists(self._meta_path(artifact_id)):
+                        os.remove(path)
+                        removed += 1
+            except (OSError, ValueError):
+                continue  # Removed concurrently by another worker, or half-written
+        with self._lock:
+            self.collected += removed
+        return removed
+
+    def start_gc(self, interval_seconds=ARTIFACT_GC_INTERVAL_SECONDS):
+        """Run collect_garbage every `interval_seconds` in a daemon thread (once per process)."""
+        def run():
+            while True:
+                time.sleep(interval_seconds)
+                try:
+                    removed = self.collect_garbage()
+                    if removed:
+                        print(f"Artifact GC removed {removed} expired files from {self.directory}")
+                except Exception as e:
+                    print(f"Artifact GC failed: {e}")
+
+        with self._lock:
+            if self._gc_thread is None or not self._gc_thread.is_alive():
+                self._gc_thread = threading.Thread(target=run, name="artifact-gc", daemon=True)
+                self._gc_thread.start()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "directory": self.directory,
+                "ttl_seconds": self.ttl_seconds,
+                "saved": self.saved,
+                "collected": self.collected,
+            }
@@ -0,0 +1,104 @@
+"""Login hashing benchmark: bcrypt inline on request threads vs the bounded process pool.
+
+Simulates a login burst (many threads calling check()) while a probe thread runs the
+small CPU work a generation request does between upstream calls, and reports login
+throughput, rejected logins and the probe's latency percentiles for each mode.
+
+    python bench/bcrypt_login.py --logins 200 --threads 32 --rounds 12
+"""
+import os
+import sys
+import json
+import argparse
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from password_hashing import PasswordHasher, PasswordHasherBusy, _hash_password  # noqa: E402
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def probe(stop, latencies):
+    """Stand-in for generation work: build a prompt, serialize a payload, sleep like an upstream wait."""
+    while not stop.is_set():
+        started = time.perf_counter()
+        prompt = " ".join(f"word{i}" for i in range(2000))
+        json.dumps({"text": prompt, "voice_settings": {"stability": 0.7, "similarity_boost": 0.85}})
+        latencies.append((time.perf_counter() - started) * 1000)
+        time.sleep(0.005)
+
+
+def run_mode(name, hasher, stored_hash, args):
+    remaining = [args.logins]
+    lock = threading.Lock()
+    counts = {"ok": 0, "rejected": 0}
+
+    def login_worker():
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            try:
+                hasher.check(args.password, stored_hash)
+                with lock:
+                    counts["ok"] += 1
+            except PasswordHasherBusy:
+                with lock:
+                    counts["rejected"] += 1
+
+    # Baseline probe latency with nothing else running
+    baseline, stop = [], threading.Event()
+    t = threading.Thread(target=probe, args=(stop, baseline))
+    t.start()
+    time.sleep(1.0)
+    stop.set()
+    t.join()
+
+    hasher.check(args.password, stored_hash)  # Start the pool outside the measurement
+
+    latencies, stop = [], threading.Event()
+    probe_thread = threading.Thread(target=probe, args=(stop, latencies))
+    probe_thread.start()
+    workers = [threading.Thread(target=login_worker) for _ in range(args.threads)]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    probe_thread.join()
+
+    print(f"[{name}] {counts['ok']} logins in {elapsed:.2f}s ({counts['ok'] / elapsed:.1f}/s), {counts['rejected']} rejected")
+    print(f"[{name}] generation probe ms  idle p50={percentile(baseline, 50):.2f} p99={percentile(baseline, 99):.2f}"
+          f"  under load p50={percentile(latencies, 50):.2f} p95={percentile(latencies, 95):.2f}"
+          f" p99={percentile(latencies, 99):.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=32, help="Concurrent login requests")
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost factor")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1), help="Hashing processes")
+    parser.add_argument("--max-queue", type=int, default=64)
+    parser.add_argument("--password", default="correct horse battery staple")
+    args = parser.parse_args()
+
+    stored_hash = _hash_password(args.password.encode("utf-8"), args.rounds)
+    print(f"bcrypt cost {args.rounds}, {args.logins} logins from {args.threads} threads, {os.cpu_count()} CPUs")
+
+    run_mode("inline", PasswordHasher(rounds=args.rounds, workers=0, max_queue=args.threads), stored_hash, args)
+    run_mode(f"pool x{args.workers}", PasswordHasher(rounds=args.rounds, workers=args.workers, max_queue=args.max_queue),
+             stored_hash, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Content filter benchmark: the old per-substring scan vs the compiled ContentFilter.
+
+Measures checks per second and MB/s on short inputs (topic + value) and on memo-length generated
+texts, and lists the innocent words each implementation flags.
+
+    python bench/content_filter_throughput.py --seconds 2
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from content_filter import ContentFilter  # noqa: E402
+
+LEGACY_PATTERNS = [
+    'sex', 'porn', 'nude', 'naked', 'xxx', 'dildo', 'vibrator', 'nsfw',
+    'fuck', 'shit', 'ass', 'dick', 'cock', 'pussy', 'cunt', 'whore',
+    'bitch', 'slut', 'horny', 'masturbat', 'orgas', 'nazi', 'kill',
+    'murder', 'suicide', 'rape', 'racist', 'n-word', 'nigger'
+]
+
+INNOCENT = ["class", "skill", "Scunthorpe", "cocktail", "assistant", "grape", "Sussex", "Dickens",
+            "passion", "analysis", "therapist", "Essex", "compass", "document", "shiitake", "cassette"]
+
+INPUTS = [("movies", "Titanic"), ("phobias", "spiders"), ("food", "sushi"), ("places", "Lisbon"),
+          ("películas", "El laberinto del fauno"), ("lieux", "Montréal"), ("Musik", "Straßenmusik"),
+          ("music", "jazz"), ("classes", "skill building"), ("colors", "turquoise")]
+
+MEMOS = {
+    "en": "Okay, so... I was brushing my teeth and suddenly remembered this weird dream about {value}. "
+          "Someone kept talking about it, like it was really important. No idea why it came back to me.",
+    "es": "Okay, entonces... estaba ya vistiéndome y me vino esta imagen rarísima de {value}, alguien "
+          "hablaba de eso y se ponía súper nervioso. No sé qué fue eso, la verdad.",
+    "fr": "J'étais prêt à sortir et là, paf, j'me souviens d'un truc dans mon rêve à propos de {value}. "
+          "C'est revenu d'un coup, bizarre.",
+    "de": "Ich war schon fertig im Bad und plötzlich kam so ein Bild aus dem Traum hoch, irgendwas mit "
+          "{value}. Ganz seltsam, keine Ahnung warum.",
+}
+
+
+def legacy_is_likely_inappropriate(text):
+    if not text:
+        return False
+    text = text.lower()
+    return any(pattern in text for pattern in LEGACY_PATTERNS)
+
+
+def measure(label, check, samples, seconds):
+    total_bytes = sum(len(text.encode("utf-8")) for text, _ in samples)
+    runs = 0
+    started = time.perf_counter()
+    deadline = started + seconds
+    while time.perf_counter() < deadline:
+        for text, language in samples:
+            check(text, language)
+        runs += 1
+    elapsed = time.perf_counter() - started
+    checks = runs * len(samples)
+    print(f"  {label:<10} {checks / elapsed:>12,.0f} checks/s {runs * total_bytes / elapsed / 1e6:>8.1f} MB/s "
+          f"{elapsed / checks * 1e6:>8.2f} us/check")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=2.0, help="Time per measurement")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    content_filter = ContentFilter()
+    print(f"Compiled {content_filter.term_count} terms for {', '.join(content_filter.languages)} "
+          f"in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    random.seed(1)
+    short = [(f"{topic}\n{value}", random.choice(list(MEMOS))) for topic, value in INPUTS]
+    memos = [(MEMOS[language].format(value=value), language) for _, value in INPUTS for language in MEMOS]
+
+    def legacy(text, language):
+        return legacy_is_likely_inappropriate(text)
+
+    for name, samples in (("topic + value", short), ("generated memo", memos)):
+        avg = sum(len(text) for text, _ in samples) / len(samples)
+        print(f"{name} ({len(samples)} samples, {avg:.0f} chars on average)")
+        measure("legacy", legacy, samples, args.seconds)
+        measure("compiled", content_filter.is_flagged, samples, args.seconds)
+
+    print("Innocent words flagged:")
+    print(f"  legacy:   {[word for word in INNOCENT if legacy_is_likely_inappropriate(word)]}")
+    print(f"  compiled: {[word for word in INNOCENT if content_filter.is_flagged(word, 'en')]}")
+    print("Evasions caught (legacy / compiled):")
+    for text, language in [("sh1t", "en"), ("$hit", "en"), ("a$$hole", "en"), ("Hijo de PUTA", "es"),
+                           ("violación", "es"), ("Scheiße", "de"), ("f u c k", "en")]:
+        print(f"  {text!r:<16} {legacy_is_likely_inappropriate(text)!s:<6} {content_filter.is_flagged(text, language)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""Local stand-in for the ElevenLabs and Gemini APIs, for tests and benchmarks without real accounts.
+
+    python bench/fake_upstream.py --port 18555 --clone-seconds 5
+    ELEVENLABS_API_BASE=http://127.0.0.1:18555 ELEVEN_LABS_API_KEY=fake \
+    GEMINI_API_ENDPOINT=http://127.0.0.1:18555 GOOGLE_API_KEY=fake MONGO_URI=mongomock:// python main.py
+
+Implements the ElevenLabs endpoints the backend uses: GET /v1/voices, GET /v1/models,
+POST /v1/text-to-speech/<voice_id>[/stream] (MP3, or raw PCM when output_format=pcm_*),
+POST /v1/voices/add (plain or chunked multipart) and DELETE /v1/voices/<voice_id>; and the
+Gemini REST calls POST /v1beta/models/<model>:generateContent and :streamGenerateContent.
+Latencies and failure rates are configurable so the server can mimic a slow or flaky upstream.
+"""
+import os
+import sys
+import json
+import time
+import random
+import re
+import argparse
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# One silent MPEG-1 Layer III frame (128 kbps, 44.1 kHz): 417 bytes, ~26 ms of audio
+MP3_FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413
+MP3_FRAMES_PER_CHAR = 2
+
+# Gemini answers are assembled from these so consecutive memos differ (like the real model, and unlike a
+# fixed string that the TTS cache would serve after the first request)
+MEMO_OPENINGS = ["Okay, so...", "Hmm, okay...", "So, weird thing...", "Okay, this is random..."]
+MEMO_MIDDLES = [
+    "I was brushing my teeth and suddenly remembered a dream about {value}.",
+    "I had this strange passing thought about {value} while making coffee.",
+    "someone in my dream kept talking about {value}, like it was really important.",
+    "I woke up with {value} stuck in my head and I have no idea why.",
+]
+MEMO_ENDINGS = ["No idea why it came back to me.", "Kinda funny, honestly.", "Anyway, it felt oddly specific.",
+                "I don't know, it just stuck with me.", "Weird way to start the day."]
+VALUE_RE = re.compile(r"\*\*\((.+?)\)\*\*")
+
+
+class FakeElevenLabs(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    options = None  # argparse namespace, set by serve()
+    stats = {"tts": 0, "clones": 0, "deletes": 0, "gemini": 0, "failures": 0}
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        if self.options.verbose:
+            super().log_message(format, *args)
+
+    def _count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def _should_fail(self, rate):
+        if rate > 0 and random.random() < rate:
+            self._count("failures")
+            return True
+        return False
+
+    def _read_body(self):
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            body = bytearray()
+            while True:
+                size = int(self.rfile.readline().split(b";")[0].strip() or b"0", 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return bytes(body)
+                body += self.rfile.read(size)
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _send(self, status, body, content_type="application/json", chunk_size=None, chunk_delay=0.0):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        if chunk_size:
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i in range(0, len(body), chunk_size):
+                chunk = body[i:i + chunk_size]
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                self.wfile.flush()
+                time.sleep(chunk_delay)
+            self.wfile.write(b"0\r\n\r\n")
+        else:
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/v1/voices":
+            return self._send(200, {"voices": [{"name": "Alex Latorre", "voice_id": "fake-alex", "category": "cloned"}]})
+        if path == "/v1/models":
+            return self._send(200, [{"model_id": "eleven_turbo_v2_5", "name": "Eleven Turbo v2.5"}])
+        self._send(404, {"detail": "Not found"})
+
+    def do_DELETE(self):
+        self._count("deletes")
+        if urlparse(self.path).path.startswith("/v1/voices/"):
+            return self._send(200, {"status": "ok"})
+        self._send(404, {"detail": "Not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self._read_body()
+        if url.path.startswith("/v1/text-to-speech/"):
+            return self._tts(url, body)
+        if url.path.startswith("/v1beta/models/"):
+            return self._gemini(url, body)
+        if url.path == "/v1/voices/add":
+            self._count("clones")
+            time.sleep(self.options.clone_seconds)
+            if self._should_fail(self.options.failure_rate):
+                return self._send(500, {"detail": "Fake upstream failure"})
+            if b'name="files"' not in body:
+                return self._send(400, {"detail": "Missing files"})
+            return self._send(200, {"voice_id": f"fake-{uuid.uuid4().hex[:12]}"})
+        self._send(404, {"detail": "Not found"})
+
+    def _tts(self, url, body):
+        self._count("tts")
+        payload = json.loads(body or b"{}")
+        text = payload.get("text", "")
+        if "FAIL" in text:
+            return self._send(422, {"detail": "Fake TTS failure requested"})
+        time.sleep(self.options.tts_first_byte_ms / 1000)
+        if self._should_fail(self.options.failure_rate):
+            return self._send(500, {"detail": "Fake upstream failure"})
+        output_format = parse_qs(url.query).get("output_format", ["mp3_44100_128"])[0]
+        if output_format.startswith("pcm_"):
+            rate = int(output_format.split("_")[1])
+            seconds = max(1.0, len(text) / 15)
+            return self._send(200, os.urandom(int(rate * seconds) * 2), "audio/pcm")
+        audio = MP3_FRAME * (MP3_FRAMES_PER_CHAR * max(1, len(text)))
+        if url.path.endswith("/stream"):
+            return self._send(200, audio, "audio/mpeg", chunk_size=4096, chunk_delay=self.options.stream_chunk_ms / 1000)
+        self._send(200, audio, "audio/mpeg")
+
+    def _gemini(self, url, body):
+        self._count("gemini")
+        payload = json.loads(body or b"{}")
+        prompt = " ".join(part.get("text", "") for content in payload.get("contents", []) for part in content.get("parts", []))
+        match = VALUE_RE.search(prompt)
+        value = match.group(1) if match else "something"
+        text = " ".join([random.choice(MEMO_OPENINGS), random.choice(MEMO_MIDDLES).format(value=value), random.choice(MEMO_ENDINGS)])
+
+        if self._should_fail(self.options.gemini_failure_rate):
+            time.sleep(self.options.gemini_ms / 1000)
+            return self._send(503, {"error": {"code": 503, "message": "Fake Gemini failure", "status": "UNAVAILABLE"}})
+
+        def response(chunk_text, finished=True):
+            candidate = {"content": {"parts": [{"text": chunk_text}], "role": "model"}, "index": 0}
+            if finished:
+                candidate["finishReason"] = "STOP"
+            return {"candidates": [candidate]}
+
+        if url.path.endswith(":streamGenerateContent"):
+            # A JSON array streamed element by element, as the REST API does without alt=sse
+            words = text.split(" ")
+            step = max(1, len(words) // 4)
+            pieces = [" ".join(words[i:i + step]) + " " for i in range(0, len(words), step)]
+            delay = self.options.gemini_ms / 1000 / len(pieces)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i, piece in enumerate(pieces):
+                time.sleep(delay)
+                element = ("[" if i == 0 else ",") + json.dumps(response(piece, finished=i == len(pieces) - 1))
+                chunk = element.encode("utf-8")
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                self.wfile.flush()
+            self.wfile.write(b"1\r\n]\r\n0\r\n\r\n")
+            return
+        time.sleep(self.options.gemini_ms / 1000)
+        self._send(200, response(text))
+
+
+def serve(options):
+    FakeElevenLabs.options = options
+    server = ThreadingHTTPServer((options.host, options.port), FakeElevenLabs)
+    server.daemon_threads = True
+    return server
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18555)
+    parser.add_argument("--tts-first-byte-ms", type=float, default=300, help="Delay before TTS audio starts")
+    parser.add_argument("--stream-chunk-ms", type=float, default=5, help="Delay between streamed TTS chunks")
+    parser.add_argument("--clone-seconds", type=float, default=3, help="Time /v1/voices/add takes to answer")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of TTS and clone calls answered with 500")
+    parser.add_argument("--gemini-ms", type=float, default=600, help="Time Gemini takes to produce the whole text")
+    parser.add_argument("--gemini-failure-rate", type=float, default=0.0, help="Fraction of Gemini calls answered with 503")
+    parser.add_argument("--verbose", action="store_true")
+    return parser
+
+
+def main(argv=None):
+    options = build_parser().parse_args(argv)
+
+    server = serve(options)
+    print(f"Fake ElevenLabs + Gemini listening on http://{options.host}:{options.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f"Requests served: {FakeElevenLabs.stats}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,284 @@
+"""Load test: replays a mix of /login, /me, /character-usage and /generate-audio-cloned and reports
+throughput and p50/p95/p99 latency per endpoint.
+
+Offline by default: bench/fake_upstream.py (ElevenLabs + Gemini stand-in) runs in a thread and the
+backend is imported in this process on an in-memory database (MONGO_URI=mongomock://), served by
+werkzeug's threaded server. Nothing leaves the machine.
+
+    python bench/load_test.py --duration 30 --concurrency 16 --mix login=1,me=5,usage=3,generate=1
+
+To measure a real deployment shape (gunicorn, several workers), start the server yourself pointed at
+the fake upstream and a real MongoDB, and give the driver the same database so it can mint
+activation codes:
+
+    python bench/fake_upstream.py --port 18555 &
+    ELEVENLABS_API_BASE=http://127.0.0.1:18555 GEMINI_API_ENDPOINT=http://127.0.0.1:18555 \\
+        ELEVEN_LABS_API_KEY=fake GOOGLE_API_KEY=fake EMAIL_CHECK_DELIVERABILITY=false \\
+        MONTHLY_CHAR_LIMIT=100000000 gunicorn -c gunicorn.conf.py main:app &
+    python bench/load_test.py --target http://127.0.0.1:5002 --mongo-uri mongodb://localhost:27017/
+
+"login" logs the worker's user out and back in (the backend allows one session per user), "generate"
+reads the whole MP3. Each driver thread has its own user, registered through /register at start-up.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import logging
+import tempfile
+import threading
+
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MIX = "login=1,me=5,usage=3,generate=1"
+OPERATIONS = ("login", "me", "usage", "generate")
+PASSWORD = "load-test-password"
+TOPICS = [("movies", "Titanic"), ("phobias", "spiders"), ("food", "sushi"), ("places", "Lisbon"),
+          ("animals", "octopus"), ("music", "jazz"), ("sports", "tennis"), ("colors", "turquoise")]
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def parse_mix(text):
+    weights = {}
+    for entry in text.split(","):
+        name, _, weight = entry.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Unknown operation '{name}' (expected one of {', '.join(OPERATIONS)})")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def start_offline_backend(args):
+    """Fake upstream + in-process backend on mongomock. Returns (base_url, activation codes collection)."""
+    import fake_upstream
+    upstream = fake_upstream.serve(fake_upstream.build_parser().parse_args([
+        "--port", "0",
+        "--tts-first-byte-ms", str(args.tts_ms),
+        "--gemini-ms", str(args.gemini_ms),
+        "--failure-rate", str(args.failure_rate),
+    ]))
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+    upstream_url = f"http://127.0.0.1:{upstream.server_address[1]}"
+
+    # The backend reads its configuration at import time
+    os.environ.update({
+        "ELEVEN_LABS_API_KEY": "fake",
+        "ELEVENLABS_API_BASE": upstream_url,
+        "GOOGLE_API_KEY": "fake",
+        "GEMINI_API_ENDPOINT": upstream_url,
+        "MONGO_URI": "mongomock://",
+        "EMAIL_CHECK_DELIVERABILITY": "false",
+        "MONTHLY_CHAR_LIMIT": str(10 ** 9),
+        "BCRYPT_ROUNDS": str(args.bcrypt_rounds),
+        "TTS_CACHE_DIR": tempfile.mkdtemp(prefix="voicememos_bench_tts_"),
+        "ARTIFACT_DIR": tempfile.mkdtemp(prefix="voicememos_bench_artifacts_"),
+        # Every simulated client comes from 127.0.0.1, so the per-IP limits would throttle the whole run
+        "ADMISSION_ENABLED": "true" if args.admission else "false",
+    })
+    os.chdir(BACKEND_DIR)
+    # The backend logs with print(); keep its output out of the report
+    print(f"Backend output goes to {args.server_log}")
+    sys.stdout = open(args.server_log, "w", buffering=1)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    import main
+    from werkzeug.serving import make_server
+
+    server = make_server("127.0.0.1", 0, main.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}", main.activation_codes_collection
+
+
+class Worker(threading.Thread):
+    """One simulated client: its own user, session and token."""
+
+    def __init__(self, base_url, username, weights, deadline, results, lock):
+        super().__init__(daemon=True)
+        self.base_url = base_url
+        self.username = username
+        self.operations = list(weights)
+        self.weights = [weights[name] for name in self.operations]
+        self.deadline = deadline
+        self.results = results
+        self.lock = lock
+        self.session = requests.Session()
+        self.token = None
+
+    def call(self, method, path, **kwargs):
+        headers = {"Authorization": f"Bearer {self.token}"} if self.token else {}
+        return self.session.request(method, self.base_url + path, headers=headers, timeout=120, **kwargs)
+
+    def login(self):
+        resp = self.call("POST", "/login", json={"email": self.username, "password": PASSWORD})
+        if resp.status_code == 200:
+            self.token = resp.json()["token"]
+        return resp
+
+    def run_operation(self, name):
+        if name == "login":
+            self.call("POST", "/logout")
+            started = time.perf_counter()
+            resp = self.login()
+        elif name == "me":
+            started = time.perf_counter()
+            resp = self.call("GET", "/me")
+        elif name == "usage":
+            started = time.perf_counter()
+            resp = self.call("GET", "/character-usage")
+        else:
+            topic, value = random.choice(TOPICS)
+            started = time.perf_counter()
+            resp = self.call("POST", "/generate-audio-cloned", json={"topic": topic, "value": value})
+            resp.content  # Whole MP3, as the app waits for it
+        return resp.status_code, time.perf_counter() - started
+
+    def run(self):
+        while time.monotonic() < self.deadline:
+            name = random.choices(self.operations, self.weights)[0]
+            try:
+                status, seconds = self.run_operation(name)
+            except requests.RequestException as e:
+                status, seconds = f"error:{e.__class__.__name__}", 0.0
+            with self.lock:
+                self.results.append((name, status, seconds))
+
+
+def register_users(base_url, codes, count):
+    usernames = []
+    for i in range(count):
+        username = f"load{os.getpid()}_{i}"
+        resp = requests.post(f"{base_url}/register", json={
+            "username": username, "email": f"{username}@example.com", "password": PASSWORD, "activation_code": codes[i],
+        }, timeout=60)
+        if resp.status_code != 201:
+            raise RuntimeError(f"Could not register {username}: {resp.status_code} {resp.text}")
+        usernames.append(username)
+    return usernames
+
+
+def fetch_stage_means(base_url):
+    """Mean per stage from the server's /metrics (under gunicorn, only the worker that answers the scrape)."""
+    try:
+        text = requests.get(f"{base_url}/metrics", timeout=10).text
+    except requests.RequestException:
+        return {}
+    sums, counts = {}, {}
+    for line in text.splitlines():
+        if line.startswith("voicememos_stage_duration_seconds_sum") or line.startswith("voicememos_stage_duration_seconds_count"):
+            name, value = line.rsplit(" ", 1)
+            stage = name.split('stage="', 1)[1].split('"', 1)[0]
+            (sums if "_sum" in name else counts)[stage] = float(value)
+    return {stage: sums[stage] / counts[stage] for stage in sums if counts.get(stage)}
+
+
+def report(results, elapsed, concurrency, print=print):
+    summary = {}
+    print(f"\n{len(results)} requests in {elapsed:.1f}s from {concurrency} clients")
+    print(f"{'operation':<10} {'count':>7} {'errors':>7} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name in OPERATIONS + ("all",):
+        rows = [r for r in results if name == "all" or r[0] == name]
+        if not rows:
+            continue
+        ok = [seconds * 1000 for _, status, seconds in rows if isinstance(status, int) and status < 400]
+        errors = len(rows) - len(ok)
+        entry = {
+            "count": len(rows), "errors": errors, "rps": len(rows) / elapsed,
+            "p50_ms": percentile(ok, 50), "p95_ms": percentile(ok, 95), "p99_ms": percentile(ok, 99),
+            "max_ms": max(ok) if ok else 0.0,
+        }
+        summary[name] = entry
+        print(f"{name:<10} {entry['count']:>7} {errors:>7} {entry['rps']:>8.1f} {entry['p50_ms']:>9.1f} "
+              f"{entry['p95_ms']:>9.1f} {entry['p99_ms']:>9.1f} {entry['max_ms']:>9.1f}")
+    failures = {}
+    for name, status, _ in results:
+        if not (isinstance(status, int) and status < 400):
+            failures[f"{name} {status}"] = failures.get(f"{name} {status}", 0) + 1
+    if failures:
+        print("Errors: " + ", ".join(f"{key} x{count}" for key, count in sorted(failures.items())))
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", help="Base URL of a running backend (default: start one in-process, offline)")
+    parser.add_argument("--mongo-uri", default=os.getenv("MONGO_URI"), help="Database of --target, to mint activation codes")
+    parser.add_argument("--concurrency", type=int, default=16, help="Simulated clients (one user each)")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of load after the warm-up")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f"Operation weights (default {DEFAULT_MIX})")
+    parser.add_argument("--tts-ms", type=float, default=300, help="Offline mode: fake TTS time to first byte")
+    parser.add_argument("--gemini-ms", type=float, default=600, help="Offline mode: fake Gemini generation time")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Offline mode: fraction of failing TTS calls")
+    parser.add_argument("--admission", action="store_true", help="Offline mode: keep rate limits and load shedding on")
+    parser.add_argument("--bcrypt-rounds", type=int, default=10, help="Offline mode: bcrypt cost for the test users")
+    parser.add_argument("--server-log", default=os.path.join(tempfile.gettempdir(), "voicememos_load_test_server.log"),
+                        help="Offline mode: where the in-process backend's output goes")
+    parser.add_argument("--json", dest="json_path", help="Also write the summary as JSON to this file")
+    args = parser.parse_args(argv)
+    console = sys.stdout
+
+    def out(*values):
+        print(*values, file=console, flush=True)
+
+    if args.target:
+        if not args.mongo_uri:
+            parser.error("--target needs --mongo-uri (or MONGO_URI) to create activation codes")
+        from activation_codes_cli import get_activation_codes_collection
+        _, codes_collection = get_activation_codes_collection(args.mongo_uri)
+        base_url = args.target.rstrip("/")
+    else:
+        base_url, codes_collection = start_offline_backend(args)
+
+    from activation_codes_cli import mint_codes
+    label = f"load-test-{os.getpid()}-{int(time.time())}"
+    mint_codes(codes_collection, args.concurrency, label=label)
+    codes = [doc["code"] for doc in codes_collection.find({"batch": label}, {"code": 1})]
+
+    for _ in range(100):
+        try:
+            if requests.get(f"{base_url}/ready", timeout=5).status_code == 200:
+                break
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+
+    out(f"Registering {args.concurrency} users on {base_url}")
+    usernames = register_users(base_url, codes, args.concurrency)
+
+    results, lock = [], threading.Lock()
+    deadline = time.monotonic() + args.duration
+    workers = [Worker(base_url, username, args.mix, deadline, results, lock) for username in usernames]
+    for worker in workers:
+        worker.login()
+    out(f"Running {args.duration:.0f}s with mix {args.mix}")
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    summary = report(results, elapsed, args.concurrency, print=out)
+    stage_means = fetch_stage_means(base_url)
+    if stage_means:
+        out("Server stage means (ms): " + ", ".join(f"{stage}={seconds * 1000:.1f}" for stage, seconds in sorted(stage_means.items())))
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"elapsed_seconds": elapsed, "concurrency": args.concurrency, "mix": args.mix,
+                       "operations": summary, "server_stage_means_seconds": stage_means}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
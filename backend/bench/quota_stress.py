@@ -0,0 +1,111 @@
+"""Multithreaded stress test for the monthly character quota (quota.py).
+
+Hammers one user's ledger entry from many threads and checks that no charge is lost and
+that the limit is never overshot by more than one charge. Needs a real MongoDB
+(MONGO_URI or --uri); it works in a scratch database that is dropped at the end.
+In-memory fakes such as mongomock do not make updates atomic across threads and
+will report lost updates for reasons unrelated to this code.
+
+    python bench/quota_stress.py --threads 32 --charges 200
+"""
+import os
+import sys
+import argparse
+import threading
+import time
+
+import certifi
+from dotenv import load_dotenv
+from pymongo import MongoClient
+from bson import ObjectId
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from quota import MONTHLY_CHAR_LIMIT, charge_characters, ensure_indexes, month_key, usage_for  # noqa: E402
+
+
+def run_threads(threads, target):
+    workers = [threading.Thread(target=target) for _ in range(threads)]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return time.perf_counter() - started
+
+
+def legacy_charge(ledger, user_id, chars):
+    """A read-modify-write for comparison: read the count, then $set old + new."""
+    used = usage_for(ledger, user_id)
+    ledger.update_one({"user_id": user_id, "month": month_key()}, {"$set": {"chars": used + chars}}, upsert=True)
+
+
+def check_no_lost_updates(ledger, threads, charges, chars, legacy=False):
+    # No entry yet: the first charges of all threads race to create it
+    user_id = ObjectId()
+
+    def worker():
+        for _ in range(charges):
+            if legacy:
+                legacy_charge(ledger, user_id, chars)
+            else:
+                charge_characters(ledger, user_id, chars, enforce_limit=False)
+
+    elapsed = run_threads(threads, worker)
+    expected = threads * charges * chars
+    actual = usage_for(ledger, user_id)
+    label = "legacy read-modify-write" if legacy else "atomic charge"
+    print(f"[{label}] {threads * charges} charges in {elapsed:.2f}s "
+          f"({threads * charges / elapsed:.0f}/s): expected {expected}, stored {actual}, lost {expected - actual}")
+    return actual == expected
+
+
+def check_limit_enforced(ledger, threads, chars):
+    # A full previous month must not count against this one
+    user_id = ObjectId()
+    ledger.insert_one({"user_id": user_id, "month": "2000-01", "chars": MONTHLY_CHAR_LIMIT})
+    granted = []
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            ok, _, _, _ = charge_characters(ledger, user_id, chars)
+            if not ok:
+                return
+            with lock:
+                granted.append(chars)
+
+    run_threads(threads, worker)
+    stored = usage_for(ledger, user_id)
+    ok = stored == sum(granted) and MONTHLY_CHAR_LIMIT <= stored < MONTHLY_CHAR_LIMIT + chars
+    print(f"[limit] {len(granted)} charges granted, stored {stored}, limit {MONTHLY_CHAR_LIMIT} "
+          f"(max allowed {MONTHLY_CHAR_LIMIT + chars - 1}) -> {'OK' if ok else 'FAILED'}")
+    return ok
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default=os.getenv("MONGO_URI", "mongodb://localhost:27017/"))
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--charges", type=int, default=100, help="charges per thread")
+    parser.add_argument("--chars", type=int, default=7, help="characters per charge")
+    parser.add_argument("--legacy", action="store_true", help="also run the old read-modify-write for comparison")
+    args = parser.parse_args()
+
+    client = MongoClient(args.uri, tlsCAFile=certifi.where())
+    db_name = f"voicememos_quota_stress_{os.getpid()}"
+    ledger = client[db_name].usage_ledger
+    try:
+        ensure_indexes(ledger)
+        ok = check_no_lost_updates(ledger, args.threads, args.charges, args.chars)
+        ok = check_limit_enforced(ledger, args.threads, args.chars) and ok
+        if args.legacy:
+            check_no_lost_updates(ledger, args.threads, args.charges, args.chars, legacy=True)
+    finally:
+        client.drop_database(db_name)
+        client.close()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
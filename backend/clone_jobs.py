@@ -0,0 +1,220 @@
+import os
+import socket
+import tempfile
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+CLONE_JOB_WORKERS = int(os.getenv("CLONE_JOB_WORKERS", "2"))
+# Jobs queued in one process beyond this are refused (503) instead of waiting
+CLONE_JOB_MAX_PENDING = int(os.getenv("CLONE_JOB_MAX_PENDING", "32"))
+# Uploads wait here until their job runs. Local by default: a job can then only be run on the host that
+# received it, and is lost with that host. With several hosts, point it at shared storage (NFS, EFS...)
+# so any of them can pick up the queued jobs of one that went away.
+CLONE_JOB_DIR = os.getenv("CLONE_JOB_DIR", os.path.join(tempfile.gettempdir(), "voicememos_clone_jobs"))
+# A running job not updated for this long belongs to a dead process and is queued again
+CLONE_JOB_STALE_SECONDS = int(os.getenv("CLONE_JOB_STALE_SECONDS", "600"))
+CLONE_JOB_MAX_ATTEMPTS = int(os.getenv("CLONE_JOB_MAX_ATTEMPTS", "3"))
+# Finished jobs are removed by a Mongo TTL index after this long
+CLONE_JOB_RETENTION_SECONDS = int(os.getenv("CLONE_JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+
+
+class CloneJobQueueFull(Exception):
+    """This process already has CLONE_JOB_MAX_PENDING clone jobs waiting."""
+
+
+class CloneJobQueue:
+    """Voice-clone jobs stored in Mongo and run by a small per-process thread pool.
+
+    The upload is written to CLONE_JOB_DIR and `handler(job, audio_path, set_stage)` does the
+    upstream work and returns the new voice_clone_id. Jobs are claimed with a conditional update,
+    so a job re-queued after a restart runs in exactly one process. A queued job is owned by the
+    process that queued it ("owner"); others only adopt it once that lease is stale.
+    """
+
+    def __init__(self, collection, handler, directory=CLONE_JOB_DIR, workers=CLONE_JOB_WORKERS,
+                 max_pending=CLONE_JOB_MAX_PENDING):
+        self.collection = collection
+        self.handler = handler
+        self.directory = directory
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="clone-job")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.succeeded = 0
+        self.failed = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def ensure_indexes(self):
+        self.collection.create_index([("user_id", 1), ("created_at", -1)])
+        self.collection.create_index([("status", 1), ("updated_at", 1)])
+        self.collection.create_index("finished_at", expireAfterSeconds=CLONE_JOB_RETENTION_SECONDS)
+
+    @staticmethod
+    def owner():
+        """This process as a job owner (per call: gunicorn forks the workers after the queue is created)."""
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def audio_path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.audio")
+
+    def submit(self, user_id, filename, content_type, overwrite, chunks):
+        """Store the uploaded audio (streamed from `chunks`), create the job and queue it. Returns the job document."""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise CloneJobQueueFull("Too many voice clone jobs in progress, please try again later")
+
+        job_id = ObjectId()
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            size = 0
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    size += len(chunk)
+            os.replace(tmp_path, self.audio_path(job_id))
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        now = datetime.utcnow()
+        job = {
+            "_id": job_id,
+            "user_id": user_id,
+            "status": QUEUED,
+            "stage": QUEUED,
+            "overwrite": overwrite,
+            "filename": filename,
+            "content_type": content_type,
+            "size": size,
+            "attempts": 0,
+            "voice_clone_id": None,
+            "error": None,
+            "owner": self.owner(),
+            "created_at": now,
+            "updated_at": now,
+        }
+        self.collection.insert_one(job)
+        self._enqueue(job_id)
+        return job
+
+    def _enqueue(self, job_id):
+        with self._lock:
+            self._pending += 1
+        self._executor.submit(self._run, job_id)
+
+    def _set_stage(self, job_id, stage):
+        self.collection.update_one({"_id": job_id}, {"$set": {"stage": stage, "updated_at": datetime.utcnow()}})
+
+    def _finish(self, job_id, status, **fields):
+        now = datetime.utcnow()
+        self.collection.update_one({"_id": job_id}, {"$set": {
+            "status": status, "stage": "done", "updated_at": now, "finished_at": now, **fields}})
+        try:
+            os.remove(self.audio_path(job_id))
+        except OSError:
+            pass
+
+    def _run(self, job_id):
+        try:
+            now = datetime.utcnow()
+            # Claim: only one process moves a queued job to running
+            job = self.collection.find_one_and_update(
+                {"_id": job_id, "status": QUEUED},
+                {"$set": {"status": RUNNING, "stage": "starting", "started_at": now, "updated_at": now, "worker_pid": os.getpid()},
+                 "$inc": {"attempts": 1}},
+                return_document=ReturnDocument.AFTER,
+            )
+            if not job:
+                return
+            audio_path = self.audio_path(job_id)
+            if not os.path.exists(audio_path):
+                self._finish(job_id, FAILED, error="The uploaded audio is no longer available")
+                return
+            try:
+                voice_id = self.handler(job, audio_path, lambda stage: self._set_stage(job_id, stage))
+            except Exception as e:
+                print(f"Clone job {job_id} failed: {e}")
+                traceback.print_exc()
+                self._finish(job_id, FAILED, error=str(e) or e.__class__.__name__)
+                with self._lock:
+                    self.failed += 1
+                return
+            self._finish(job_id, SUCCEEDED, voice_clone_id=voice_id)
+            with self._lock:
+                self.succeeded += 1
+            print(f"Clone job {job_id} finished: voice_clone_id {voice_id}")
+        except Exception as e:
+            print(f"Clone job {job_id} could not be processed: {e}")
+            traceback.print_exc()
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def requeue_pending(self):
+        """Pick up jobs left queued, or running in a process that died, when this process starts.
+
+        Only jobs whose audio is in this process's CLONE_JOB_DIR, and that are unowned, owned by this
+        process or whose owner has not touched them for CLONE_JOB_STALE_SECONDS: every worker runs this
+        at start, and each job must be queued in one of them.
+        """
+        stale_before = datetime.utcnow() - timedelta(seconds=CLONE_JOB_STALE_SECONDS)
+        self.collection.update_many(
+            {"status": RUNNING, "updated_at": {"$lt": stale_before}, "attempts": {"$lt": CLONE_JOB_MAX_ATTEMPTS}},
+            {"$set": {"status": QUEUED, "stage": QUEUED, "owner": None, "updated_at": datetime.utcnow()}},
+        )
+        for job in self.collection.find({"status": RUNNING, "updated_at": {"$lt": stale_before}}, {"_id": 1}):
+            self._finish(job["_id"], FAILED, error="Clone job was interrupted too many times")
+        owner = self.owner()
+        requeued = 0
+        for job in self.collection.find({"status": QUEUED}, {"_id": 1}):
+            if not os.path.exists(self.audio_path(job["_id"])):
+                continue  # Received by another host, which still has the audio
+            adopted = self.collection.find_one_and_update(
+                {"_id": job["_id"], "status": QUEUED,
+                 "$or": [{"owner": None}, {"owner": owner}, {"updated_at": {"$lt": stale_before}}]},
+                {"$set": {"owner": owner, "updated_at": datetime.utcnow()}},
+                projection={"_id": 1},
+            )
+            if adopted:
+                self._enqueue(job["_id"])
+                requeued += 1
+        return requeued
+
+    def get(self, job_id, user_id):
+        """The job if it exists and belongs to `user_id`, else None."""
+        try:
+            job_id = ObjectId(job_id)
+        except Exception:
+            return None
+        return self.collection.find_one({"_id": job_id, "user_id": user_id})
+
+    @staticmethod
+    def describe(job):
+        """Public view of a job for the status endpoint."""
+        def iso(value):
+            return value.isoformat() + "Z" if value else None
+        return {
+            "job_id": str(job["_id"]),
+            "status": job["status"],
+            "stage": job.get("stage"),
+            "voice_clone_id": job.get("voice_clone_id"),
+            "error": job.get("error"),
+            "attempts": job.get("attempts", 0),
+            "created_at": iso(job.get("created_at")),
+            "updated_at": iso(job.get("updated_at")),
+            "finished_at": iso(job.get("finished_at")),
+        }
+
+    def stats(self):
+        with self._lock:
+            return {"pending": self._pending, "max_pending": self.max_pending,
+                    "succeeded": self.succeeded, "failed": self.failed}
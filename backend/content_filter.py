@@ -0,0 +1,158 @@
+import os
+import re
+import threading
+import unicodedata
+
+CONTENT_FILTER_TERMS_DIR = os.getenv(
+    "CONTENT_FILTER_TERMS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "filter_terms"))
+# Lists applied whatever language the user picked (English profanity shows up in every language)
+CONTENT_FILTER_BASE_LANGUAGES = [
+    code.strip().lower() for code in os.getenv("CONTENT_FILTER_BASE_LANGUAGES", "en").split(",") if code.strip()
+]
+
+# Leetspeak is only undone inside tokens that also contain letters, so "2024" or "$5" stay as they are
+LEET_TABLE = str.maketrans({"0": "o", "1": "i", "3": "e", "4": "a", "5": "s", "7": "t", "8": "b",
+                            "@": "a", "$": "s", "!": "i", "|": "i"})
+LEET_CHARS_RE = re.compile(r"[0-9@$!|]")
+# "!" and "|" count as part of a word only when a letter or digit follows ("sh!t", but not "wow!")
+LEET_TOKEN_RE = re.compile(r"(?:[\w@$]|[!|](?=[\w@$]))+")
+LETTER_RE = re.compile(r"[^\W\d_]")
+
+
+def _build_accent_table():
+    """Accented Latin letters -> base letters, precomputed so normalization is a single str.translate."""
+    table = {}
+    for codepoint in range(0xC0, 0x250):
+        char = chr(codepoint)
+        base = "".join(c for c in unicodedata.normalize("NFKD", char) if not unicodedata.combining(c))
+        if base and base != char:
+            table[codepoint] = base
+    return table
+
+
+ACCENT_TABLE = _build_accent_table()
+COMBINING_RE = re.compile("[\u0300-\u036f]+")
+
+
+def _undo_leet(match):
+    token = match.group(0)
+    if not LETTER_RE.search(token):
+        return token
+    return token.translate(LEET_TABLE)
+
+
+def normalize(text):
+    """Casefold, strip accents and undo leetspeak. Used on both the terms and the checked text."""
+    text = text.casefold()
+    if not text.isascii():
+        text = text.translate(ACCENT_TABLE)
+        if not text.isascii():
+            # Letters outside Latin-1/Extended-A/B, or accents typed as separate combining marks
+            text = COMBINING_RE.sub("", unicodedata.normalize("NFKD", text))
+    if LEET_CHARS_RE.search(text):
+        text = LEET_TOKEN_RE.sub(_undo_leet, text)
+    return text
+
+
+def load_term_lists(directory=CONTENT_FILTER_TERMS_DIR):
+    """{language code: [(normalized term, is_prefix)]} from <code>.txt files (# comments, trailing * = prefix)."""
+    lists = {}
+    try:
+        names = sorted(os.listdir(directory))
+    except OSError as e:
+        print(f"Content filter terms not found in {directory}: {e}")
+        return lists
+    for name in names:
+        code, ext = os.path.splitext(name)
+        if ext != ".txt":
+            continue
+        terms = []
+        with open(os.path.join(directory, name), encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                is_prefix = line.endswith("*")
+                term = " ".join(normalize(line.rstrip("*")).split())
+                if term:
+                    terms.append((term, is_prefix))
+        lists[code.lower()] = terms
+    return lists
+
+
+def _trie_pattern(node):
+    """Regex for a trie node: shared prefixes are written once, so matching never re-scans alternatives."""
+    alternatives = []
+    for char, child in sorted(node.items(), key=lambda item: item[0]):
+        if char == "":
+            continue
+        # Words of a multi-word term may be joined by any run of non-word characters
+        head = r"[\W_]+" if char == " " else re.escape(char)
+        alternatives.append(head + _trie_pattern(child))
+    end = node.get("")
+    if end == "prefix":
+        alternatives.append("")
+    elif end == "word":
+        alternatives.append(r"(?!\w)")
+    if len(alternatives) == 1:
+        return alternatives[0]
+    return "(?:" + "|".join(alternatives) + ")"
+
+
+def compile_terms(terms):
+    """One regex for a whole term list: the term trie behind a word boundary, run by re in a single scan."""
+    trie = {}
+    for term, is_prefix in terms:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        # A prefix term already covers every longer word that starts with it
+        if node.get("") != "prefix":
+            node[""] = "prefix" if is_prefix else "word"
+    if not trie:
+        return None
+    return re.compile(r"(?<!\w)" + _trie_pattern(trie))
+
+
+class ContentFilter:
+    """Screens topics, values and generated text against per-language term lists.
+
+    Every language gets one compiled pattern at start-up (its own list plus the base lists), so a
+    check is a normalization pass plus one regex scan. Matches respect word boundaries: "class",
+    "skill" or "Scunthorpe" are not flagged.
+    """
+
+    def __init__(self, terms_dir=CONTENT_FILTER_TERMS_DIR, base_languages=None):
+        lists = load_term_lists(terms_dir)
+        base_languages = CONTENT_FILTER_BASE_LANGUAGES if base_languages is None else base_languages
+        base_terms = [term for code in base_languages for term in lists.get(code, [])]
+        self.languages = sorted(lists)
+        self.term_count = sum(len(terms) for terms in lists.values())
+        self._base_pattern = compile_terms(base_terms)
+        self._patterns = {code: compile_terms(base_terms + terms) for code, terms in lists.items()}
+        self._lock = threading.Lock()
+        self.checks = 0
+        self.flagged = 0
+
+    def _pattern(self, language):
+        return self._patterns.get((language or "").lower(), self._base_pattern)
+
+    def find(self, text, language=None):
+        """Normalized terms found in `text` for a language code such as 'es' (unknown codes use the base lists)."""
+        pattern = self._pattern(language)
+        if not text or pattern is None:
+            return []
+        return [match.group(0) for match in pattern.finditer(normalize(text))]
+
+    def is_flagged(self, text, language=None):
+        pattern = self._pattern(language)
+        flagged = bool(text) and pattern is not None and pattern.search(normalize(text)) is not None
+        with self._lock:
+            self.checks += 1
+            if flagged:
+                self.flagged += 1
+        return flagged
+
+    def stats(self):
+        with self._lock:
+            return {"languages": self.languages, "terms": self.term_count, "checks": self.checks, "flagged": self.flagged}
@@ -0,0 +1,23 @@
+import os
+
+# Under gevent (SERVING_MODE=async) every greenlet of a worker shares one OS thread: CPU-bound work run
+# inline (numpy mix, MP3 encode, regex filtering) stalls all of them. It goes to gevent's pool of native
+# threads instead, where the waiting greenlet yields. In sync mode request threads are real threads already.
+ASYNC_SERVING = os.getenv("SERVING_MODE", "sync").strip().lower() == "async"
+CPU_POOL_THREADS = int(os.getenv("CPU_POOL_THREADS", str(min(8, os.cpu_count() or 1))))
+
+_hub_pool_sized = False
+
+
+def run_cpu_bound(fn, *args, **kwargs):
+    """fn(*args, **kwargs) off the gevent hub when serving async; a plain call otherwise."""
+    if not ASYNC_SERVING:
+        return fn(*args, **kwargs)
+    import gevent
+
+    global _hub_pool_sized
+    threadpool = gevent.get_hub().threadpool
+    if not _hub_pool_sized:
+        threadpool.maxsize = max(1, CPU_POOL_THREADS)
+        _hub_pool_sized = True
+    return threadpool.apply(fn, args, kwargs)
@@ -0,0 +1,156 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from metrics import UPSTREAM_RESPONSES
+from resilience import CircuitBreaker, call_timeout, remaining
+
+ELEVENLABS_API_BASE = os.getenv("ELEVENLABS_API_BASE", "https://api.elevenlabs.io").rstrip("/")
+
+# Pool / timeout tuning (per worker process). Size the pool to the number of
+# threads a worker can run concurrently, otherwise requests queue for a socket.
+ELEVENLABS_POOL_CONNECTIONS = int(os.getenv("ELEVENLABS_POOL_CONNECTIONS", "2"))
+ELEVENLABS_POOL_MAXSIZE = int(os.getenv("ELEVENLABS_POOL_MAXSIZE", "10"))
+ELEVENLABS_CONNECT_TIMEOUT = float(os.getenv("ELEVENLABS_CONNECT_TIMEOUT", "3.05"))
+ELEVENLABS_READ_TIMEOUT = float(os.getenv("ELEVENLABS_READ_TIMEOUT", "60"))
+ELEVENLABS_MAX_RETRIES = int(os.getenv("ELEVENLABS_MAX_RETRIES", "2"))
+ELEVENLABS_RETRY_BACKOFF = float(os.getenv("ELEVENLABS_RETRY_BACKOFF", "0.3"))
+
+# Only idempotent methods are retried on read errors / retryable status codes.
+# Connection errors (nothing was sent yet) are retried for every method.
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "DELETE"})
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+def _upstream_failed(status_code):
+    """Statuses that say something is wrong with ElevenLabs itself (4xx are about the request)."""
+    return status_code >= 500 or status_code == 429
+
+
+class ElevenLabsClient:
+    """Shared keep-alive HTTP client for the ElevenLabs API (one per worker process).
+
+    Every call is limited by the current request deadline (resilience.deadline) and goes through a
+    circuit breaker: while ElevenLabs keeps failing, calls fail fast with CircuitOpenError.
+    """
+
+    def __init__(self, api_key, base_url=ELEVENLABS_API_BASE,
+                 pool_connections=ELEVENLABS_POOL_CONNECTIONS, pool_maxsize=ELEVENLABS_POOL_MAXSIZE,
+                 connect_timeout=ELEVENLABS_CONNECT_TIMEOUT, read_timeout=ELEVENLABS_READ_TIMEOUT,
+                 max_retries=ELEVENLABS_MAX_RETRIES, retry_backoff=ELEVENLABS_RETRY_BACKOFF):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_maxsize = pool_maxsize
+
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=max_retries,
+            status=max_retries,
+            backoff_factor=retry_backoff,
+            status_forcelist=RETRY_STATUS_CODES,
+            allowed_methods=IDEMPOTENT_METHODS,
+            respect_retry_after_header=True,
+            raise_on_status=False,  # Hand the final response back so callers can map the error
+        )
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=retry,
+            pool_block=False,
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self.session.headers.update({"xi-api-key": api_key})
+        self.breaker = CircuitBreaker("elevenlabs")
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._requests_total = 0
+        self._errors_total = 0
+
+    def url(self, path):
+        """Build an absolute URL for an API path such as '/v1/models'."""
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        return f"{self.base_url}{path}"
+
+    def request(self, method, path, timeout=None, **kwargs):
+        """Send a request through the shared pool. `timeout` may be a float or a (connect, read) tuple."""
+        if timeout is None:
+            timeout = self.timeout
+        elif not isinstance(timeout, tuple):
+            timeout = (min(self.timeout[0], timeout), timeout)
+        # A read timeout shortened by the deadline says more about our budget than about ElevenLabs
+        cut_by_deadline = (remaining() or float("inf")) < timeout[1]
+        timeout = call_timeout(timeout, "elevenlabs")
+        self.breaker.check()
+
+        with self._lock:
+            self._in_flight += 1
+            self._requests_total += 1
+        try:
+            response = self.session.request(method, self.url(path), timeout=timeout, **kwargs)
+            UPSTREAM_RESPONSES.inc(upstream="elevenlabs", status=response.status_code)
+            if _upstream_failed(response.status_code):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            return response
+        except requests.exceptions.RequestException as e:
+            UPSTREAM_RESPONSES.inc(upstream="elevenlabs", status="error")
+            with self._lock:
+                self._errors_total += 1
+            if isinstance(e, requests.exceptions.Timeout) and cut_by_deadline:
+                self.breaker.release()
+            else:
+                self.breaker.record_failure()
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request("DELETE", path, **kwargs)
+
+    def pool_stats(self):
+        """Snapshot of the connection pools, used to size ELEVENLABS_POOL_MAXSIZE per gunicorn worker."""
+        pools = []
+        pool_manager = self.adapter.poolmanager
+        if pool_manager is not None:
+            for key in list(pool_manager.pools.keys()):
+                pool = pool_manager.pools.get(key)
+                if pool is None:
+                    continue
+                # The queue is pre-filled with None placeholders; only real entries are idle sockets
+                idle = sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool is not None else 0
+                pools.append({
+                    "host": f"{pool.scheme}://{pool.host}:{pool.port}",
+                    "maxsize": pool.pool.maxsize if pool.pool is not None else self.pool_maxsize,
+                    "idle_connections": idle,
+                    "connections_opened": pool.num_connections,
+                    "requests_sent": pool.num_requests,
+                })
+
+        with self._lock:
+            return {
+                "pool_maxsize": self.pool_maxsize,
+                "connect_timeout": self.timeout[0],
+                "read_timeout": self.timeout[1],
+                "in_flight": self._in_flight,
+                "requests_total": self._requests_total,
+                "errors_total": self._errors_total,
+                "circuit": self.breaker.stats(),
+                "pools": pools,
+            }
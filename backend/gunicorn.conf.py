@@ -0,0 +1,38 @@
+# Gunicorn configuration: gunicorn -c gunicorn.conf.py main:app
+#
+# SERVING_MODE=sync  (default) one request per worker thread, as before.
+# SERVING_MODE=async cooperative gevent workers: each process holds hundreds of in-flight
+#                    requests while they wait on Mongo, Gemini and ElevenLabs. Routes and
+#                    responses are unchanged; gevent patches the sockets used by pymongo,
+#                    requests and the Gemini REST transport.
+import os
+import multiprocessing
+
+serving_mode = os.getenv("SERVING_MODE", "sync").strip().lower()
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5002')}"
+workers = int(os.getenv("WEB_CONCURRENCY", str(min(4, multiprocessing.cpu_count()))))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+accesslog = "-"
+
+if serving_mode == "async":
+    worker_class = "gevent"
+    worker_connections = int(os.getenv("ASYNC_WORKER_CONNECTIONS", "500"))
+    # Upstream pools must be as large as the number of in-flight requests, or greenlets
+    # queue for a socket. Workers inherit these defaults from the master's environment.
+    os.environ.setdefault("ELEVENLABS_POOL_MAXSIZE", str(worker_connections))
+    # The same for the executors the memos fan out to (greenlets under gevent, so sizing them up is cheap):
+    # a Gemini call queued behind a 16-thread pool spends its memo deadline waiting
+    for executor_size in ("GEMINI_WORKERS", "PIPELINE_TTS_WORKERS", "BATCH_WORKERS"):
+        os.environ.setdefault(executor_size, str(worker_connections))
+    # Per-worker limits whose defaults fit 8 threads: the upstream gate would shed everything past 32 memos,
+    # and greenlets beyond the Mongo pool would fail after waitQueueTimeoutMS
+    os.environ.setdefault("ADMISSION_MAX_UPSTREAM_REQUESTS", str(worker_connections))
+    os.environ.setdefault("ADMISSION_MAX_WAITING", str(max(8, worker_connections // 4)))
+    os.environ.setdefault("MONGO_MAX_POOL_SIZE", str(worker_connections))
+else:
+    worker_class = "gthread"
+    threads = int(os.getenv("GUNICORN_THREADS", "8"))
+    os.environ.setdefault("ELEVENLABS_POOL_MAXSIZE", str(threads))
@@ -1,24 +1,56 @@
 import os
-import tempfile
+import io
 import requests
 import json
 import traceback
 import jwt # Added for JWT
-import bcrypt # Added for password hashing
 import certifi # Added for MongoDB SSL
-from flask import Flask, request, send_file, jsonify, render_template, g
+from flask import Flask, request, send_file, jsonify, render_template, g, Response, stream_with_context, make_response
 from dotenv import load_dotenv
-from pydub import AudioSegment
-import google.generativeai as genai
-from google.generativeai.client import configure
 from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
 from bson import ObjectId
 from email_validator import validate_email, EmailNotValidError
 import re
+import time
+import queue
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime, timedelta # Added timedelta
 from functools import wraps # Added for decorator
 
 load_dotenv()
+# Local modules read their configuration from the environment at import time, so import them after load_dotenv()
+from elevenlabs_client import ElevenLabsClient, ELEVENLABS_API_BASE
+from tts_cache import TTSAudioCache, TTS_CACHE_ENABLED
+from user_cache import UserCache
+from ambience import AmbienceMixer, BACKGROUND_MIX_ENABLED
+from cpu_pool import run_cpu_bound
+import quota
+from repositories import UserRepository, ActivationCodeRepository, mongo_client_options
+from quota import MONTHLY_CHAR_LIMIT, month_start, usage_for, charge_characters, refund_characters
+from password_hashing import PasswordHasher, PasswordHasherBusy
+from artifact_store import ArtifactStore, ARTIFACTS_ENABLED
+from upload_stream import StreamingMultipartUpload, UploadRejected, content_type_allowed, multipart_body, CLONE_UPLOAD_MAX_BYTES, UPLOAD_READ_CHUNK_SIZE
+from voice_preprocess import VoicePreprocessor, VOICE_PREPROCESS_ENABLED
+from clone_jobs import CloneJobQueue, CloneJobQueueFull
+from content_filter import ContentFilter
+from memo_pool import MemoPool, MEMO_POOL_ENABLED
+from admission import AdmissionController, make_backend, parse_rate, ADMISSION_TRUST_FORWARDED_FOR, ADMISSION_WAIT_SECONDS
+import metrics
+from metrics import stage_timer, record_stage, timed, FALLBACKS, BYTES_STREAMED, UPSTREAM_RESPONSES
+import resilience
+from resilience import CircuitBreaker, Hedger, UpstreamUnavailable, DeadlineExceeded, with_deadline, bind_deadline, MEMO_DEADLINE_SECONDS
+
+# "sync" (default) or "async". In async mode gunicorn runs cooperative gevent workers (see gunicorn.conf.py),
+# so every blocking socket call (Mongo, ElevenLabs, Gemini) yields instead of holding an OS thread.
+SERVING_MODE = os.getenv("SERVING_MODE", "sync").strip().lower()
+ASYNC_SERVING = SERVING_MODE == "async"
+# Alternative Gemini API base URL, e.g. the stub in bench/fake_upstream.py (only reachable over REST)
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT", "").strip() or None
+# gRPC does not cooperate with gevent, so Gemini goes over REST (plain sockets) in async mode
+GEMINI_TRANSPORT = os.getenv("GEMINI_TRANSPORT", "rest" if ASYNC_SERVING or GEMINI_API_ENDPOINT else "") or None
 API_KEY = os.getenv("ELEVEN_LABS_API_KEY")
 if not API_KEY:
     raise RuntimeError("ELEVEN_LABS_API_KEY not set in environment")
@@ -27,22 +59,42 @@ if not API_KEY:
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 if not GOOGLE_API_KEY:
     print("WARNING: GOOGLE_API_KEY not set in environment. Thought generation will not work.")
-else:
-    # Initialize Google Gemini API
-    try:
-        # Assuming 'configure' is from 'google.generativeai.client' as per original context
-        from google.generativeai.client import configure
-        configure(api_key=GOOGLE_API_KEY)
-        print("Google AI client initialized successfully")
-    except ImportError:
-        print("Failed to import 'google.generativeai.client.configure'. Make sure the library is installed.")
-        traceback.print_exc()
-    except Exception as e:
-        print(f"Error initializing Google AI client: {e}")
-        traceback.print_exc()
+
+# The Gemini SDK is imported and configured on first use (or by the background warm-up):
+# importing google.generativeai alone is a large part of the process start time.
+_gemini_configured = False
+_gemini_lock = threading.Lock()
+
+def _ensure_gemini_configured():
+    """Importa y configura el SDK de Gemini una sola vez por proceso."""
+    global _gemini_configured
+    if _gemini_configured or not GOOGLE_API_KEY:
+        return _gemini_configured
+    with _gemini_lock:
+        if _gemini_configured:
+            return True
+        try:
+            from google.generativeai.client import configure
+            client_options = {"api_endpoint": GEMINI_API_ENDPOINT} if GEMINI_API_ENDPOINT else None
+            configure(api_key=GOOGLE_API_KEY, transport=GEMINI_TRANSPORT, client_options=client_options)
+            _gemini_configured = True
+            print(f"Google AI client initialized successfully (transport: {GEMINI_TRANSPORT or 'default'}, endpoint: {GEMINI_API_ENDPOINT or 'default'})")
+        except ImportError:
+            print("Failed to import 'google.generativeai.client.configure'. Make sure the library is installed.")
+            traceback.print_exc()
+        except Exception as e:
+            print(f"Error initializing Google AI client: {e}")
+            traceback.print_exc()
+    return _gemini_configured
 
 # Define Gemini model name
 GOOGLE_MODEL_NAME = "gemini-2.0-flash" # Updated to a common model, ensure this is intended
+# Upper bound for one Gemini call (the memo deadline usually cuts it shorter)
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "15"))
+GEMINI_WORKERS = int(os.getenv("GEMINI_WORKERS", "16"))
+gemini_executor = ThreadPoolExecutor(max_workers=GEMINI_WORKERS, thread_name_prefix="gemini")
+gemini_breaker = CircuitBreaker("gemini")
+gemini_hedger = Hedger("gemini", gemini_executor)
 
 # ElevenLabs model configuration
 ELEVENLABS_DEFAULT_MODEL = os.getenv("ELEVENLABS_MODEL", "eleven_multilingual_v2")
@@ -58,17 +110,41 @@ CORS(app)
 # MongoDB Setup
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
 
-# Add certifi to the MongoDB client connection
-client = MongoClient(MONGO_URI, tlsCAFile=certifi.where())
+if MONGO_URI.startswith("mongomock://"):
+    # In-memory database for benchmarks and offline runs (pip install mongomock). Data lives and dies with
+    # the process, so run a single worker.
+    import mongomock
+    client = mongomock.MongoClient()
+    print("Using in-memory mongomock database (MONGO_URI=mongomock://)")
+else:
+    # Add certifi to the MongoDB client connection.
+    # connect=False: no server contact at import time (and safe to fork); the first operation connects.
+    # Pool size and timeouts come from the MONGO_* settings (see repositories.py).
+    client = MongoClient(MONGO_URI, tlsCAFile=certifi.where(), connect=False, **mongo_client_options())
 
 db = client.voicememos_db # Database name
 users_collection = db.users
 activation_codes_collection = db.activation_codes
-
-# Create indexes for unique fields
-users_collection.create_index("username", unique=True)
-users_collection.create_index("email", unique=True)
-activation_codes_collection.create_index("code", unique=True)
+# All user / activation code queries go through these (projections and indexes in one place)
+users = UserRepository(users_collection)
+activation_codes = ActivationCodeRepository(activation_codes_collection)
+# Characters used per (user, month), see quota.py
+usage_collection = db.usage_ledger
+
+def ensure_indexes():
+    """Create the indexes the queries rely on (called from the background warm-up)."""
+    users.ensure_indexes()
+    activation_codes.ensure_indexes()
+    quota.ensure_indexes(usage_collection)
+    clone_job_queue.ensure_indexes()
+    user_cache.ensure_indexes()
+    if hasattr(admission.backend, "ensure_indexes"):
+        admission.backend.ensure_indexes()
+
+# Cache en proceso de los documentos de usuario usados por token_required.
+# Toda ruta que modifica un usuario debe llamar a user_cache.invalidate(user_id): se publica en
+# user_cache_invalidations y los demás workers descartan su copia en USER_CACHE_SYNC_SECONDS.
+user_cache = UserCache(invalidations=db.user_cache_invalidations)
 
 # Decorator for JWT requirement
 def token_required(f):
@@ -87,10 +163,16 @@ def token_required(f):
 
         try:
             # Decode the token using the app's secret key
-            data = jwt.decode(token, app.config['JWT_SECRET_KEY'], algorithms=["HS256"])
-
-            # Fetch the user from DB and store in flask.g
-            current_user = users_collection.find_one({"_id": ObjectId(data["user_id"])})
+            with stage_timer("token_validation"):
+                data = jwt.decode(token, app.config['JWT_SECRET_KEY'], algorithms=["HS256"])
+
+            # Fetch the user (projected, without the password hash) from the cache or DB and store in flask.g
+            with stage_timer("user_lookup"):
+                current_user = user_cache.get(data["user_id"])
+                if current_user is None:
+                    current_user = users.find_profile(ObjectId(data["user_id"]))
+                    if current_user:
+                        user_cache.set(data["user_id"], current_user)
             if not current_user:
                 return jsonify({"message": "User not found for token"}), 401
             g.current_user = current_user
@@ -107,29 +189,144 @@ def token_required(f):
         return f(*args, **kwargs)
     return decorated
 
-# URLs para la API de Eleven Labs
-ELEVEN_VOICE_ADD_URL = "https://api.elevenlabs.io/v1/voices/add"
-ELEVEN_TTS_URL_TEMPLATE = "https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
+# Admission control: token buckets ("<count>/<s|min|h>[:burst]") and the per-worker upstream gate (see admission.py)
+GENERATE_RATE_PER_USER = parse_rate(os.getenv("ADMISSION_GENERATE_PER_USER", "6/min:4"))
+GENERATE_RATE_PER_IP = parse_rate(os.getenv("ADMISSION_GENERATE_PER_IP", "60/min:20"))
+CLONE_RATE_PER_USER = parse_rate(os.getenv("ADMISSION_CLONE_PER_USER", "3/h:2"))
+CLONE_RATE_PER_IP = parse_rate(os.getenv("ADMISSION_CLONE_PER_IP", "20/h:5"))
+LOGIN_RATE_PER_IP = parse_rate(os.getenv("ADMISSION_LOGIN_PER_IP", "30/min:10"))
+LOGIN_RATE_PER_ACCOUNT = parse_rate(os.getenv("ADMISSION_LOGIN_PER_ACCOUNT", "10/min:5"))
+admission = AdmissionController(make_backend(db))
+
+def client_ip():
+    if ADMISSION_TRUST_FORWARDED_FOR and request.access_route:
+        return request.access_route[0]
+    return request.remote_addr
+
+def too_many_requests_response(retry_after):
+    return jsonify({"error": f"Too many requests, please try again in {retry_after} seconds"}), 429, {"Retry-After": str(retry_after)}
+
+def admission_required(endpoint, per_user=None, per_ip=None, upstream=False, cost=None):
+    """Rate limits per user (after token_required) and per client IP; with upstream=True the request also
+    needs a slot of the upstream gate, held until the response (streamed or not) has been sent.
+    `cost` (a function of the request) is how many tokens it takes, 1 by default."""
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            user = g.get("current_user")
+            tokens = cost() if cost else 1
+            limits = [(f"{endpoint}_user", str(user["_id"]) if user else None, per_user), (f"{endpoint}_ip", client_ip(), per_ip)]
+            for limit, key, rate in limits:
+                if rate:
+                    retry_after = admission.check(limit, key, *rate, cost=tokens)
+                    if retry_after:
+                        print(f"Admission: {limit} limit reached for {key}, retry in {retry_after}s")
+                        return too_many_requests_response(retry_after)
+            if not upstream:
+                return f(*args, **kwargs)
+
+            if not admission.acquire_upstream():
+                print(f"Admission: shedding {endpoint} request, upstream gate full ({admission.gate.stats()})")
+                return jsonify({"error": "The server is busy, please try again shortly"}), 503, {"Retry-After": str(max(1, int(ADMISSION_WAIT_SECONDS)))}
+            try:
+                response = make_response(f(*args, **kwargs))
+            except BaseException:
+                admission.release_upstream()
+                raise
+            if response.is_streamed and not response.direct_passthrough:
+                # Generated bodies keep calling the upstream while they are sent
+                response.call_on_close(admission.release_upstream)
+            else:
+                # Buffered audio (send_file hands its file straight to the server, without close callbacks)
+                admission.release_upstream()
+            return response
+        return decorated
+    return decorator
 
-# Cabeceras para la API de Eleven Labs
-headers = {
-    "xi-api-key": API_KEY
-}
+# URLs para la API de Eleven Labs
+ELEVEN_VOICE_ADD_URL = f"{ELEVENLABS_API_BASE}/v1/voices/add"
+ELEVEN_TTS_URL_TEMPLATE = ELEVENLABS_API_BASE + "/v1/text-to-speech/{voice_id}"
+ELEVEN_TTS_STREAM_URL_TEMPLATE = ELEVENLABS_API_BASE + "/v1/text-to-speech/{voice_id}/stream"
+ELEVEN_VOICE_URL_TEMPLATE = ELEVENLABS_API_BASE + "/v1/voices/{voice_id}"
+
+# Cliente compartido (pool keep-alive + timeouts + reintentos) para todas las llamadas a Eleven Labs.
+# La cabecera xi-api-key va en la sesión del cliente.
+eleven_client = ElevenLabsClient(API_KEY)
+
+# Cloning uploads can take much longer than a TTS request
+ELEVEN_CLONE_READ_TIMEOUT = float(os.getenv("ELEVENLABS_CLONE_READ_TIMEOUT", "180"))
+
+# Cache de audio TTS (direccionado por contenido) compartido entre workers a través del directorio en disco
+tts_cache = TTSAudioCache() if TTS_CACHE_ENABLED else None
+
+# Audios generados guardados un tiempo (TTL) con un ID para poder descargarlos de nuevo (GET /artifacts/<id>).
+# Un hilo en segundo plano borra los caducados.
+artifact_store = ArtifactStore() if ARTIFACTS_ENABLED else None
+if artifact_store and __name__ != "__mp_main__":
+    artifact_store.start_gc()
+
+# Limpieza de las muestras de voz antes de clonar (recorte de silencios, mono, normalización, MP3 compacto)
+voice_preprocessor = VoicePreprocessor() if VOICE_PREPROCESS_ENABLED else None
+
+# Sonido de fondo (fan.mp3): se decodifica una sola vez a PCM compartido (memory-mapped) entre workers.
+# La carga se hace en el warm-up en segundo plano.
+ambience_mixer = AmbienceMixer() if BACKGROUND_MIX_ENABLED else None
+
+# /models and /verify-api results are reused for this long instead of hitting ElevenLabs on every call
+UPSTREAM_METADATA_TTL_SECONDS = float(os.getenv("UPSTREAM_METADATA_TTL_SECONDS", "300"))
+
+# Streaming TTS: size of the MP3 chunks relayed to the client as they arrive from ElevenLabs
+TTS_STREAM_CHUNK_SIZE = int(os.getenv("TTS_STREAM_CHUNK_SIZE", "4096"))
+
+# Pipelined mode: Gemini output is cut into sentences and each one is synthesized as soon as it is complete.
+# Fragments shorter than this are merged with the next sentence so TTS keeps a natural prosody.
+PIPELINE_MIN_SENTENCE_CHARS = int(os.getenv("PIPELINE_MIN_SENTENCE_CHARS", "40"))
+PIPELINE_TTS_WORKERS = int(os.getenv("PIPELINE_TTS_WORKERS", "16"))
+tts_pipeline_executor = ThreadPoolExecutor(max_workers=PIPELINE_TTS_WORKERS, thread_name_prefix="tts-pipeline")
+SENTENCE_END_RE = re.compile(r'(?<=[.!?…])\s+')
+
+# Batch generation: items per request, items of one request in flight at once, and the shared pool
+# (per worker process) that runs them. Quota is reserved up front per item and reconciled at the end.
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "20"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "16"))
+BATCH_RESERVE_CHARS_PER_ITEM = int(os.getenv("BATCH_RESERVE_CHARS_PER_ITEM", "150"))
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="memo-batch")
 
 # Variable global para almacenar el ID de la voz de Alex Latorre
 ALEX_LATORRE_VOICE_ID = None
 
+def ttl_cached(ttl_seconds):
+    """Decorator caching a zero-argument function's truthy result for `ttl_seconds` (failures are not cached)."""
+    def decorator(f):
+        state = {"value": None, "expires_at": 0.0}
+        lock = threading.Lock()
+
+        @wraps(f)
+        def wrapper():
+            now = time.monotonic()
+            if state["value"] and state["expires_at"] > now:
+                return state["value"]
+            with lock:
+                if state["value"] and state["expires_at"] > time.monotonic():
+                    return state["value"]
+                value = f()
+                if value:
+                    state["value"] = value
+                    state["expires_at"] = time.monotonic() + ttl_seconds
+                return value
+        wrapper.cache_clear = lambda: state.update(value=None, expires_at=0.0)
+        return wrapper
+    return decorator
+
+@ttl_cached(UPSTREAM_METADATA_TTL_SECONDS)
 def get_available_models():
     """Get available TTS models from ElevenLabs"""
     try:
-        models_resp = requests.get("https://api.elevenlabs.io/v1/models", headers=headers)
+        models_resp = eleven_client.get("/v1/models")
         models_resp.raise_for_status()
         models_data = models_resp.json()
         
-        print("Available ElevenLabs models:")
-        print(f"Raw response type: {type(models_data)}")
-        print(f"Raw response: {models_data}")
-        
         # Handle different response formats
         models_list = []
         if isinstance(models_data, list):
@@ -147,15 +344,8 @@ def get_available_models():
             print(f"Unexpected models response format: {type(models_data)}")
             return []
         
-        for model in models_list:
-            if isinstance(model, dict):
-                model_id = model.get('model_id', model.get('id', 'unknown'))
-                name = model.get('name', 'Unknown')
-                description = model.get('description', 'No description')
-                print(f"  - ID: {model_id}, Name: {name}")
-                print(f"    Description: {description}")
-            else:
-                print(f"  - Unexpected model format: {model}")
+        model_ids = [model.get('model_id', model.get('id', 'unknown')) for model in models_list if isinstance(model, dict)]
+        print(f"Available ElevenLabs models ({len(models_list)}): {', '.join(model_ids)}")
         
         return models_list
     except requests.exceptions.RequestException as e:
@@ -173,7 +363,7 @@ def get_alex_latorre_voice_id():
         return ALEX_LATORRE_VOICE_ID
 
     try:
-        voices_resp = requests.get("https://api.elevenlabs.io/v1/voices", headers=headers)
+        voices_resp = eleven_client.get("/v1/voices")
         voices_resp.raise_for_status()
         voices_data = voices_resp.json()
         
@@ -216,21 +406,11 @@ def get_alex_latorre_voice_id():
         print(f"An unexpected error occurred while fetching voice ID: {e}")
         return None
 
-# Llama a la función al iniciar la aplicación para obtener el ID de la voz
-# Esto se ejecutará una vez cuando el servidor Flask comience.
-ALEX_LATORRE_VOICE_ID = get_alex_latorre_voice_id()
-
-# Also get available models on startup
-print("\n" + "="*50)
-print("ELEVENLABS MODELS INFORMATION")
-print("="*50)
-available_models = get_available_models()
-print("="*50 + "\n")
-
+@ttl_cached(UPSTREAM_METADATA_TTL_SECONDS)
 def verify_api_key():
     """Verify that the API key is valid by making a test request to Eleven Labs"""
     try:
-        response = requests.get("https://api.elevenlabs.io/v1/models", headers=headers)
+        response = eleven_client.get("/v1/models")
         response.raise_for_status()
         return True
     except requests.exceptions.RequestException as e:
@@ -249,6 +429,118 @@ def verify_api():
     else:
         return jsonify({"status": "error", "message": "API key is invalid"}), 401
 
+# --- Background warm-up and readiness ---
+
+# The warm-up retries until the required checks pass (the worker stays unready until then), waiting
+# WARMUP_RETRY_SECONDS after the first failed attempt and doubling up to WARMUP_RETRY_MAX_SECONDS
+WARMUP_RETRY_SECONDS = float(os.getenv("WARMUP_RETRY_SECONDS", "2"))
+WARMUP_RETRY_MAX_SECONDS = float(os.getenv("WARMUP_RETRY_MAX_SECONDS", "60"))
+
+warmup_state = {
+    "voice_id_loaded": False,
+    "models_loaded": False,
+    "indexes_created": False,
+    "gemini_configured": False,
+    "ambience_loaded": False,
+    "clone_jobs_requeued": False,
+    "attempts": 0,
+    "started_at": None,
+    "completed_at": None,
+}
+
+def _warm_up():
+    """Carga en segundo plano lo que antes se hacía al importar: voz, modelos, índices, Gemini y sonido de fondo."""
+    warmup_state["started_at"] = datetime.utcnow().isoformat()
+    delay = WARMUP_RETRY_SECONDS
+    while True:
+        warmup_state["attempts"] += 1
+        if not warmup_state["voice_id_loaded"]:
+            warmup_state["voice_id_loaded"] = bool(get_alex_latorre_voice_id())
+        if not warmup_state["models_loaded"]:
+            warmup_state["models_loaded"] = bool(get_available_models())
+        if not warmup_state["indexes_created"]:
+            try:
+                ensure_indexes()
+                warmup_state["indexes_created"] = True
+            except Exception as e:
+                print(f"Warm-up: index creation failed: {e}")
+        if not warmup_state["gemini_configured"]:
+            warmup_state["gemini_configured"] = _ensure_gemini_configured()
+        if ambience_mixer and not warmup_state["ambience_loaded"]:
+            warmup_state["ambience_loaded"] = ambience_mixer.load()
+        if not warmup_state["clone_jobs_requeued"]:
+            try:
+                requeued = clone_job_queue.requeue_pending()
+                warmup_state["clone_jobs_requeued"] = True
+                if requeued:
+                    print(f"Warm-up: {requeued} pending clone jobs queued again")
+            except Exception as e:
+                print(f"Warm-up: clone job recovery failed: {e}")
+
+        if (warmup_state["voice_id_loaded"] and warmup_state["models_loaded"] and warmup_state["indexes_created"]
+                and warmup_state["clone_jobs_requeued"]):
+            break
+        # An upstream or Mongo outage at boot must not leave the worker unready until it is restarted
+        print(f"Warm-up attempt {warmup_state['attempts']} incomplete, retrying in {delay:g}s")
+        time.sleep(delay)
+        delay = min(delay * 2, WARMUP_RETRY_MAX_SECONDS)
+    warmup_state["completed_at"] = datetime.utcnow().isoformat()
+    print(f"Warm-up finished: {warmup_state}")
+
+def start_warm_up():
+    threading.Thread(target=_warm_up, name="warm-up", daemon=True).start()
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe: 200 once the voice and model metadata are loaded, 503 before"""
+    is_ready = warmup_state["voice_id_loaded"] and warmup_state["models_loaded"]
+    return jsonify({"ready": is_ready, **warmup_state}), 200 if is_ready else 503
+
+@app.route('/internal/stats', methods=['GET'])
+@token_required
+def internal_stats():
+    """Endpoint with per-worker runtime statistics (upstream connection pool, caches). Admin only, like /admin/*"""
+    if g.current_user.get('username') != 'alexlatorre':
+        return jsonify({"error": "Admin access required"}), 403
+    return jsonify({
+        "pid": os.getpid(),
+        "elevenlabs_pool": eleven_client.pool_stats(),
+        "tts_cache": tts_cache.stats() if tts_cache else None,
+        "user_cache": user_cache.stats(),
+        "artifacts": artifact_store.stats() if artifact_store else None,
+        "voice_preprocessing": voice_preprocessor.stats() if voice_preprocessor else None,
+        "clone_jobs": clone_job_queue.stats(),
+        "password_hashing": password_hasher.stats(),
+        "content_filter": content_filter.stats(),
+        "memo_pool": memo_pool.stats() if memo_pool else None,
+        "circuits": {"gemini": gemini_breaker.stats(), "elevenlabs": eleven_client.breaker.stats()},
+        "gemini_hedging": gemini_hedger.stats(),
+        "admission": admission.stats(),
+        "background_ambience_ready": bool(ambience_mixer and ambience_mixer.ready)
+    }), 200
+
+WORKER_QUEUE_DEPTH = metrics.REGISTRY.gauge(
+    "voicememos_worker_queue_depth",
+    "Work in progress or waiting per pool of this worker (compare with the pool sizes when tuning them)",
+    ("pool",))
+
+def _collect_pool_metrics():
+    WORKER_QUEUE_DEPTH.set(eleven_client.pool_stats()["in_flight"], pool="elevenlabs_http")
+    WORKER_QUEUE_DEPTH.set(password_hasher.stats()["in_flight"], pool="password_hashing")
+    WORKER_QUEUE_DEPTH.set(clone_job_queue.stats()["pending"], pool="clone_jobs")
+    gate = admission.gate.stats()
+    WORKER_QUEUE_DEPTH.set(gate["in_flight"], pool="upstream_gate")
+    WORKER_QUEUE_DEPTH.set(gate["waiting"], pool="upstream_gate_waiting")
+
+metrics.REGISTRY.add_collector(_collect_pool_metrics)
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus scrape endpoint (metrics of the worker process that answers)"""
+    if not metrics.METRICS_ENABLED:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
 @app.route('/models', methods=['GET'])
 def get_models():
     """Endpoint to get available ElevenLabs models"""
@@ -258,33 +550,139 @@ def get_models():
     else:
         return jsonify({"error": "Failed to fetch models"}), 500
 
-def _is_likely_inappropriate(text):
+# Compiled once per process: one pattern per language (see content_filter.py and filter_terms/)
+content_filter = ContentFilter()
+
+def _filter_language(language):
+    """Language code for the content filter from the user's setting ('spanish' -> 'es')."""
+    language = (language or "").strip().lower()
+    return CLONE_LANGUAGE_CODES.get(language, language[:2])
+
+def _is_likely_inappropriate(text, language="english"):
     """Check if text contains potentially inappropriate content"""
-    if not text:
-        return False
-        
-    text = text.lower()
-    inappropriate_patterns = [
-        'sex', 'porn', 'nude', 'naked', 'xxx', 'dildo', 'vibrator', 'nsfw',
-        'fuck', 'shit', 'ass', 'dick', 'cock', 'pussy', 'cunt', 'whore',
-        'bitch', 'slut', 'horny', 'masturbat', 'orgas', 'nazi', 'kill', 
-        'murder', 'suicide', 'rape', 'racist', 'n-word', 'nigger'
-    ]
-    
-    return any(pattern in text for pattern in inappropriate_patterns)
+    return content_filter.is_flagged(text, _filter_language(language))
+
+def _screen_generated_text(text, language):
+    """Gemini output is checked as well before TTS is paid for; flagged text becomes the safe fallback."""
+    if text and _is_likely_inappropriate(text, language):
+        print(f"Warning: Generated text flagged by the content filter. Using safe fallback in {language}.")
+        FALLBACKS.inc(reason="generated_text_filter")
+        return _inappropriate_fallback_text(language)
+    return text
+
+def _screen_generated_sentences(sentences, language):
+    """Streaming version of _screen_generated_text: stops at the first flagged sentence.
+
+    If nothing was spoken yet the safe fallback replaces the memo; otherwise it simply ends early.
+    """
+    produced = False
+    try:
+        for sentence in sentences:
+            if _is_likely_inappropriate(sentence, language):
+                print(f"Warning: Generated sentence flagged by the content filter after {'some' if produced else 'no'} audio.")
+                FALLBACKS.inc(reason="generated_text_filter")
+                if not produced:
+                    yield _inappropriate_fallback_text(language)
+                return
+            produced = True
+            yield sentence
+    finally:
+        sentences.close()
 
+def _thought_fallback_template(language):
+    """Plantilla de respaldo (con {value} y {topic}) cuando Gemini no está disponible o falla."""
+    if language.lower().startswith("es") or language.lower() == "spanish":
+        return "Okay, entonces... Esta mañana tuve la sensación de que alguien que conozco está interesado en {value} en relación a {topic}."
+    return "Okay, so... This morning I had a feeling that someone I know is interested in {value} regarding {topic}."
+
+def _inappropriate_fallback_text(language):
+    """Texto seguro que sustituye a la nota cuando el topic o el value parecen inapropiados."""
+    if language.lower().startswith("es") or language.lower() == "spanish":
+        return "Esta mañana me desperté pensando en lo interesante que es la magia y cómo puede sorprender a la gente."
+    return "This morning I woke up thinking about how interesting magic is and how it can surprise people."
+
+def _thought_prompt(user_language, topic, value):
+    """Prompt de Gemini con las instrucciones de idioma para una nota sobre `value` (con `topic` como subtexto)."""
+    return f"""
+──────────  ROLE  ──────────
+You are a fully awake person who just got ready for the day — and you're recording a quick, casual voice note in {user_language}.  
+You suddenly remembered a weird dream, or had a strange passing thought, and you want to say it out loud before you forget.
+
+────────  MUST‑HAVES  ────────
+1. **Language**: The entire note must be in {user_language}.  
+2. **Tone**: Awake, calm, and casual — like you're talking to yourself or a friend in the morning.  
+3. **Value inclusion**: The value **({value})** should be mentioned naturally by name, not forced.  
+4. **Topic as subtext**: Do **NOT** mention the topic **({topic})** — but let it guide the general mood or situation.  
+5. **Length**: One or two short sentences — max 15 seconds to read aloud.  
+6. **Emotion**: Curious, chill, or a bit puzzled — no drama or exaggeration. Think: “I just remembered something odd.”
+
+────────  STYLE TIPS  ────────
+• Use conversational, natural speech for {user_language} — like how people talk out loud in the morning.  
+• Feel free to use a few filler words typical for the language (e.g., “no sé”, “o algo”, “creo”, “genre”, “je pense”, “kinda”, etc.).  
+• Avoid sounding too polished — contractions and incomplete thoughts are fine.  
+• Keep punctuation relaxed — ellipses, commas, or nothing at all.  
+
+────────  EXAMPLES (adjust to {user_language})  ────────
+EN:  “I was brushing my teeth and suddenly remembered this weird dream… someone was terrified of spiders, like legit panic. No idea why it came back to me.”  
+ES:  “Estaba ya vistiéndome y me vino esta imagen rarísima… alguien hablaba de arañas y se ponía super nervioso, no sé qué fue eso.”  
+FR:  “J’étais prêt à sortir et là, paf, j’me souviens d’un truc dans mon rêve… un mec flippait grave à cause des araignées. C’est revenu d’un coup.”  
+DE:  “Ich war schon fertig im Bad und plötzlich kam so ein Bild aus dem Traum hoch… irgendwer hatte mega Angst vor Spinnen. Ganz seltsam.”  
+IT:  “Stavo per uscire e all’improvviso mi è tornata in mente questa scena… qualcuno parlava dei ragni e sembrava super agitato. Boh.”
+
+────────  OUTPUT RULE  ────────
+Return only the voice note in {user_language}, no additional text, labels, or formatting.
+"""
+
+def _gemini_error_status(error):
+    """HTTP status of a failed Gemini call when the SDK exposes one (google.api_core errors), else 'error'."""
+    code = getattr(error, "code", None)
+    return code if isinstance(code, int) else "error"
+
+def _gemini_failed(error):
+    """Whether a Gemini error counts against its circuit breaker (4xx other than 429 are about the request)."""
+    status = _gemini_error_status(error)
+    return not isinstance(status, int) or status >= 500 or status == 429
+
+def _record_gemini_error(error, timeout):
+    if isinstance(error, DeadlineExceeded):
+        UPSTREAM_RESPONSES.inc(upstream="gemini", status="timeout")
+        if timeout < GEMINI_TIMEOUT_SECONDS:
+            gemini_breaker.release()  # Cut short by the memo deadline: says nothing about Gemini
+            return
+    else:
+        UPSTREAM_RESPONSES.inc(upstream="gemini", status=_gemini_error_status(error))
+    if isinstance(error, DeadlineExceeded) or _gemini_failed(error):
+        gemini_breaker.record_failure()
+    else:
+        gemini_breaker.record_success()
+
+def _gemini_call_allowed(language):
+    """Timeout for the next Gemini call, or None (use the template) when there is no time left or the circuit is open."""
+    try:
+        timeout = resilience.call_timeout(GEMINI_TIMEOUT_SECONDS, "gemini")
+    except DeadlineExceeded:
+        print(f"No time left for Gemini. Returning fallback message in {language}.")
+        FALLBACKS.inc(reason="deadline")
+        return None
+    if not gemini_breaker.allow():
+        print(f"Gemini circuit open. Returning fallback message in {language}.")
+        FALLBACKS.inc(reason="gemini_circuit_open")
+        return None
+    return timeout
+
+@timed("gemini")
 def _generate_thought_text(prompt, topic, value, language="english"): # Added language parameter
     """Genera texto usando la API de Gemini en el idioma especificado."""
     
-    # Determine the appropriate starting phrase based on language
-    start_phrase = "Okay, so..."
-    fallback_message_template = "Okay, so... This morning I had a feeling that someone I know is interested in {value} regarding {topic}."
-    if language.lower().startswith("es") or language.lower() == "spanish":
-        start_phrase = "Okay, entonces..." # Or a more natural Spanish equivalent
-        fallback_message_template = "Okay, entonces... Esta mañana tuve la sensación de que alguien que conozco está interesado en {value} en relación a {topic}."
+    fallback_message_template = _thought_fallback_template(language)
 
     if not GOOGLE_API_KEY:
         print(f"GOOGLE_API_KEY not set. Returning fallback message in {language}.")
+        FALLBACKS.inc(reason="gemini_template")
+        return fallback_message_template.format(value=value, topic=topic)
+    _ensure_gemini_configured()
+    timeout = _gemini_call_allowed(language)
+    if timeout is None:
         return fallback_message_template.format(value=value, topic=topic)
     
     try:
@@ -297,7 +695,13 @@ def _generate_thought_text(prompt, topic, value, language="english"): # Added la
             # The main prompt content is passed as 'prompt' argument to this function
             full_prompt_for_gemini = f"{prompt}" # The 'prompt' arg already contains language instructions
 
-            thought_response = model.generate_content(full_prompt_for_gemini)
+            def attempt(attempt_timeout):
+                return model.generate_content(full_prompt_for_gemini, request_options={"timeout": attempt_timeout})
+
+            # Hedged: if Gemini is slower than usual a second identical call is sent and the first answer wins
+            thought_response = gemini_hedger.call(attempt, timeout)
+            UPSTREAM_RESPONSES.inc(upstream="gemini", status="ok")
+            gemini_breaker.record_success()
             
             generated_text = ""
             if hasattr(thought_response, 'text'):
@@ -311,6 +715,7 @@ def _generate_thought_text(prompt, topic, value, language="english"): # Added la
             return generated_text
 
         except (ImportError, NameError, AttributeError) as sdk_err:
+            gemini_breaker.release()
             print(f"Google AI SDK error or not available: {str(sdk_err)}. Falling back to REST API or general fallback.")
             traceback.print_exc()
         
@@ -321,18 +726,453 @@ def _generate_thought_text(prompt, topic, value, language="english"): # Added la
     except Exception as e:
         print(f"Error generating text with Gemini: {e}")
         traceback.print_exc()
+        _record_gemini_error(e, timeout)
     
     # General fallback if all attempts fail
     print(f"All Gemini generation attempts failed. Returning fallback message in {language}.")
+    FALLBACKS.inc(reason="gemini_template")
     return fallback_message_template.format(value=value, topic=topic)
 
+def _stream_thought_sentences(prompt, topic, value, language="english"):
+    """Genera el texto con Gemini en streaming y lo entrega frase a frase a medida que se completa."""
+    fallback_text = _thought_fallback_template(language).format(value=value, topic=topic)
+    if not GOOGLE_API_KEY:
+        print(f"GOOGLE_API_KEY not set. Returning fallback message in {language}.")
+        FALLBACKS.inc(reason="gemini_template")
+        yield fallback_text
+        return
+
+    _ensure_gemini_configured()
+    timeout = _gemini_call_allowed(language)
+    if timeout is None:
+        yield fallback_text
+        return
+    pending = ""
+    produced = False
+    started = time.perf_counter()
+    try:
+        from google.generativeai.generative_models import GenerativeModel
+        model = GenerativeModel(GOOGLE_MODEL_NAME)
+        for chunk in model.generate_content(prompt, stream=True, request_options={"timeout": timeout}):
+            try:
+                pending += chunk.text
+            except (ValueError, AttributeError):
+                continue  # Chunk without text (e.g. safety metadata only)
+
+            parts = SENTENCE_END_RE.split(pending)
+            pending = parts.pop()  # Last part may still be growing
+            sentence = ""
+            for part in parts:
+                sentence = f"{sentence} {part}".strip()
+                if len(sentence) >= PIPELINE_MIN_SENTENCE_CHARS:
+                    produced = True
+                    yield sentence
+                    sentence = ""
+            if sentence:
+                # Too short to speak alone: put it back (with the separator the split consumed)
+                pending = f"{sentence} {pending}"
+    except GeneratorExit:
+        gemini_breaker.release()  # Consumer stopped early (client gone or flagged sentence)
+        raise
+    except Exception as e:
+        print(f"Error streaming text from Gemini: {e}")
+        traceback.print_exc()
+        _record_gemini_error(e, timeout)
+        record_stage("gemini_stream", time.perf_counter() - started)
+        if not produced:
+            # Nothing was spoken yet, so the whole fallback can replace it
+            print(f"Gemini streaming failed. Returning fallback message in {language}.")
+            FALLBACKS.inc(reason="gemini_template")
+            yield fallback_text
+            return
+    else:
+        UPSTREAM_RESPONSES.inc(upstream="gemini", status="ok")
+        gemini_breaker.record_success()
+        record_stage("gemini_stream", time.perf_counter() - started)
+
+    if pending.strip():
+        yield pending.strip()
+    elif not produced:
+        FALLBACKS.inc(reason="gemini_template")
+        yield fallback_text
+
+
+def _background_gain(user):
+    """Volumen del ambiente de fondo según los ajustes del usuario (0.0 = sin mezcla)."""
+    settings = user.get("settings", {})
+    if not (ambience_mixer and ambience_mixer.ready) or not settings.get("add_background_sound", True):
+        return 0.0
+    return max(0.0, min(1.0, float(settings.get("background_volume", 0.5))))
+
+def _tts_cache_key(voice_id, model_id, text, stability, similarity_boost, background_gain=0.0):
+    if not tts_cache:
+        return None
+    cache_extra = {"background_volume": background_gain} if background_gain > 0 else {}
+    return TTSAudioCache.make_key(voice_id, model_id, text, stability, similarity_boost, **cache_extra)
+
+def _mix_background(voice_pcm, background_gain):
+    """Raw PCM speech -> MP3 with the ambience under it. Returns (audio_bytes, mixed).
+
+    A failed mix falls back to the voice alone (mixed=False, so it is not cached as mixed audio);
+    only a failed encode raises, and then the caller refunds like for any other undelivered memo.
+    """
+    mixed = True
+    try:
+        with stage_timer("ambience_mix"):
+            samples = run_cpu_bound(ambience_mixer.mix, voice_pcm, background_gain)
+    except Exception as e:
+        print(f"Ambience mix failed, sending the voice without background: {e}")
+        FALLBACKS.inc(reason="ambience_mix")
+        samples, mixed = ambience_mixer.mix(voice_pcm, 0.0), False
+    # ~100-350 ms of CPU per memo: off the gevent hub in async mode (the result is cached under the gain)
+    with stage_timer("mp3_encode"):
+        return run_cpu_bound(ambience_mixer.encode_mp3, samples), mixed
+
+def _render_tts(voice_id, model_id, text, voice_settings, background_gain=0.0, cache_key=None):
+    """Buffered TTS: the complete MP3, with the ambience mixed in when background_gain > 0.
+
+    The result is stored under cache_key unless the mix fell back to the voice alone.
+    Raises requests.HTTPError (with the upstream response) when ElevenLabs refuses the text.
+    """
+    params = {"output_format": ambience_mixer.output_format} if background_gain > 0 else None
+    with stage_timer("tts"):
+        tts_resp = eleven_client.post(ELEVEN_TTS_URL_TEMPLATE.format(voice_id=voice_id),
+                                      json={"text": text, "model_id": model_id, "voice_settings": voice_settings}, params=params)
+        try:
+            tts_resp.raise_for_status()
+            audio_bytes = tts_resp.content
+        finally:
+            tts_resp.close()
+    cacheable = True
+    if background_gain > 0:
+        audio_bytes, cacheable = _mix_background(audio_bytes, background_gain)
+    if cache_key and cacheable:
+        tts_cache.put(cache_key, audio_bytes)
+    return audio_bytes
+
+def _pool_profile(voice_id, stability, similarity_boost, background_gain):
+    """What makes pre-rendered pool audio usable for a request (same fields as the TTS cache key)."""
+    return (voice_id, ELEVENLABS_TURBO_MODEL, float(stability), float(similarity_boost), background_gain)
+
+def _pool_generate(language, topic, value):
+    """Texto nuevo para el pool de notas; None si Gemini no respondió (las plantillas de respaldo no se guardan)."""
+    text = _generate_thought_text(_thought_prompt(language, topic, value), topic, value, language)
+    if not text or text == _thought_fallback_template(language).format(value=value, topic=topic):
+        return None
+    if _is_likely_inappropriate(text, language):
+        FALLBACKS.inc(reason="generated_text_filter")
+        return None
+    return text
+
+def _pool_prerender(text, profile):
+    """Synthesize a pooled text for one voice profile straight into the TTS cache."""
+    voice_id, model_id, stability, similarity_boost, background_gain = profile
+    cache_key = _tts_cache_key(voice_id, model_id, text, stability, similarity_boost, background_gain)
+    _render_tts(voice_id, model_id, text, {"stability": stability, "similarity_boost": similarity_boost}, background_gain, cache_key)
+
+# Popular (language, topic, value) requests get a text generated ahead of time (see memo_pool.py).
+# Pre-rendering needs the TTS cache, where the audio is left for the request to find.
+memo_pool = MemoPool(_pool_generate, _pool_prerender if tts_cache else None) if MEMO_POOL_ENABLED else None
+
+def _streaming_headers(artifact=None, cache_status=None):
+    headers = {
+        "Content-Disposition": "attachment; filename=output.mp3",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",  # Keep reverse proxies from buffering the stream
+    }
+    if cache_status:
+        headers["X-TTS-Cache"] = cache_status
+    if artifact:
+        headers["X-Artifact-Id"] = artifact.artifact_id
+    return headers
+
+def _relay_tts_stream(tts_resp, cache_key=None, artifact=None):
+    """Relay a streamed ElevenLabs TTS response to the client chunk by chunk.
+
+    When a cache key is given, the relayed chunks are also collected and stored once the stream completes.
+    With an artifact writer the audio is also persisted; if the client disconnects, the rest of the
+    upstream stream is still read into the artifact so it can be fetched from /artifacts/<id>.
+    """
+    finished = threading.Event()  # Set by whichever cleanup runs first: the generator's or call_on_close
+
+    def relay_chunks():
+        bytes_sent = 0
+        collected = [] if cache_key else None
+        chunks = tts_resp.iter_content(chunk_size=TTS_STREAM_CHUNK_SIZE)
+        completed = False
+        try:
+            for chunk in chunks:
+                if chunk:
+                    bytes_sent += len(chunk)
+                    if collected is not None:
+                        collected.append(chunk)
+                    if artifact:
+                        artifact.write(chunk)
+                    yield chunk
+            completed = True
+        except GeneratorExit:
+            if artifact:
+                print(f"Client disconnected after {bytes_sent} bytes, finishing artifact {artifact.artifact_id}")
+                try:
+                    for chunk in chunks:
+                        if chunk:
+                            if collected is not None:
+                                collected.append(chunk)
+                            artifact.write(chunk)
+                    completed = True
+                except requests.exceptions.RequestException as e:
+                    print(f"ERROR TTS stream interrupted while finishing artifact: {e}")
+        except requests.exceptions.RequestException as e:
+            # Headers are already sent at this point, so the only option is to end the stream early
+            print(f"ERROR TTS stream interrupted after {bytes_sent} bytes: {e}")
+        finally:
+            finished.set()
+            tts_resp.close()
+            if completed and collected:
+                tts_cache.put(cache_key, b"".join(collected))
+            if artifact:
+                artifact.commit() if completed else artifact.abort()
+            BYTES_STREAMED.inc(bytes_sent, mode="stream")
+            print(f"TTS stream finished, {bytes_sent} bytes relayed")
+
+    response = Response(
+        stream_with_context(relay_chunks()),
+        mimetype='audio/mpeg',
+        headers=_streaming_headers(artifact, cache_status="miss"),
+    )
+
+    @response.call_on_close
+    def release_unstarted_stream():
+        # Client gone before the first chunk: closing a generator that never started skips its finally.
+        # No header was sent either, so the client never learned the artifact id: drop it
+        if not finished.is_set():
+            finished.set()
+            tts_resp.close()
+            if artifact:
+                artifact.abort()
+            print("TTS stream closed before the first chunk")
+
+    return response
+
+def _describe_artifact(artifact_meta):
+    return {
+        "artifact_id": artifact_meta["id"],
+        "url": f"/artifacts/{artifact_meta['id']}",
+        "etag": artifact_meta["etag"],
+        "size": artifact_meta["size"],
+        "expires_at": datetime.utcfromtimestamp(artifact_meta["expires_at"]).isoformat() + "Z",
+    }
+
+def _audio_file_response(audio_bytes, cache_status, artifact_meta=None, json_mode=False):
+    """Buffered generation response: the MP3 itself, or (json_mode) a JSON description of the stored artifact."""
+    if json_mode and artifact_meta:
+        response = jsonify(_describe_artifact(artifact_meta))
+    else:
+        response = send_file(io.BytesIO(audio_bytes), mimetype='audio/mpeg', as_attachment=True, download_name='output.mp3')
+        BYTES_STREAMED.inc(len(audio_bytes), mode="buffered")
+    response.headers['X-TTS-Cache'] = cache_status
+    if artifact_meta:
+        response.headers['X-Artifact-Id'] = artifact_meta["id"]
+    return response
+
+def _save_artifact(owner_id, audio_bytes):
+    """Persist a buffered generation; failures only cost the retry ability, never the response."""
+    if not artifact_store:
+        return None
+    try:
+        return artifact_store.save(owner_id, audio_bytes)
+    except Exception as e:
+        print(f"Could not store artifact: {e}")
+        return None
+
+def _open_artifact_writer(owner_id):
+    if not artifact_store:
+        return None
+    try:
+        return artifact_store.writer(owner_id)
+    except Exception as e:
+        print(f"Could not start artifact: {e}")
+        return None
+
+def _pipelined_memo_response(sentences, voice_id, model_id, voice_settings, on_text_complete, artifact=None):
+    """Synthesize each sentence as soon as Gemini finishes it and stream the MP3 segments in order.
+
+    A producer thread consumes the sentence generator and submits one TTS call per sentence, so
+    synthesis of the first sentence overlaps with generation of the next ones. The first segment is
+    awaited before answering so TTS errors still map to a JSON error with the upstream status.
+    `on_text_complete(delivered_text)` is called once the stream ends, with the sentences whose audio
+    was actually delivered (quota accounting); it is not called when nothing was.
+    A failed segment or a client that goes away (without an artifact to finish) stops the producer:
+    no further sentences are generated or synthesized.
+    An optional artifact writer persists the concatenated segments, as in _relay_tts_stream.
+    """
+    tts_url = ELEVEN_TTS_URL_TEMPLATE.format(voice_id=voice_id)
+    segments = queue.Queue()  # (future, sentence), then done
+    done = object()
+    stop = threading.Event()
+
+    def synthesize(sentence, previous_text):
+        payload = {"text": sentence, "model_id": model_id, "voice_settings": voice_settings}
+        if previous_text:
+            payload["previous_text"] = previous_text  # Keeps intonation continuous across segments
+        with stage_timer("tts"):
+            resp = eleven_client.post(tts_url, json=payload)
+            resp.raise_for_status()
+            return resp.content
+
+    def produce():
+        spoken = []
+        try:
+            for sentence in sentences:
+                if stop.is_set():
+                    print(f"Pipeline: stopped after {len(spoken)} sentences")
+                    break
+                print(f"Pipeline: synthesizing sentence {len(spoken) + 1}: '{sentence[:60]}'")
+                future = tts_pipeline_executor.submit(bind_deadline(synthesize), sentence, " ".join(spoken))
+                segments.put((future, sentence))
+                if stop.is_set():
+                    future.cancel()  # Raced with cancel_pending()
+                spoken.append(sentence)
+        except Exception as e:
+            print(f"Pipeline: sentence generation failed: {e}")
+            traceback.print_exc()
+        finally:
+            if stop.is_set() and hasattr(sentences, "close"):
+                sentences.close()  # Ends the Gemini stream too
+            segments.put(done)
+
+    def cancel_pending():
+        """Stop the producer and drop the TTS calls it queued that have not started yet."""
+        stop.set()
+        while True:
+            try:
+                item = segments.get_nowait()
+            except queue.Empty:
+                return
+            if item is not done:
+                item[0].cancel()
+
+    def charge_delivered(delivered):
+        if delivered:
+            try:
+                on_text_complete(" ".join(delivered))
+            except Exception as e:
+                print(f"Pipeline: quota update failed: {e}")
+                traceback.print_exc()
+
+    # The producer and the TTS calls keep the memo deadline of the request that started them
+    threading.Thread(target=bind_deadline(produce), name="thought-pipeline", daemon=True).start()
+
+    first_wait_started = time.perf_counter()
+    first = segments.get()
+    if first is done:
+        if artifact:
+            artifact.abort()
+        return jsonify({"error": "Error al generar audio: no text was generated"}), 500
+    first_future, first_sentence = first
+    try:
+        first_audio = first_future.result()
+    except requests.HTTPError as e:
+        cancel_pending()
+        if artifact:
+            artifact.abort()
+        error_msg = f"Error al generar voz: {e.response.text}"
+        print(f"ERROR TTS: {error_msg}")
+        return jsonify({"error": error_msg}), e.response.status_code
+    except (UpstreamUnavailable, requests.RequestException) as e:
+        # Open circuit, memo deadline spent or ElevenLabs unreachable: nothing was delivered or charged
+        cancel_pending()
+        if artifact:
+            artifact.abort()
+        print(f"ERROR TTS pipeline first segment: {e}")
+        status_code = e.status_code if isinstance(e, UpstreamUnavailable) else 503
+        retry_after = (e.retry_after if isinstance(e, UpstreamUnavailable) else None) or 1
+        return jsonify({"error": f"Error al generar voz: {e}"}), status_code, {"Retry-After": str(retry_after)}
+
+    # Gemini's first sentence plus its TTS: what the client waits for before audio starts
+    record_stage("first_segment", time.perf_counter() - first_wait_started)
+
+    def remaining_segments():
+        while True:
+            item = segments.get()
+            if item is done:
+                return
+            future, sentence = item
+            yield future.result(), sentence
+
+    finished = threading.Event()  # Set by whichever cleanup runs first: the generator's or call_on_close
+
+    def relay_segments():
+        bytes_sent = len(first_audio)
+        completed = False
+        delivered = [first_sentence]  # Sent to the client, or kept in the artifact
+        pending = remaining_segments()
+        try:
+            if artifact:
+                artifact.write(first_audio)
+            yield first_audio
+            for audio, sentence in pending:
+                bytes_sent += len(audio)
+                if artifact:
+                    artifact.write(audio)
+                delivered.append(sentence)
+                yield audio
+            completed = True
+        except GeneratorExit:
+            if artifact:
+                # Client gone: keep collecting the segments so the memo can be fetched as an artifact
+                try:
+                    for audio, sentence in pending:
+                        artifact.write(audio)
+                        delivered.append(sentence)
+                    completed = True
+                except Exception as e:
+                    print(f"ERROR TTS pipeline segment failed while finishing artifact: {e}")
+                    cancel_pending()
+            else:
+                cancel_pending()
+        except Exception as e:
+            # Headers are already sent: end the stream with the segments delivered so far
+            print(f"ERROR TTS pipeline segment failed after {bytes_sent} bytes: {e}")
+            cancel_pending()
+        finally:
+            finished.set()
+            if artifact:
+                artifact.commit() if completed else artifact.abort()
+            BYTES_STREAMED.inc(bytes_sent, mode="pipeline")
+            charge_delivered(delivered)
+        print(f"Pipelined TTS finished, {bytes_sent} bytes relayed")
+
+    response = Response(
+        stream_with_context(relay_segments()),
+        mimetype='audio/mpeg',
+        headers=_streaming_headers(artifact),
+    )
+
+    @response.call_on_close
+    def release_unstarted_pipeline():
+        # Client gone before the first segment was sent (the generator's finally never runs): stop the
+        # producer and its queued TTS calls, drop the artifact and charge nothing, as nothing was delivered
+        if not finished.is_set():
+            finished.set()
+            cancel_pending()
+            if artifact:
+                artifact.abort()
+            print("Pipelined TTS closed before the first segment")
+
+    return response
 
 @app.route('/generate-audio-cloned', methods=['POST'])
 @token_required
+@admission_required("generate", per_user=GENERATE_RATE_PER_USER, per_ip=GENERATE_RATE_PER_IP, upstream=True)
+@with_deadline(MEMO_DEADLINE_SECONDS)
 def generate_audio():
     """Endpoint para generar audio. Soporta form-data (HTML) y JSON (Swift app)."""
     topic_str = None
     value_str = None
+    stream_requested = request.args.get('stream', '')
+    pipeline_requested = request.args.get('pipeline', '')
+    response_mode = request.args.get('response', '')
     
     # Default values for voice settings
     stability_val = g.current_user.get("settings", {}).get("stability", 0.7)
@@ -346,6 +1186,9 @@ def generate_audio():
         
         topic_str = data.get('topic')
         value_str = data.get('value')
+        stream_requested = data.get('stream', stream_requested)
+        pipeline_requested = data.get('pipeline', pipeline_requested)
+        response_mode = data.get('response', response_mode)
         
         # Allow numbers directly from JSON for these settings, or strings that can be converted
         stability_input = data.get('stability', stability_val) # Use user's default if not provided
@@ -366,6 +1209,9 @@ def generate_audio():
 
         topic_str = request.form.get('topic')
         value_str = request.form.get('value')
+        stream_requested = request.form.get('stream', stream_requested)
+        pipeline_requested = request.form.get('pipeline', pipeline_requested)
+        response_mode = request.form.get('response', response_mode)
         
         stability_form_str = request.form.get('stability', str(stability_val))
         similarity_boost_form_str = request.form.get('similarity_boost', str(similarity_boost_val))
@@ -382,7 +1228,14 @@ def generate_audio():
     
     topic = topic_str.strip()
     value = value_str.strip()
-
+    # stream=true relays the MP3 chunk by chunk (chunked transfer) instead of waiting for the full file
+    stream_audio = stream_requested is True or str(stream_requested).strip().lower() in ('true', '1')
+    # pipeline=true overlaps Gemini generation with TTS sentence by sentence (always streamed)
+    pipeline_audio = pipeline_requested is True or str(pipeline_requested).strip().lower() in ('true', '1')
+    # response=json (buffered mode) answers with the artifact ID instead of the MP3; fetch it from /artifacts/<id>
+    json_response = str(response_mode).strip().lower() == 'json' and artifact_store is not None
+
+    charged_chars, charged_month = 0, None  # Refunds go to the month charge_characters charged
     try:
         user_clone_id = g.current_user.get("voice_clone_id")
         voice_id_to_use = user_clone_id if user_clone_id else (ALEX_LATORRE_VOICE_ID or get_alex_latorre_voice_id())
@@ -391,31 +1244,11 @@ def generate_audio():
             username = g.current_user.get("username", "user")
             return jsonify({"error": f"Voice clone for '{username}' not found and default voice unavailable. Please check backend logs."}), 500
 
-        # Determine prompt start phrase and fallback text based on language
-        prompt_start_phrase = "Okay, so..."
-        inappropriate_fallback_text = "This morning I woke up thinking about how interesting magic is and how it can surprise people."
-        if user_language.lower().startswith("es") or user_language.lower() == "spanish":
-            prompt_start_phrase = "Okay, entonces..." # Or "Bueno, pues..." or "A ver..."
-            inappropriate_fallback_text = "Esta mañana me desperté pensando en lo interesante que es la magia y cómo puede sorprender a la gente."
-
-        # Check monthly character limit (5,000 characters)
-        MONTHLY_CHAR_LIMIT = 5000
-        current_user_char_count = g.current_user.get("charCount", 0)
-        last_reset = g.current_user.get("lastCharReset")
-        
-        # Check if we need to reset monthly count (if it's a new month)
-        now = datetime.utcnow()
-        if last_reset:
-            last_reset_date = last_reset if isinstance(last_reset, datetime) else datetime.fromisoformat(last_reset.replace('Z', '+00:00'))
-            # Reset if it's a new month
-            if now.month != last_reset_date.month or now.year != last_reset_date.year:
-                current_user_char_count = 0
-                # Update user's character count and reset date
-                users_collection.update_one(
-                    {"_id": g.current_user['_id']}, 
-                    {"$set": {"charCount": 0, "lastCharReset": now}}
-                )
-                print(f"Reset character count for user {g.current_user.get('username')} - new month detected")
+        # Check monthly character limit (5,000 characters).
+        # Indexed point read on this month's ledger entry so over-limit users never reach Gemini;
+        # the authoritative check happens atomically when the characters are charged.
+        with stage_timer("quota_check"):
+            current_user_char_count = usage_for(usage_collection, g.current_user['_id'])
         
         # Check if user has exceeded monthly limit
         if current_user_char_count >= MONTHLY_CHAR_LIMIT:
@@ -424,66 +1257,54 @@ def generate_audio():
             }), 429 # Too Many Requests
 
 
-        if _is_likely_inappropriate(topic) or _is_likely_inappropriate(value):
-            generated_text = inappropriate_fallback_text
-            print(f"Warning: Potentially inappropriate content detected. Using safe fallback in {user_language}.")
-        else:
-            # Construct the safe_prompt with language instructions for Gemini
-            safe_prompt = f"""
-──────────  ROLE  ──────────
-You are a fully awake person who just got ready for the day — and you're recording a quick, casual voice note in {user_language}.  
-You suddenly remembered a weird dream, or had a strange passing thought, and you want to say it out loud before you forget.
+        # ElevenLabs is failing: answer now instead of spending a Gemini call on a memo that cannot be voiced
+        if eleven_client.breaker.state == resilience.OPEN:
+            retry_after = eleven_client.breaker.retry_after()
+            return jsonify({"error": "Voice generation is temporarily unavailable, please try again shortly"}), 503, {"Retry-After": str(retry_after)}
 
-────────  MUST‑HAVES  ────────
-1. **Language**: The entire note must be in {user_language}.  
-2. **Tone**: Awake, calm, and casual — like you're talking to yourself or a friend in the morning.  
-3. **Value inclusion**: The value **({value})** should be mentioned naturally by name, not forced.  
-4. **Topic as subtext**: Do **NOT** mention the topic **({topic})** — but let it guide the general mood or situation.  
-5. **Length**: One or two short sentences — max 15 seconds to read aloud.  
-6. **Emotion**: Curious, chill, or a bit puzzled — no drama or exaggeration. Think: “I just remembered something odd.”
+        flagged_input = _is_likely_inappropriate(f"{topic}\n{value}", user_language)
+        # Popular requests may already have a text waiting (and its audio cached for this voice)
+        pooled_text = None
+        if memo_pool and not flagged_input:
+            pool_gain = 0.0 if stream_audio or pipeline_audio else _background_gain(g.current_user)
+            pooled_text = memo_pool.take(user_language, topic, value,
+                                         _pool_profile(voice_id_to_use, stability_val, similarity_boost_val, pool_gain))
 
-────────  STYLE TIPS  ────────
-• Use conversational, natural speech for {user_language} — like how people talk out loud in the morning.  
-• Feel free to use a few filler words typical for the language (e.g., “no sé”, “o algo”, “creo”, “genre”, “je pense”, “kinda”, etc.).  
-• Avoid sounding too polished — contractions and incomplete thoughts are fine.  
-• Keep punctuation relaxed — ellipses, commas, or nothing at all.  
-
-────────  EXAMPLES (adjust to {user_language})  ────────
-EN:  “I was brushing my teeth and suddenly remembered this weird dream… someone was terrified of spiders, like legit panic. No idea why it came back to me.”  
-ES:  “Estaba ya vistiéndome y me vino esta imagen rarísima… alguien hablaba de arañas y se ponía super nervioso, no sé qué fue eso.”  
-FR:  “J’étais prêt à sortir et là, paf, j’me souviens d’un truc dans mon rêve… un mec flippait grave à cause des araignées. C’est revenu d’un coup.”  
-DE:  “Ich war schon fertig im Bad und plötzlich kam so ein Bild aus dem Traum hoch… irgendwer hatte mega Angst vor Spinnen. Ganz seltsam.”  
-IT:  “Stavo per uscire e all’improvviso mi è tornata in mente questa scena… qualcuno parlava dei ragni e sembrava super agitato. Boh.”
+        if flagged_input:
+            generated_text = _inappropriate_fallback_text(user_language)
+            FALLBACKS.inc(reason="inappropriate_filter")
+            print(f"Warning: Potentially inappropriate content detected. Using safe fallback in {user_language}.")
+        elif pooled_text:
+            generated_text = pooled_text
+            # The text is ready, so there is no Gemini stream to overlap with: plain streaming instead
+            stream_audio = stream_audio or pipeline_audio
+            print(f"Memo pool hit for ({user_language}, {topic}, {value})")
+        else:
+            safe_prompt = _thought_prompt(user_language, topic, value)
+            if pipeline_audio:
+                user_id = g.current_user['_id']
+                username = g.current_user.get('username')
+
+                def charge_pipelined_text(delivered_text):
+                    generated_char_count = len(delivered_text) // 2
+                    # The audio is already on its way, so the charge cannot be refused at this point
+                    _, _, new_total_count, _ = charge_characters(usage_collection, user_id, generated_char_count, enforce_limit=False)
+                    print(f"Character usage - User: {username}, This generation: {generated_char_count}, Total this month: {new_total_count}/{MONTHLY_CHAR_LIMIT}")
+
+                print(f"Using pipelined generation (Gemini streaming + per-sentence TTS) for language: {user_language}")
+                return _pipelined_memo_response(
+                    _screen_generated_sentences(_stream_thought_sentences(safe_prompt, topic, value, user_language), user_language),
+                    voice_id_to_use,
+                    ELEVENLABS_TURBO_MODEL,
+                    {"stability": stability_val, "similarity_boost": similarity_boost_val},
+                    charge_pipelined_text,
+                    artifact=_open_artifact_writer(user_id),
+                )
 
-────────  OUTPUT RULE  ────────
-Return only the voice note in {user_language}, no additional text, labels, or formatting.
-"""
-            generated_text = _generate_thought_text(safe_prompt, topic, value, user_language)
+            generated_text = _screen_generated_text(_generate_thought_text(safe_prompt, topic, value, user_language), user_language)
 
         print(f"Texto generado ({user_language}): {generated_text}")
 
-        # Count characters in generated text and update user's character count
-        generated_char_count = (len(generated_text))//2
-        new_total_count = current_user_char_count + generated_char_count
-        
-        # Update user's character count in database
-        users_collection.update_one(
-            {"_id": g.current_user['_id']}, 
-            {"$set": {"charCount": new_total_count}}
-        )
-        
-        print(f"Character usage - User: {g.current_user.get('username')}, This generation: {generated_char_count}, Total this month: {new_total_count}/{MONTHLY_CHAR_LIMIT}")
-
-        tts_url = ELEVEN_TTS_URL_TEMPLATE.format(voice_id=voice_id_to_use)
-        
-        # ElevenLabs model selection - choose the model that best fits your needs
-        # Available models (as of 2024):
-        # - "eleven_multilingual_v2" (default) - Best for multiple languages, high quality
-        # - "eleven_turbo_v2" - Faster generation, good quality, lower latency
-        # - "eleven_turbo_v2_5" - Latest turbo model with improvements
-        # - "eleven_monolingual_v1" - English only, high quality
-        # - "eleven_multilingual_v1" - Older multilingual model
-        
         # ElevenLabs model selection - choose the model that best fits your needs
         # Available models (as of 2024):
         # - "eleven_multilingual_v2" (default) - Best for multiple languages, high quality
@@ -494,6 +1315,42 @@ Return only the voice note in {user_language}, no additional text, labels, or fo
         
         # Always use Eleven Turbo v2.5 model
         model_id = ELEVENLABS_TURBO_MODEL  # Always use turbo model for fast generation
+
+        # Background ambience (user settings) is mixed in the buffered mode only: TTS comes back as raw PCM,
+        # is mixed with the pre-decoded ambience and encoded to MP3 once.
+        background_gain = 0.0 if stream_audio else _background_gain(g.current_user)
+        mix_background = background_gain > 0
+
+        # Identical requests (e.g. the safe fallback texts) are served from the audio cache:
+        # no upstream round trip and no character charge.
+        cache_key = _tts_cache_key(voice_id_to_use, model_id, generated_text, stability_val, similarity_boost_val, background_gain)
+        if cache_key:
+            cached_audio = tts_cache.get(cache_key)
+            if cached_audio is not None:
+                print(f"TTS cache hit for user {g.current_user.get('username')} (key {cache_key[:12]})")
+                if pooled_text:
+                    # Pre-rendered pool audio is still a new memo for this user, so it is charged as one
+                    granted, used_before, _, _ = charge_characters(usage_collection, g.current_user['_id'], len(generated_text) // 2)
+                    if not granted:
+                        return jsonify({
+                            "error": f"Monthly character limit of {MONTHLY_CHAR_LIMIT} characters exceeded. Used: {used_before}. Your limit will reset on the 1st of next month."
+                        }), 429
+                return _audio_file_response(cached_audio, 'hit', _save_artifact(g.current_user['_id'], cached_audio), json_response)
+
+        # Count characters in generated text and charge them: a single atomic conditional upsert on this
+        # month's ledger entry, so parallel requests from one user cannot lose updates.
+        generated_char_count = (len(generated_text))//2
+        with stage_timer("quota_check"):
+            granted, used_before, new_total_count, charged_month = charge_characters(usage_collection, g.current_user['_id'], generated_char_count)
+        if not granted:
+            return jsonify({
+                "error": f"Monthly character limit of {MONTHLY_CHAR_LIMIT} characters exceeded. Used: {used_before}. Your limit will reset on the 1st of next month."
+            }), 429
+        charged_chars = generated_char_count
+        
+        print(f"Character usage - User: {g.current_user.get('username')}, This generation: {generated_char_count}, Total this month: {new_total_count}/{MONTHLY_CHAR_LIMIT}")
+
+        tts_url = ELEVEN_TTS_URL_TEMPLATE.format(voice_id=voice_id_to_use)
         
         print(f"Using ElevenLabs model: {model_id} (Eleven Turbo v2.5) for language: {user_language}")
         
@@ -509,37 +1366,373 @@ Return only the voice note in {user_language}, no additional text, labels, or fo
             # The text itself being in the target language is key.
         }
 
-        print(f"Generando TTS con voice_id: {voice_id_to_use}, texto (primeros 100 chars): '{generated_text[:100]}...', settings: {json_payload['voice_settings']}, language context from user: {user_language}")
-        tts_resp = requests.post(tts_url, headers={**headers, 'Content-Type': 'application/json'}, json=json_payload)
+        print(f"Generando TTS con voice_id: {voice_id_to_use}, texto (primeros 100 chars): '{generated_text[:100]}...', settings: {json_payload['voice_settings']}, language context from user: {user_language}, stream: {stream_audio}")
+        if stream_audio:
+            tts_url = ELEVEN_TTS_STREAM_URL_TEMPLATE.format(voice_id=voice_id_to_use)
+        tts_params = {"output_format": ambience_mixer.output_format} if mix_background else None
+        # Streamed: time until ElevenLabs answers with headers; buffered: the whole audio body
+        with stage_timer("tts"):
+            tts_resp = eleven_client.post(tts_url, json=json_payload, params=tts_params, stream=stream_audio)
+            if not stream_audio and tts_resp.ok:
+                tts_resp.content  # Download the body inside the timer
 
         try:
             tts_resp.raise_for_status()
         except requests.HTTPError as e:
             error_msg = f"Error al generar voz: {tts_resp.text}"
             print(f"ERROR TTS: {error_msg}") # Differentiate TTS error log
+            tts_resp.close()
+            # No audio was produced: release the characters charged for it
+            refund_characters(usage_collection, g.current_user['_id'], charged_chars, charged_month)
+            user_cache.invalidate(g.current_user['_id'])
             return jsonify({"error": error_msg}), tts_resp.status_code
 
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as out:
-            out.write(tts_resp.content)
-            out_path = out.name
+        if stream_audio:
+            charged_chars = 0  # The relay settles nothing: from here on the audio is the user's
+            return _relay_tts_stream(tts_resp, cache_key, artifact=_open_artifact_writer(g.current_user['_id']))
 
-        # Schedule deletion of the temp file after sending it
-        # This requires a bit more setup (e.g., Flask's after_this_request) or handling it differently
-        # For now, it's deleted when the 'with' block for NamedTemporaryFile would normally end if delete=True
-        # Since it's delete=False, it persists. Consider a cleanup strategy for these files.
+        audio_bytes = tts_resp.content
+        cacheable = True
+        if mix_background:
+            # Still refundable: if the encode fails, the generic handler below gives the characters back
+            audio_bytes, cacheable = _mix_background(audio_bytes, background_gain)
+            print(f"Mixed background ambience at volume {background_gain}" if cacheable else "Sent the voice without background ambience")
+        charged_chars = 0  # Delivered from here on
+        if cache_key and cacheable:
+            tts_cache.put(cache_key, audio_bytes)
 
-        return send_file(out_path, mimetype='audio/mpeg', as_attachment=True, download_name='output.mp3')
+        # Kept as an artifact so a dropped download can be fetched again without regenerating
+        return _audio_file_response(audio_bytes, 'miss', _save_artifact(g.current_user['_id'], audio_bytes), json_response)
 
     except Exception as e:
         print(f"Error general en generate_audio: {e}")
-        traceback.print_exc()
+        if not isinstance(e, UpstreamUnavailable):
+            traceback.print_exc()
+        if charged_chars:
+            try:
+                refund_characters(usage_collection, g.current_user['_id'], charged_chars, charged_month)
+                user_cache.invalidate(g.current_user['_id'])
+            except Exception as refund_error:
+                print(f"Could not refund {charged_chars} characters: {refund_error}")
+        if isinstance(e, UpstreamUnavailable):
+            # Open circuit or memo deadline spent: fail fast and tell the app when to try again
+            headers = {"Retry-After": str(e.retry_after)} if e.retry_after else {}
+            return jsonify({"error": f"Error al generar audio: {str(e)}"}), e.status_code, headers
         return jsonify({"error": f"Error al generar audio: {str(e)}"}), 500
 
+class _ZipStreamSink:
+    """Write-only file object for zipfile: without tell()/seek() it writes a streamable archive (data descriptors)."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+@with_deadline(MEMO_DEADLINE_SECONDS)
+def _render_batch_item(user, voice_id, topic, value, voice_settings, background_gain):
+    """Una nota del lote: texto (Gemini o respaldo) y audio. Returns (audio_bytes, cache_status, charged_chars)."""
+    language = user.get("settings", {}).get("language", "english")
+    pooled_text = None
+    if _is_likely_inappropriate(f"{topic}\n{value}", language):
+        text = _inappropriate_fallback_text(language)
+        FALLBACKS.inc(reason="inappropriate_filter")
+    else:
+        if memo_pool:
+            pooled_text = memo_pool.take(language, topic, value, _pool_profile(
+                voice_id, voice_settings["stability"], voice_settings["similarity_boost"], background_gain))
+        text = pooled_text or _screen_generated_text(
+            _generate_thought_text(_thought_prompt(language, topic, value), topic, value, language), language)
+
+    model_id = ELEVENLABS_TURBO_MODEL
+    cache_key = _tts_cache_key(voice_id, model_id, text, voice_settings["stability"], voice_settings["similarity_boost"], background_gain)
+    cached_audio = tts_cache.get(cache_key) if cache_key else None
+    if cached_audio is not None:
+        # Pre-rendered pool audio is charged like a generated memo
+        return cached_audio, 'hit', len(text) // 2 if pooled_text else 0
+    audio_bytes = _render_tts(voice_id, model_id, text, voice_settings, background_gain, cache_key)
+    return audio_bytes, 'miss', len(text) // 2
+
+def _settle_batch_characters(user, reserved_chars, reserved_month, used_chars):
+    """Replace the up-front reservation (charged to `reserved_month`) with the characters the batch actually generated."""
+    user_id = user['_id']
+    try:
+        if used_chars < reserved_chars:
+            refund_characters(usage_collection, user_id, reserved_chars - used_chars, reserved_month)
+        elif used_chars > reserved_chars:
+            # The audio already exists, so the difference cannot be refused
+            charge_characters(usage_collection, user_id, used_chars - reserved_chars, enforce_limit=False)
+        print(f"Character usage - User: {user.get('username')}, This batch: {used_chars} (reserved {reserved_chars})")
+    except Exception as e:
+        print(f"Could not settle batch characters (reserved {reserved_chars}, used {used_chars}): {e}")
+
+def _run_memo_batch(user, voice_id, items, voice_settings, concurrency, reserved_chars, reserved_month, settled):
+    """Run (index, topic, value) items on batch_executor with at most `concurrency` in flight.
+
+    Yields (index, audio_bytes or None, result) in completion order. When the generator finishes or is
+    closed (client gone), items not started yet are cancelled, running ones are waited for, and the
+    reservation is settled against the characters actually generated; then `settled` (an Event) is set.
+    A generator closed before it ever started never gets there: its caller settles it instead.
+    """
+    background_gain = _background_gain(user)
+    remaining = iter(items)
+    in_flight = {}
+    used_chars = 0
+
+    def submit_next():
+        for index, topic, value in remaining:
+            future = batch_executor.submit(_render_batch_item, user, voice_id, topic, value, voice_settings, background_gain)
+            in_flight[future] = index
+            return
+
+    try:
+        for _ in range(concurrency):
+            submit_next()
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = in_flight.pop(future)
+                submit_next()
+                try:
+                    audio_bytes, cache_status, chars = future.result()
+                except requests.HTTPError as e:
+                    upstream = e.response
+                    status_code = upstream.status_code if upstream is not None else 502
+                    detail = upstream.text if upstream is not None else str(e)
+                    print(f"ERROR TTS (batch item {index}): {detail}")
+                    yield index, None, {"index": index, "status": "error", "status_code": status_code, "error": f"Error al generar voz: {detail}"}
+                    continue
+                except UpstreamUnavailable as e:
+                    print(f"Elemento {index} del lote sin generar: {e}")
+                    yield index, None, {"index": index, "status": "error", "status_code": e.status_code, "error": f"Error al generar audio: {str(e)}"}
+                    continue
+                except Exception as e:
+                    print(f"Error en el elemento {index} del lote: {e}")
+                    traceback.print_exc()
+                    yield index, None, {"index": index, "status": "error", "status_code": 500, "error": f"Error al generar audio: {str(e)}"}
+                    continue
+                used_chars += chars
+                yield index, audio_bytes, {"index": index, "status": "ok", "cache": cache_status, "characters": chars}
+    finally:
+        for future in in_flight:
+            future.cancel()
+        # Items already running still cost upstream characters
+        for future in in_flight:
+            if not future.cancelled():
+                try:
+                    used_chars += future.result()[2]
+                except Exception:
+                    pass
+        _settle_batch_characters(user, reserved_chars, reserved_month, used_chars)
+        settled.set()
+
+def _batch_item_count():
+    """Admission cost of a batch: one generate token per item (a malformed body costs 1 and gets its 400)."""
+    data = request.get_json(silent=True)
+    items = data.get('items') if isinstance(data, dict) else None
+    return max(1, min(len(items), BATCH_MAX_ITEMS)) if isinstance(items, list) else 1
+
+@app.route('/generate-audio-batch', methods=['POST'])
+@token_required
+@admission_required("generate", per_user=GENERATE_RATE_PER_USER, per_ip=GENERATE_RATE_PER_IP, upstream=True,
+                    cost=_batch_item_count)
+def generate_audio_batch():
+    """Genera varias notas de voz (lista de topic/value) con la voz del usuario.
+
+    JSON body: {"items": [{"topic", "value"}, ...], "format": "artifacts" | "zip", "concurrency",
+    "stability", "similarity_boost"}. Quota is reserved once for the whole batch and results are
+    streamed as items finish: NDJSON lines with artifact IDs, or a zip with one MP3 per item plus
+    manifest.json. A failed item is reported on its own line/manifest entry; the batch goes on.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('items'), list) or not data['items']:
+        return jsonify({"error": "Request body must be JSON with a non-empty 'items' list of {topic, value}"}), 400
+    if len(data['items']) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"At most {BATCH_MAX_ITEMS} items per batch"}), 400
+
+    output_format = str(data.get('format', 'artifacts')).strip().lower()
+    if output_format not in ('artifacts', 'zip'):
+        return jsonify({"error": "'format' must be 'artifacts' or 'zip'"}), 400
+    if output_format == 'artifacts' and not artifact_store:
+        return jsonify({"error": "Artifacts are disabled on this server, use format=zip"}), 400
+
+    user = g.current_user
+    user_settings = user.get("settings", {})
+    try:
+        voice_settings = {
+            "stability": float(data.get('stability', user_settings.get("stability", 0.7))),
+            "similarity_boost": float(data.get('similarity_boost', user_settings.get("voice_similarity", 0.85))),
+        }
+        concurrency = max(1, min(BATCH_CONCURRENCY, int(data.get('concurrency', BATCH_CONCURRENCY))))
+    except (ValueError, TypeError):
+        return jsonify({"error": "Los parámetros 'stability', 'similarity_boost' y 'concurrency' deben ser números válidos"}), 400
+
+    items = []
+    invalid = []
+    for index, item in enumerate(data['items']):
+        topic = item.get('topic') if isinstance(item, dict) else None
+        value = item.get('value') if isinstance(item, dict) else None
+        if not isinstance(topic, str) or not topic.strip() or not isinstance(value, str) or not value.strip():
+            invalid.append({"index": index, "status": "error", "status_code": 400,
+                            "error": "'topic' y 'value' son requeridos y deben ser strings no vacíos"})
+        else:
+            items.append((index, topic.strip(), value.strip()))
+
+    voice_id_to_use = user.get("voice_clone_id") or ALEX_LATORRE_VOICE_ID or get_alex_latorre_voice_id()
+    if not voice_id_to_use:
+        return jsonify({"error": f"Voice clone for '{user.get('username', 'user')}' not found and default voice unavailable. Please check backend logs."}), 500
+
+    current_user_char_count = usage_for(usage_collection, user['_id'])
+    if current_user_char_count >= MONTHLY_CHAR_LIMIT:
+        return jsonify({
+            "error": f"Monthly character limit of {MONTHLY_CHAR_LIMIT} characters exceeded. Used: {current_user_char_count}. Your limit will reset on the 1st of next month."
+        }), 429
+
+    # One conditional charge for the whole batch; settled with the real text lengths when it ends
+    reserved_chars = BATCH_RESERVE_CHARS_PER_ITEM * len(items)
+    reserved_month = None
+    if reserved_chars:
+        with stage_timer("quota_check"):
+            granted, used_before, _, reserved_month = charge_characters(usage_collection, user['_id'], reserved_chars)
+        if not granted:
+            return jsonify({
+                "error": f"Monthly character limit of {MONTHLY_CHAR_LIMIT} characters exceeded. Used: {used_before}. Your limit will reset on the 1st of next month."
+            }), 429
+
+    print(f"Batch generation for user {user.get('username')}: {len(items)} items ({len(invalid)} invalid), concurrency {concurrency}, format {output_format}")
+    settled = threading.Event()
+    batch = _run_memo_batch(user, voice_id_to_use, items, voice_settings, concurrency, reserved_chars, reserved_month, settled)
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+    def summary(results):
+        succeeded = sum(1 for r in results if r["status"] == "ok")
+        return {"done": True, "items": len(results), "succeeded": succeeded, "failed": len(results) - succeeded,
+                "characters": sum(r.get("characters", 0) for r in results)}
+
+    def ndjson_lines():
+        results = list(invalid)
+        try:
+            for result in invalid:
+                yield json.dumps(result) + "\n"
+            for index, audio_bytes, result in batch:
+                if audio_bytes is not None:
+                    artifact_meta = _save_artifact(user['_id'], audio_bytes)
+                    if artifact_meta:
+                        result.update(_describe_artifact(artifact_meta))
+                    else:
+                        result.update(status="error", status_code=500, error="Could not store the generated audio")
+                results.append(result)
+                yield json.dumps(result) + "\n"
+            yield json.dumps(summary(results)) + "\n"
+        finally:
+            batch.close()
+
+    def zip_chunks():
+        results = list(invalid)
+        sink = _ZipStreamSink()
+        try:
+            with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as archive:
+                for index, audio_bytes, result in batch:
+                    if audio_bytes is not None:
+                        result["file"] = f"memo-{index + 1:02d}.mp3"
+                        archive.writestr(result["file"], audio_bytes)
+                        BYTES_STREAMED.inc(len(audio_bytes), mode="batch_zip")
+                    results.append(result)
+                    yield sink.drain()
+                manifest = {"results": sorted(results, key=lambda r: r["index"]), **summary(results)}
+                archive.writestr("manifest.json", json.dumps(manifest, indent=2))
+            yield sink.drain()
+        finally:
+            batch.close()
+
+    if output_format == 'zip':
+        headers["Content-Disposition"] = "attachment; filename=memos.zip"
+        response = Response(zip_chunks(), mimetype='application/zip', headers=headers)
+    else:
+        response = Response(ndjson_lines(), mimetype='application/x-ndjson', headers=headers)
+
+    @response.call_on_close
+    def release_unstarted_batch():
+        # Client gone before the batch was first advanced (even if the invalid-item lines were sent):
+        # closing a generator that never started skips its finally, so give the whole reservation back here
+        batch.close()
+        if not settled.is_set():
+            _settle_batch_characters(user, reserved_chars, reserved_month, 0)
+            settled.set()
+
+    return response
+
+@app.route('/artifacts/<artifact_id>', methods=['GET'])
+@token_required
+def get_artifact(artifact_id):
+    """Download a generated memo again. Supports Range, ETag and If-None-Match (resume and seek)."""
+    meta = artifact_store.get(artifact_id) if artifact_store else None
+    # Other users' artifacts look the same as missing ones
+    if not meta or meta.get("owner") != str(g.current_user['_id']):
+        return jsonify({"error": "Artifact not found or expired"}), 404
+
+    response = send_file(
+        artifact_store.audio_path(artifact_id),
+        mimetype=meta.get("mimetype", "audio/mpeg"),
+        download_name='output.mp3',
+        conditional=True,
+        etag=meta["etag"],
+        last_modified=meta["created_at"],
+    )
+    response.cache_control.no_cache = None
+    response.cache_control.private = True
+    response.cache_control.max_age = max(0, int(meta["expires_at"] - time.time()))
+    return response
+
 # --- User Authentication Endpoints ---
 
+# bcrypt corre en un pool de procesos acotado (ver password_hashing.py) para no bloquear los workers
+password_hasher = PasswordHasher()
+
+def password_hasher_busy_response():
+    """503 returned when the password hashing queue is full."""
+    response = jsonify({"error": "Server is busy, please try again in a moment"})
+    response.headers["Retry-After"] = "1"
+    return response, 503
+
+def duplicate_key_field(error):
+    """Name of the unique field that caused a DuplicateKeyError (e.g. 'username' or 'email')."""
+    key_pattern = (error.details or {}).get("keyPattern") or (error.details or {}).get("keyValue") or {}
+    if key_pattern:
+        return next(iter(key_pattern))
+    # Older servers only report the index name in the message
+    match = re.search(r"index: (\w+?)_\d", str(error))
+    return match.group(1) if match else None
+
+def release_activation_code(code_id, user_id):
+    """Compensation: give back an activation code claimed by a registration that did not complete."""
+    try:
+        activation_codes.release_registration(code_id, user_id)
+    except Exception as e:
+        print(f"Could not release activation code {code_id}: {e}")
+
+def release_password_reset_code(code_id, claimed_at):
+    """Compensation: undo a password-reset claim on an activation code when the reset did not happen."""
+    try:
+        activation_codes.release_password_reset(code_id, claimed_at)
+    except Exception as e:
+        print(f"Could not release activation code {code_id}: {e}")
+
+# The deliverability check is a DNS lookup per registration; offline runs (benchmarks) turn it off
+EMAIL_CHECK_DELIVERABILITY = os.getenv("EMAIL_CHECK_DELIVERABILITY", "true").strip().lower() in ("true", "1")
+
 def is_valid_email(email):
     try:
-        validate_email(email)
+        validate_email(email, check_deliverability=EMAIL_CHECK_DELIVERABILITY)
         return True
     except EmailNotValidError:
         return False
@@ -561,20 +1754,21 @@ def register():
     if not is_valid_email(email):
         return jsonify({"error": "Invalid email format"}), 400
 
-    # Validate activation code
-    activation_code = activation_codes_collection.find_one({"code": activation_code_str})
+    # Claim the activation code atomically: only one registration can flip used -> True
+    user_id = ObjectId()
+    now = datetime.utcnow()
+    activation_code = activation_codes.claim_for_registration(activation_code_str, user_id, now)
     if not activation_code:
+        # Only on failure: one lookup to tell an unknown code from a used one
+        if activation_codes.exists(activation_code_str):
+            return jsonify({"error": "Activation code already used"}), 400
         return jsonify({"error": "Invalid activation code"}), 400
-    if activation_code.get("used"):
-        return jsonify({"error": "Activation code already used"}), 400
 
-    # Check for existing user
-    if users_collection.find_one({"username": username}):
-        return jsonify({"error": "Username already exists"}), 409 # 409 Conflict
-    if users_collection.find_one({"email": email}):
-        return jsonify({"error": "Email already exists"}), 409
-
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    try:
+        hashed_password = password_hasher.hash(password)
+    except PasswordHasherBusy:
+        release_activation_code(activation_code['_id'], user_id)
+        return password_hasher_busy_response()
     
     # Default user settings
     default_settings = {
@@ -586,32 +1780,35 @@ def register():
     }
 
     user_data = {
+        "_id": user_id,
         "username": username,
         "email": email,
         "password": hashed_password,
-        "created_at": datetime.utcnow(),
+        "created_at": now,
         "settings": default_settings, # Add default settings
         "voice_clone_id": None, # Initialize voice_clone_id
         "voice_ids": [], # Initialize voice_ids list for multiple cloned voices
-        "loggedIn": False, # Initialize as not logged in
-        "charCount": 0, # Initialize character count for monthly limits
-        "lastCharReset": datetime.utcnow() # Track when character count was last reset
+        "loggedIn": False # Initialize as not logged in
+        # Monthly character usage lives in usage_collection, created by the first charge
     }
     
     try:
-        result = users_collection.insert_one(user_data)
-        # Mark activation code as used
-        activation_codes_collection.update_one(
-            {"_id": activation_code['_id']},
-            {"$set": {"used": True, "used_by": result.inserted_id, "used_at": datetime.utcnow()}}
-        )
-        return jsonify({"message": "User registered successfully", "user_id": str(result.inserted_id)}), 201
+        # Duplicate usernames/emails are rejected by the unique indexes (ensure_indexes), no pre-queries needed
+        users.create(user_data)
+        return jsonify({"message": "User registered successfully", "user_id": str(user_id)}), 201
+    except DuplicateKeyError as e:
+        release_activation_code(activation_code['_id'], user_id)
+        if duplicate_key_field(e) == "email":
+            return jsonify({"error": "Email already exists"}), 409
+        return jsonify({"error": "Username already exists"}), 409 # 409 Conflict
     except Exception as e:
         print(f"Error during user registration: {e}")
         traceback.print_exc()
+        release_activation_code(activation_code['_id'], user_id)
         return jsonify({"error": "Registration failed due to a server error"}), 500
 
 @app.route('/login', methods=['POST'])
+@admission_required("login", per_ip=LOGIN_RATE_PER_IP)
 def login():
     data = request.get_json()
     if not data:
@@ -623,10 +1820,20 @@ def login():
     if not email_or_username or not password:
         return jsonify({"error": "Missing email/username or password"}), 400
 
+    # Password guessing against one account from many addresses
+    retry_after = admission.check("login_account", str(email_or_username).strip().lower(), *LOGIN_RATE_PER_ACCOUNT)
+    if retry_after:
+        return too_many_requests_response(retry_after)
+
     # Try to find user by email or username
-    user = users_collection.find_one({"$or": [{"email": email_or_username}, {"username": email_or_username}]})
+    user = users.find_for_login(email_or_username)
 
-    if user and bcrypt.checkpw(password.encode('utf-8'), user['password']):
+    try:
+        password_ok = bool(user) and password_hasher.check(password, user['password'])
+    except PasswordHasherBusy:
+        return password_hasher_busy_response()
+
+    if password_ok:
         # Check if user is already logged in
         if user.get('loggedIn', False):
             return jsonify({"error": "User is already logged in from another device. Please sign out from the other device first."}), 409
@@ -641,10 +1848,15 @@ def login():
             token = jwt.encode(token_payload, app.config['JWT_SECRET_KEY'], algorithm='HS256')
             
             # Set loggedIn to True
-            users_collection.update_one(
-                {"_id": user['_id']}, 
-                {"$set": {"loggedIn": True}}
-            )
+            new_hash = None
+            # Re-hash transparently when BCRYPT_ROUNDS changed since the password was stored
+            if password_hasher.needs_rehash(user['password']):
+                try:
+                    new_hash = password_hasher.hash(password)
+                except PasswordHasherBusy:
+                    pass  # Keep the old hash; it will be upgraded on a later login
+            users.mark_logged_in(user['_id'], new_hash)
+            user_cache.invalidate(user['_id'])
             
             return jsonify({"message": "Login successful", "token": token}), 200
         except Exception as e:
@@ -663,7 +1875,7 @@ def verify_activation_code_endpoint():
     if not code_str:
         return jsonify({"error": "Missing 'code' parameter"}), 400
 
-    activation_code = activation_codes_collection.find_one({"code": code_str})
+    activation_code = activation_codes.find_status(code_str)
 
     if not activation_code:
         return jsonify({"valid": False, "message": "Activation code not found"}), 404
@@ -673,6 +1885,7 @@ def verify_activation_code_endpoint():
 
     return jsonify({"valid": True, "message": "Activation code is valid"}), 200
 
+
 # Add endpoint for forgot password functionality
 @app.route('/reset-password', methods=['POST'])
 def reset_password():
@@ -695,48 +1908,33 @@ def reset_password():
     #     return jsonify({"error": "Password must be at least 6 characters long"}), 400
 
     try:
-        # Validate activation code
-        activation_code = activation_codes_collection.find_one({"code": activation_code_str})
+        # Claim the activation code for this reset atomically (one reset per code)
+        claimed_at = datetime.utcnow()
+        activation_code = activation_codes.claim_for_password_reset(activation_code_str, claimed_at)
         if not activation_code:
+            if activation_codes.exists(activation_code_str):
+                return jsonify({"error": "Activation code has already been used for password reset"}), 400
             return jsonify({"error": "Invalid activation code"}), 400
-        
-        # Check if activation code was already used for password reset
-        if activation_code.get("used_for_password_reset"):
-            return jsonify({"error": "Activation code has already been used for password reset"}), 400
 
-        # Find user by email
-        user = users_collection.find_one({"email": email})
+        # Hash the new password
+        try:
+            hashed_password = password_hasher.hash(new_password)
+        except PasswordHasherBusy:
+            release_password_reset_code(activation_code['_id'], claimed_at)
+            return password_hasher_busy_response()
+        
+        # Update user password and set loggedIn to False (logout from all devices) in the same call that finds the user
+        try:
+            user = users.reset_password(email, hashed_password)
+        except Exception:
+            release_password_reset_code(activation_code['_id'], claimed_at)
+            raise
         if not user:
+            release_password_reset_code(activation_code['_id'], claimed_at)
             return jsonify({"error": "No user found with this email address"}), 404
+        user_cache.invalidate(user['_id'])
 
-        # Hash the new password
-        hashed_password = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
-        
-        # Update user password and set loggedIn to False (logout from all devices)
-        result = users_collection.update_one(
-            {"_id": user['_id']}, 
-            {
-                "$set": {
-                    "password": hashed_password,
-                    "loggedIn": False  # Force logout from all devices
-                }
-            }
-        )
-        
-        if result.modified_count == 0:
-            return jsonify({"error": "Failed to update password"}), 500
-
-        # Mark activation code as used for password reset
-        activation_codes_collection.update_one(
-            {"_id": activation_code['_id']},
-            {
-                "$set": {
-                    "used_for_password_reset": True,
-                    "password_reset_by": user['_id'],
-                    "password_reset_at": datetime.utcnow()
-                }
-            }
-        )
+        activation_codes.record_password_reset(activation_code['_id'], user['_id'])
 
         print(f"Password reset successful for user: {user.get('username')} ({email})")
         return jsonify({"message": "Password reset successful. Please log in with your new password."}), 200
@@ -746,116 +1944,249 @@ def reset_password():
         traceback.print_exc()
         return jsonify({"error": "Password reset failed due to a server error"}), 500
 
+# Map app language name to ElevenLabs language codes
+# (Refer to ElevenLabs documentation for the full list of supported codes: https://elevenlabs.io/docs/speech-synthesis/voice-cloning#supported-languages)
+CLONE_LANGUAGE_CODES = {
+    "english": "en", "spanish": "es", "french": "fr", "german": "de",
+    "italian": "it", "portuguese": "pt", "polish": "pl", "hindi": "hi",
+    "arabic": "ar", "japanese": "ja", "chinese": "zh", "korean": "ko",
+    "dutch": "nl", "turkish": "tr", "swedish": "sv", "indonesian": "id",
+    "filipino": "fil", "vietnamese": "vi", "ukrainian": "uk", "greek": "el",
+    "czech": "cs", "finnish": "fi", "romanian": "ro", "danish": "da",
+    "bulgarian": "bg", "malay": "ms", "slovak": "sk", "croatian": "hr",
+    "classic arabic": "ar", # Example if specific variants needed
+    "tamil": "ta", "russian": "ru" # Added Russian
+}
+
+def _begin_clone_upload(existing_id):
+    """Parse a clone upload up to the first bytes of its 'audio' part.
+
+    Returns (early_response, None) when the request is answered without cloning (existing voice, invalid
+    upload), else (None, upload) with the overwrite flag, filename, content_type and a `chunks` iterator.
+    The upload is streamed (no temp file, bounded memory): request.files/request.values would spool the
+    whole body first, so only the part before the audio is read here.
+    """
+    upload, audio_part, upload_error = None, None, None
+    try:
+        if request.content_length and request.content_length > CLONE_UPLOAD_MAX_BYTES:
+            raise UploadRejected(f"Upload exceeds the {CLONE_UPLOAD_MAX_BYTES / (1024 * 1024):g} MB limit", 413)
+        upload = StreamingMultipartUpload(request.stream, request.content_type)
+        audio_part = upload.next_file('audio')
+    except UploadRejected as e:
+        upload_error = e
+
+    form_fields = upload.fields if upload else {}
+    overwrite = request.args.get('overwrite', form_fields.get('overwrite', 'false')).strip().lower() in ('true', '1')
+
+    if existing_id and not overwrite:
+        return (jsonify({"voice_clone_id": existing_id, "message": "Existing voice clone ID returned."}), 200), None
+
+    if upload_error:
+        return (jsonify({"error": str(upload_error)}), upload_error.status_code), None
+    if audio_part is None:
+        return (jsonify({"error": "Missing 'audio' file"}), 400), None
+
+    filename, content_type = audio_part
+    if filename == '':
+        return (jsonify({"error": "No selected file"}), 400), None
+    if not content_type_allowed(content_type):
+        return (jsonify({"error": f"Unsupported audio content type '{content_type}'"}), 415), None
+
+    audio_data = upload.iter_file_data()
+    try:
+        first_chunk = next(audio_data, b"")
+    except UploadRejected as e:
+        return (jsonify({"error": str(e)}), e.status_code), None
+    if not first_chunk:
+        return (jsonify({"error": "Uploaded audio file is empty"}), 400), None
+
+    def audio_chunks():
+        yield first_chunk
+        yield from audio_data
+
+    return None, {
+        "overwrite": overwrite,
+        "filename": filename,
+        "content_type": content_type,
+        "chunks": audio_chunks(),
+        "stream": upload,
+    }
+
+def _preprocess_clone_sample(raw_audio, filename, content_type):
+    """Run the voice preprocessing stage; returns (upload_body, filename, content_type) to send upstream."""
+    processed = voice_preprocessor.process(raw_audio, filename) if voice_preprocessor else None
+    if not processed:
+        return [raw_audio], filename, content_type
+    processed_audio, preprocess_stats = processed
+    print(f"Voice sample preprocessed: {preprocess_stats}")
+    return [processed_audio], f"{os.path.splitext(filename)[0] or 'voice'}.mp3", "audio/mpeg"
+
+def _delete_previous_clone(user, existing_id):
+    """Delete the user's old clone from ElevenLabs before creating its replacement (failures are not fatal)."""
+    delete_url = ELEVEN_VOICE_URL_TEMPLATE.format(voice_id=existing_id)
+    try:
+        del_resp = eleven_client.delete(delete_url)
+        del_resp.raise_for_status()
+        print(f"Successfully deleted old voice clone {existing_id} for user {user.get('username')}")
+        users.clear_voice_clone(user['_id'])
+        user_cache.invalidate(user['_id'])
+    except requests.exceptions.RequestException as e:
+        print(f"Failed to delete old voice clone {existing_id} from ElevenLabs: {e}. Proceeding to create a new one.")
+
+def _create_voice_clone(user, filename, content_type, upload_body):
+    """Send the sample to /v1/voices/add, store the new voice_clone_id on the user and return it.
+
+    Raises requests.HTTPError for upstream errors and ValueError if no voice_id comes back.
+    """
+    user_language_setting = user.get("settings", {}).get("language", "english")
+    elevenlabs_lang_code = CLONE_LANGUAGE_CODES.get(user_language_setting.lower(), "en") # Default to 'en'
+    print(f"User language for cloning: {user_language_setting}, mapped to ElevenLabs code: {elevenlabs_lang_code}")
+
+    # The 'language' parameter for /v1/voices/add is NOT standard for v1 cloning.
+    # Language is typically inferred from the audio.
+    # The name and description can hint at the language.
+    data_payload = {
+        "name": f"{user['username']}_{elevenlabs_lang_code}", 
+        "description": f"Voice clone for user {user['username']} (Language: {user_language_setting} - {elevenlabs_lang_code})",
+        "labels": '{}', # Must be a JSON string
+        # "language": elevenlabs_lang_code # Add this if confirmed supported & beneficial for your ElevenLabs plan/version
+    }
+
+    print(f"Attempting to clone voice. Name: {data_payload['name']}. Audio language should be {user_language_setting}.")
+    body_content_type, body = multipart_body(list(data_payload.items()), 'files', filename, content_type, upload_body)
+    # Chunked upload with a one-shot body generator. The client only retries a POST on connection errors
+    # (allowed_methods keeps read/status retries to idempotent methods), and those happen while connecting,
+    # before the first body chunk is pulled: a retried attempt still sends the whole, untouched body.
+    # Once sending has started, a failure is raised and the clone fails instead of re-sending half a file.
+    resp = eleven_client.post(ELEVEN_VOICE_ADD_URL, data=body, headers={"Content-Type": body_content_type},
+                              timeout=(eleven_client.timeout[0], ELEVEN_CLONE_READ_TIMEOUT))
+    resp.raise_for_status()
+
+    voice_data = resp.json()
+    voice_id = voice_data.get('voice_id')
+    if not voice_id:
+        print(f"No 'voice_id' returned from ElevenLabs. Response: {voice_data}")
+        raise ValueError("No 'voice_id' returned from ElevenLabs")
+
+    users.set_voice_clone(user['_id'], voice_id)
+    user_cache.invalidate(user['_id'])
+    return voice_id
+
 # Endpoint to generate a voice clone from user audio
 @app.route('/generate-voice-clone', methods=['POST'])
 @token_required
+@admission_required("clone", per_user=CLONE_RATE_PER_USER, per_ip=CLONE_RATE_PER_IP, upstream=True)
 def generate_voice_clone():
-    overwrite = request.values.get('overwrite', 'false').strip().lower() in ('true', '1')
     existing_id = g.current_user.get('voice_clone_id')
-    user_language_setting = g.current_user.get("settings", {}).get("language", "english")
-
-    # Map app language name to ElevenLabs language codes
-    # (Refer to ElevenLabs documentation for the full list of supported codes: https://elevenlabs.io/docs/speech-synthesis/voice-cloning#supported-languages)
-    lang_code_map = {
-        "english": "en", "spanish": "es", "french": "fr", "german": "de",
-        "italian": "it", "portuguese": "pt", "polish": "pl", "hindi": "hi",
-        "arabic": "ar", "japanese": "ja", "chinese": "zh", "korean": "ko",
-        "dutch": "nl", "turkish": "tr", "swedish": "sv", "indonesian": "id",
-        "filipino": "fil", "vietnamese": "vi", "ukrainian": "uk", "greek": "el",
-        "czech": "cs", "finnish": "fi", "romanian": "ro", "danish": "da",
-        "bulgarian": "bg", "malay": "ms", "slovak": "sk", "croatian": "hr",
-        "classic arabic": "ar", # Example if specific variants needed
-        "tamil": "ta", "russian": "ru" # Added Russian
-    }
-    elevenlabs_lang_code = lang_code_map.get(user_language_setting.lower(), "en") # Default to 'en'
-    print(f"User language for cloning: {user_language_setting}, mapped to ElevenLabs code: {elevenlabs_lang_code}")
-
-    if existing_id and not overwrite:
-        return jsonify({"voice_clone_id": existing_id, "message": "Existing voice clone ID returned."}), 200
-    
-    if existing_id and overwrite:
-        delete_url = f"https://api.elevenlabs.io/v1/voices/{existing_id}"
+    early_response, upload = _begin_clone_upload(existing_id)
+    if early_response:
+        return early_response
+
+    filename, content_type = upload["filename"], upload["content_type"]
+    upload_body = upload["chunks"]
+    if voice_preprocessor:
+        # Preprocessing needs the whole sample: buffer it (bounded by CLONE_UPLOAD_MAX_BYTES) instead of streaming
         try:
-            del_resp = requests.delete(delete_url, headers=headers)
-            del_resp.raise_for_status()
-            print(f"Successfully deleted old voice clone {existing_id} for user {g.current_user.get('username')}")
-            users_collection.update_one({"_id": g.current_user['_id']}, {"$unset": {"voice_clone_id": ""}})
-        except requests.exceptions.RequestException as e:
-            print(f"Failed to delete old voice clone {existing_id} from ElevenLabs: {e}. Proceeding to create a new one.")
-
-    if 'audio' not in request.files:
-        return jsonify({"error": "Missing 'audio' file"}), 400
-    
-    file = request.files['audio']
-    if file.filename == '':
-        return jsonify({"error": "No selected file"}), 400
+            raw_audio = b"".join(upload_body)
+        except UploadRejected as e:
+            return jsonify({"error": str(e)}), e.status_code
+        upload_body, filename, content_type = _preprocess_clone_sample(raw_audio, filename, content_type)
 
-    temp_file_path = None
-    opened_file_for_request = None # To ensure it's closed
+    # The old clone is only deleted once a valid replacement upload is on its way
+    if existing_id and upload["overwrite"]:
+        _delete_previous_clone(g.current_user, existing_id)
 
     try:
-        # Validate audio file (basic check, more robust validation might be needed)
-        # Pydub can be heavy; consider alternatives if only simple validation is needed.
-        # For now, assume the file is reasonably valid if it gets this far.
-        # audio_seg = AudioSegment.from_file(file) 
-        # if len(audio_seg) > 5 * 60 * 1000: # Max 5 minutes for cloning
-        #     return jsonify({"error": "Audio file is too long. Maximum 5 minutes allowed for cloning."}), 400
-        # file.seek(0) 
-
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as temp:
-            file.save(temp.name)
-            temp_file_path = temp.name
-        
-        opened_file_for_request = open(temp_file_path, 'rb')
-        files_for_request = [('files', (file.filename, opened_file_for_request, file.mimetype))]
-
-        # The 'language' parameter for /v1/voices/add is NOT standard for v1 cloning.
-        # Language is typically inferred from the audio.
-        # However, some newer ElevenLabs models or Professional Voice Cloning might use it.
-        # For standard v1 cloning, it's safer to omit it if not explicitly supported or rely on audio content.
-        # If the API supports it and it's beneficial, it can be added.
-        # The name and description can hint at the language.
-        data_payload = {
-            "name": f"{g.current_user['username']}_{elevenlabs_lang_code}", 
-            "description": f"Voice clone for user {g.current_user['username']} (Language: {user_language_setting} - {elevenlabs_lang_code})",
-            "labels": '{}', # Must be a JSON string
-            # "language": elevenlabs_lang_code # Add this if confirmed supported & beneficial for your ElevenLabs plan/version
-        }
-        # If your ElevenLabs setup *requires* the language field for cloning, uncomment the line above.
-        # Otherwise, the language of the audio files themselves is the primary determinant.
-
-        print(f"Attempting to clone voice. Name: {data_payload['name']}. Audio language should be {user_language_setting}.")
-        resp = requests.post(ELEVEN_VOICE_ADD_URL, headers=headers, files=files_for_request, data=data_payload)
-        resp.raise_for_status()
-        
-        voice_data = resp.json()
-        voice_id = voice_data.get('voice_id')
-        if not voice_id:
-            print(f"No 'voice_id' returned from ElevenLabs. Response: {voice_data}")
-            return jsonify({"error": "No 'voice_id' returned from ElevenLabs"}), 500
-
-        users_collection.update_one({"_id": g.current_user['_id']}, {"$set": {"voice_clone_id": voice_id}})
-        
+        voice_id = _create_voice_clone(g.current_user, filename, content_type, upload_body)
+        print(f"Streamed {upload['stream'].bytes_received} upload bytes to ElevenLabs")
         result = {"voice_clone_id": voice_id, "message": "Voice clone created successfully."}
         return jsonify(result), 200
 
+    except UploadRejected as e:
+        # Limit hit mid-stream: the partial upstream request was abandoned
+        print(f"Voice clone upload rejected after {upload['stream'].bytes_received} bytes: {e}")
+        return jsonify({"error": str(e)}), e.status_code
     except requests.HTTPError as e:
-        error_body = resp.text if resp and hasattr(resp, 'text') else "No response body"
-        status_code = e.response.status_code if hasattr(e, 'response') else 500
+        error_body = e.response.text if e.response is not None else "No response body"
+        status_code = e.response.status_code if e.response is not None else 500
         print(f"ElevenLabs API HTTPError during cloning: {status_code} - {error_body}")
         return jsonify({"error": f"ElevenLabs API error: {error_body}"}), status_code
     except Exception as e:
         print(f"Error during voice clone: {e}")
         traceback.print_exc()
         return jsonify({"error": f"Failed to create voice clone: {str(e)}"}), 500
-    finally:
-        if opened_file_for_request:
-            opened_file_for_request.close()
-        if temp_file_path and os.path.exists(temp_file_path):
-            try:
-                os.remove(temp_file_path)
-            except Exception as e:
-                print(f"Error deleting temp file {temp_file_path}: {e}")
+
+def _run_clone_job(job, audio_path, set_stage):
+    """Clone job handler (runs in the clone job pool, outside any request)."""
+    user = users.find_profile(job["user_id"])
+    if not user:
+        raise ValueError("User no longer exists")
+
+    filename, content_type = job["filename"], job["content_type"]
+    if voice_preprocessor:
+        set_stage("preprocessing")
+        with open(audio_path, "rb") as f:
+            upload_body, filename, content_type = _preprocess_clone_sample(f.read(), filename, content_type)
+    else:
+        def read_chunks():
+            with open(audio_path, "rb") as f:
+                while True:
+                    chunk = f.read(UPLOAD_READ_CHUNK_SIZE)
+                    if not chunk:
+                        return
+                    yield chunk
+        upload_body = read_chunks()
+
+    existing_id = user.get("voice_clone_id")
+    if existing_id and job.get("overwrite"):
+        set_stage("deleting_old_voice")
+        _delete_previous_clone(user, existing_id)
+
+    set_stage("uploading")
+    try:
+        return _create_voice_clone(user, filename, content_type, upload_body)
+    except requests.HTTPError as e:
+        error_body = e.response.text if e.response is not None else "No response body"
+        raise RuntimeError(f"ElevenLabs API error: {error_body}") from e
+
+# Clonación asíncrona: la subida se guarda en disco y un pool acotado hace el trabajo con ElevenLabs,
+# así las clonaciones largas no ocupan workers HTTP. Los jobs viven en Mongo (sobreviven reinicios).
+clone_job_queue = CloneJobQueue(db.clone_jobs, _run_clone_job)
+
+@app.route('/clone-jobs', methods=['POST'])
+@token_required
+@admission_required("clone", per_user=CLONE_RATE_PER_USER, per_ip=CLONE_RATE_PER_IP)
+def create_clone_job():
+    """Submit a voice clone as a background job. Returns 202 with the job ID to poll."""
+    existing_id = g.current_user.get('voice_clone_id')
+    early_response, upload = _begin_clone_upload(existing_id)
+    if early_response:
+        return early_response
+
+    try:
+        job = clone_job_queue.submit(g.current_user['_id'], upload["filename"], upload["content_type"],
+                                     upload["overwrite"], upload["chunks"])
+    except UploadRejected as e:
+        return jsonify({"error": str(e)}), e.status_code
+    except CloneJobQueueFull as e:
+        response = jsonify({"error": str(e)})
+        response.headers["Retry-After"] = "30"
+        return response, 503
+
+    body = CloneJobQueue.describe(job)
+    body["status_url"] = f"/clone-jobs/{body['job_id']}"
+    response = jsonify(body)
+    response.headers["Location"] = body["status_url"]
+    return response, 202
+
+@app.route('/clone-jobs/<job_id>', methods=['GET'])
+@token_required
+def get_clone_job(job_id):
+    """Status of a clone job: queued, running (with its stage), succeeded (with voice_clone_id) or failed."""
+    job = clone_job_queue.get(job_id, g.current_user['_id'])
+    if not job:
+        return jsonify({"error": "Clone job not found"}), 404
+    return jsonify(CloneJobQueue.describe(job)), 200
 
 # Add endpoint to fetch current user info
 @app.route('/me', methods=['GET'])
@@ -902,43 +2233,38 @@ def get_character_usage():
     if not user:
         return jsonify({"error": "User not found"}), 404
 
-    # Constants
-    MONTHLY_CHAR_LIMIT = 5000
-    current_char_count = user.get("charCount", 0)
-    last_reset = user.get("lastCharReset")
-    
-    # Check if we need to reset monthly count (if it's a new month)
+    # Each month has its own ledger entry, so "resetting" is just the start of the current month
     now = datetime.utcnow()
-    if last_reset:
-        last_reset_date = last_reset if isinstance(last_reset, datetime) else datetime.fromisoformat(last_reset.replace('Z', '+00:00'))
-        # Reset if it's a new month
-        if now.month != last_reset_date.month or now.year != last_reset_date.year:
-            current_char_count = 0
-            # Update user's character count and reset date
-            users_collection.update_one(
-                {"_id": user['_id']}, 
-                {"$set": {"charCount": 0, "lastCharReset": now}}
-            )
-            print(f"Reset character count for user {user.get('username')} - new month detected")
+    current_char_count = usage_for(usage_collection, user['_id'], now)
+    last_reset = month_start(now)
     
     # Calculate days until next reset (first of next month)
     next_month = now.replace(day=1) + timedelta(days=32)  # Go to next month
     next_reset = next_month.replace(day=1)  # First day of next month
     days_until_reset = (next_reset - now).days
     
-    return jsonify({
+    usage = {
         "used_characters": current_char_count,
         "total_limit": MONTHLY_CHAR_LIMIT,
         "remaining_characters": max(0, MONTHLY_CHAR_LIMIT - current_char_count),
         "days_until_reset": days_until_reset,
-        "last_reset": last_reset.isoformat() if last_reset else None,
+        "last_reset": last_reset.isoformat(),
         "next_reset": next_reset.isoformat()
-    }), 200
+    }
+    # ?history=N adds the usage of the last N months (one indexed range read)
+    history_months = request.args.get("history", type=int)
+    if history_months:
+        usage["history"] = quota.usage_history(usage_collection, user['_id'], max(1, min(history_months, 36)), now)
+    return jsonify(usage), 200
 
 @app.route('/admin/reset-all-character-counts', methods=['POST'])
 @token_required
 def reset_all_character_counts():
-    """Admin endpoint to reset all users' character counts (for monthly reset)"""
+    """Admin endpoint to reset all users' character counts for the current month.
+
+    The monthly reset itself is automatic (a new month is a new ledger key); this only clears the
+    current month's entries, leaving earlier months as history.
+    """
     user = g.current_user
     
     # Only allow admin users (you can modify this logic as needed)
@@ -946,16 +2272,12 @@ def reset_all_character_counts():
         return jsonify({"error": "Admin access required"}), 403
     
     try:
-        # Reset all users' character counts
         now = datetime.utcnow()
-        result = users_collection.update_many(
-            {},  # Update all users
-            {"$set": {"charCount": 0, "lastCharReset": now}}
-        )
+        reset_count = quota.clear_month(usage_collection, now)
         
-        print(f"Reset character counts for {result.modified_count} users")
+        print(f"Reset character counts for {reset_count} users")
         return jsonify({
-            "message": f"Successfully reset character counts for {result.modified_count} users",
+            "message": f"Successfully reset character counts for {reset_count} users",
             "reset_date": now.isoformat()
         }), 200
         
@@ -963,6 +2285,38 @@ def reset_all_character_counts():
         print(f"Error resetting character counts: {e}")
         return jsonify({"error": "Failed to reset character counts"}), 500
 
+@app.route('/admin/usage-report', methods=['GET'])
+@token_required
+def usage_report():
+    """Admin report from the usage ledger: totals of the last `months` months and the top users of `month`."""
+    user = g.current_user
+    if user.get('username') != 'alexlatorre':
+        return jsonify({"error": "Admin access required"}), 403
+
+    months = max(1, min(request.args.get("months", default=6, type=int) or 6, 36))
+    top = max(1, min(request.args.get("top", default=20, type=int) or 20, 200))
+    month = request.args.get("month") or quota.month_key()
+    try:
+        datetime.strptime(month, "%Y-%m")
+    except ValueError:
+        return jsonify({"error": "'month' must be YYYY-MM"}), 400
+
+    try:
+        totals = quota.monthly_totals(usage_collection, months)
+        heaviest = quota.top_users(usage_collection, month, top)
+        names = users.usernames(entry["user_id"] for entry in heaviest)
+    except Exception as e:
+        print(f"Error building usage report: {e}")
+        return jsonify({"error": "Failed to build usage report"}), 500
+
+    return jsonify({
+        "limit": MONTHLY_CHAR_LIMIT,
+        "months": totals,
+        "month": month,
+        "top_users": [{"user_id": str(entry["user_id"]), "username": names.get(entry["user_id"]), "chars": entry["chars"]}
+                      for entry in heaviest],
+    }), 200
+
 @app.route('/delete-voice-clone', methods=['DELETE'])
 @token_required
 def delete_voice_clone():
@@ -973,9 +2327,9 @@ def delete_voice_clone():
         return jsonify({"error": "No voice clone found to delete"}), 404
     
     # Delete voice clone from ElevenLabs
-    delete_url = f"https://api.elevenlabs.io/v1/voices/{existing_id}"
+    delete_url = ELEVEN_VOICE_URL_TEMPLATE.format(voice_id=existing_id)
     try:
-        del_resp = requests.delete(delete_url, headers=headers)
+        del_resp = eleven_client.delete(delete_url)
         del_resp.raise_for_status()
         print(f"Deleted voice clone {existing_id} for user {user.get('username')}")
     except Exception as e:
@@ -983,10 +2337,8 @@ def delete_voice_clone():
         return jsonify({"error": f"Failed to delete voice clone from ElevenLabs: {str(e)}"}), 500
     
     # Remove voice_clone_id from user document in MongoDB
-    users_collection.update_one(
-        {"_id": user['_id']}, 
-        {"$unset": {"voice_clone_id": ""}}
-    )
+    users.clear_voice_clone(user['_id'])
+    user_cache.invalidate(user['_id'])
     
     return jsonify({"message": "Voice clone deleted successfully"}), 200
 
@@ -1055,9 +2407,11 @@ def update_settings():
         return jsonify({"message": "No settings provided to update.", "settings": current_settings}), 200
 
     try:
-        users_collection.update_one({"_id": user["_id"]}, {"$set": updated_fields})
-        # Fetch the updated user document to return the latest settings
-        updated_user = users_collection.find_one({"_id": user["_id"]})
+        # The updated settings come back from the same write
+        updated_user = users.update_settings(user["_id"], updated_fields)
+        user_cache.invalidate(user["_id"])
+        if not updated_user:
+            return jsonify({"error": "User not found"}), 404
         
         # Prepare the settings to be returned, ensuring defaults for any missing fields
         final_settings = {
@@ -1069,7 +2423,7 @@ def update_settings():
             "voice_ids": updated_user.get("voice_ids", []) # Ensure voice_ids is included
         }
         # Merge the actually updated settings from DB
-        if updated_user and "settings" in updated_user:
+        if "settings" in updated_user:
             final_settings.update(updated_user["settings"])
         
         return jsonify({"message": "Settings updated successfully", "settings": final_settings}), 200
@@ -1089,33 +2443,14 @@ def logout():
         print(f"[LOGOUT DEBUG] Attempting to log out user: {username} (ID: {user_id})")
         print(f"[LOGOUT DEBUG] User ID type: {type(user_id)}")
         
-        # Check current loggedIn status before update
-        current_user = users_collection.find_one({"_id": user_id})
-        if current_user:
-            print(f"[LOGOUT DEBUG] Current loggedIn status before update: {current_user.get('loggedIn', 'NOT_SET')}")
-        else:
-            print(f"[LOGOUT DEBUG] WARNING: Could not find user {username} before logout update")
-        
-        # Set loggedIn to False for the current user
-        result = users_collection.update_one(
-            {"_id": user_id}, 
-            {"$set": {"loggedIn": False}}
-        )
+        # Set loggedIn to False for the current user; the write returns the status it replaced
+        previous = users.set_logged_out(user_id)
+        user_cache.invalidate(user_id)
         
-        print(f"[LOGOUT DEBUG] MongoDB update result - matched: {result.matched_count}, modified: {result.modified_count}")
-        
-        # Verify the update worked
-        updated_user = users_collection.find_one({"_id": user_id})
-        if updated_user:
-            print(f"[LOGOUT DEBUG] User {username} loggedIn status after update: {updated_user.get('loggedIn', 'NOT_SET')}")
-            
-            # Extra verification - check if the field exists and its type
-            if 'loggedIn' in updated_user:
-                print(f"[LOGOUT DEBUG] loggedIn field type: {type(updated_user['loggedIn'])}, value: {repr(updated_user['loggedIn'])}")
-            else:
-                print(f"[LOGOUT DEBUG] WARNING: loggedIn field not found in user document after update")
+        if previous:
+            print(f"[LOGOUT DEBUG] User {username} loggedIn status: {previous.get('loggedIn', 'NOT_SET')} -> False")
         else:
-            print(f"[LOGOUT DEBUG] ERROR: Could not find user {username} after logout update")
+            print(f"[LOGOUT DEBUG] WARNING: Could not find user {username} for logout update")
         
         return jsonify({"message": "Logged out successfully"}), 200
     except Exception as e:
@@ -1132,7 +2467,7 @@ def debug_user_status():
         user_id = g.current_user['_id']
         username = g.current_user.get('username', 'unknown')
         
-        user = users_collection.find_one({"_id": user_id})
+        user = users.login_status(user_id)
         if not user:
             return jsonify({"error": "User not found"}), 404
             
@@ -1162,24 +2497,19 @@ def force_logout():
         
         print(f"[FORCE LOGOUT] Forcing logout for user: {username} (ID: {user_id})")
         
-        # Force set loggedIn to False
-        result = users_collection.update_one(
-            {"_id": user_id}, 
-            {"$set": {"loggedIn": False}}
-        )
+        # Force set loggedIn to False (one write; the previous status tells whether it changed anything)
+        previous = users.set_logged_out(user_id)
+        user_cache.invalidate(user_id)
+        matched = 1 if previous else 0
+        modified = 1 if previous and previous.get('loggedIn') is not False else 0
         
-        print(f"[FORCE LOGOUT] Update result - matched: {result.matched_count}, modified: {result.modified_count}")
-        
-        # Verify the update
-        updated_user = users_collection.find_one({"_id": user_id})
-        if updated_user:
-            print(f"[FORCE LOGOUT] Final loggedIn status: {updated_user.get('loggedIn', 'NOT_SET')}")
+        print(f"[FORCE LOGOUT] Update result - matched: {matched}, modified: {modified}")
         
         return jsonify({
             "message": "Force logout completed", 
-            "matched": result.matched_count,
-            "modified": result.modified_count,
-            "final_status": updated_user.get('loggedIn', 'NOT_SET') if updated_user else 'USER_NOT_FOUND'
+            "matched": matched,
+            "modified": modified,
+            "final_status": False if previous else 'USER_NOT_FOUND'
         }), 200
         
     except Exception as e:
@@ -1187,6 +2517,34 @@ def force_logout():
         traceback.print_exc()
         return jsonify({"error": f"Force logout failed: {str(e)}"}), 500
 
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.counted_in_flight = True
+    metrics.IN_FLIGHT.inc()
+
+@app.teardown_request
+def finish_request_timer(error=None):
+    # Streamed responses (stream_with_context) tear the same context down more than once
+    if g.pop("counted_in_flight", False):
+        metrics.IN_FLIGHT.dec()
+
+@app.after_request
+def record_request_metrics(response):
+    """Request duration histogram, Server-Timing header and the response_write stage (body sent to the client)."""
+    if not metrics.METRICS_ENABLED or "request_started" not in g:
+        return response
+    handler_seconds = time.perf_counter() - g.request_started
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.REQUEST_SECONDS.observe(handler_seconds, endpoint=endpoint, method=request.method, status=response.status_code)
+    if metrics.SERVER_TIMING_ENABLED:
+        # Streamed bodies are still being produced: only the stages finished before the headers appear here
+        response.headers["Server-Timing"] = metrics.server_timing_header(g.get("server_timings", {}), handler_seconds)
+
+    write_started = time.perf_counter()
+    response.call_on_close(lambda: metrics.STAGE_SECONDS.observe(time.perf_counter() - write_started, stage="response_write"))
+    return response
+
 # Configuration for CORS and next endpoints ... existing code ...
 @app.after_request
 def after_request(response):
@@ -1195,6 +2553,13 @@ def after_request(response):
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
     return response
 
+# Started once every module-level object (e.g. clone_job_queue) exists. Not in pool processes: with
+# `python main.py` the forkserver/spawn children of the password and voice pools import this file as __mp_main__.
+if __name__ != "__mp_main__":
+    start_warm_up()
+    if memo_pool:
+        memo_pool.start()
+
 if __name__ == '__main__':
     # Puerto 5002 para evitar conflictos
     app.run(host='0.0.0.0', port=5002, debug=True)
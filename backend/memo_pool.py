@@ -0,0 +1,270 @@
+import os
+import time
+import atexit
+import threading
+import traceback
+from collections import deque
+
+# Off by default: each worker process runs its own refill, so the upstream budgets below are spent once per
+# worker and per replica (8 workers x 3 replicas = 24x MEMO_POOL_GEMINI_CALLS_PER_HOUR). Enable it where the
+# deployment's total (budget x processes) fits the Gemini quota.
+MEMO_POOL_ENABLED = os.getenv("MEMO_POOL_ENABLED", "false").strip().lower() in ("true", "1")
+# Ready texts kept per popular (language, topic, value)
+MEMO_POOL_VARIANTS = int(os.getenv("MEMO_POOL_VARIANTS", "3"))
+# A tuple is popular once its decayed request count reaches this
+MEMO_POOL_MIN_REQUESTS = float(os.getenv("MEMO_POOL_MIN_REQUESTS", "3"))
+MEMO_POOL_HALF_LIFE_SECONDS = float(os.getenv("MEMO_POOL_HALF_LIFE_SECONDS", str(6 * 3600)))
+MEMO_POOL_MAX_KEYS = int(os.getenv("MEMO_POOL_MAX_KEYS", "200"))
+MEMO_POOL_TRACKED_KEYS = int(os.getenv("MEMO_POOL_TRACKED_KEYS", "5000"))
+# Variants older than this are dropped so the pool keeps following the model (and does not repeat itself forever)
+MEMO_POOL_MAX_AGE_SECONDS = float(os.getenv("MEMO_POOL_MAX_AGE_SECONDS", str(24 * 3600)))
+MEMO_POOL_REFILL_SECONDS = float(os.getenv("MEMO_POOL_REFILL_SECONDS", "30"))
+# Upstream budget of the background refill, per worker process and hour
+MEMO_POOL_GEMINI_CALLS_PER_HOUR = int(os.getenv("MEMO_POOL_GEMINI_CALLS_PER_HOUR", "120"))
+# TTS characters per hour spent pre-rendering audio for the voices asking for popular tuples (0 = texts only)
+MEMO_POOL_PRERENDER_CHARS_PER_HOUR = int(os.getenv("MEMO_POOL_PRERENDER_CHARS_PER_HOUR", "0"))
+MEMO_POOL_PRERENDER_VARIANTS = int(os.getenv("MEMO_POOL_PRERENDER_VARIANTS", "1"))
+# A voice counts as active for a tuple this long after it last asked for it
+MEMO_POOL_VOICE_TTL_SECONDS = float(os.getenv("MEMO_POOL_VOICE_TTL_SECONDS", "3600"))
+
+# Scores decay continuously, so N quick requests add up to slightly less than N
+_SCORE_TOLERANCE = 0.01
+
+
+def pool_key(language, topic, value):
+    """Requests differing only in case or spacing share a pool."""
+    return tuple(" ".join(part.split()).casefold() for part in (language or "", topic, value))
+
+
+class MemoPool:
+    """Ready-made memo texts for popular (language, topic, value) requests, refilled in the background.
+
+    `generate(language, topic, value)` returns a new text or None (Gemini failed; fallback templates are
+    not pooled). With `render(text, profile)` the refill also synthesizes variants for the voice profiles
+    (voice, model and settings, as built by the caller) that recently asked for a tuple, so the audio is
+    already in the TTS cache when the request comes. A variant is handed out once and then removed.
+
+    Each worker process keeps its own pool and budget.
+    """
+
+    def __init__(self, generate, render=None, variants=MEMO_POOL_VARIANTS, min_requests=MEMO_POOL_MIN_REQUESTS,
+                 gemini_calls_per_hour=MEMO_POOL_GEMINI_CALLS_PER_HOUR,
+                 prerender_chars_per_hour=MEMO_POOL_PRERENDER_CHARS_PER_HOUR):
+        self.generate = generate
+        self.render = render if prerender_chars_per_hour > 0 else None
+        self.variants = variants
+        self.min_requests = min_requests
+        self.gemini_calls_per_hour = gemini_calls_per_hour
+        self.prerender_chars_per_hour = prerender_chars_per_hour
+        self._popularity = {}  # key -> [score, updated_at, language, topic, value] (as first typed)
+        self._texts = {}  # key -> deque of (created_at, text)
+        self._voices = {}  # key -> {profile: last_seen}
+        self._rendered = {}  # (key, profile) -> deque of (created_at, text) whose audio is cached
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._window_started = time.monotonic()
+        self._window_gemini_calls = 0
+        self._window_tts_chars = 0
+        self.hits = 0
+        self.prerendered_hits = 0
+        self.misses = 0
+        self.generated = 0
+        self.rendered = 0
+        self.failures = 0
+
+    def _decayed(self, entry, now):
+        return entry[0] * 0.5 ** ((now - entry[1]) / MEMO_POOL_HALF_LIFE_SECONDS)
+
+    @staticmethod
+    def _pop_fresh(variants, now):
+        while variants:
+            created_at, text = variants.popleft()
+            if now - created_at <= MEMO_POOL_MAX_AGE_SECONDS:
+                return text
+        return None
+
+    def take(self, language, topic, value, profile=None):
+        """Count the request and return an unused ready text for it, or None (generate it as usual).
+
+        Texts already rendered for `profile` are preferred: their audio is a TTS cache hit.
+        """
+        key = pool_key(language, topic, value)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._popularity.get(key)
+            if entry is None:
+                entry = self._popularity[key] = [0.0, now, language, topic, value]
+            entry[0] = self._decayed(entry, now) + 1
+            entry[1] = now
+            if profile is not None:
+                self._voices.setdefault(key, {})[profile] = now
+            if len(self._popularity) > MEMO_POOL_TRACKED_KEYS:
+                self._forget_least_popular_locked(now)
+
+            text = None
+            if profile is not None and (key, profile) in self._rendered:
+                text = self._pop_fresh(self._rendered[(key, profile)], now)
+                if text is not None:
+                    self.prerendered_hits += 1
+            if text is None and key in self._texts:
+                text = self._pop_fresh(self._texts[key], now)
+            if text is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            if text is None and entry[0] + _SCORE_TOLERANCE >= self.min_requests:
+                self._wake.set()
+        return text
+
+    def _forget_least_popular_locked(self, now):
+        ranked = sorted(self._popularity, key=lambda k: self._decayed(self._popularity[k], now))
+        for key in ranked[:len(ranked) - MEMO_POOL_TRACKED_KEYS]:
+            self._drop_locked(key)
+
+    def _drop_locked(self, key):
+        self._popularity.pop(key, None)
+        self._texts.pop(key, None)
+        for profile in self._voices.pop(key, {}):
+            self._rendered.pop((key, profile), None)
+
+    def popular(self):
+        """[(key, language, topic, value, score)] of the tuples worth keeping warm, most requested first."""
+        now = time.monotonic()
+        with self._lock:
+            ranked = [(key, entry[2], entry[3], entry[4], self._decayed(entry, now))
+                      for key, entry in self._popularity.items()]
+        ranked = [item for item in ranked if item[4] + _SCORE_TOLERANCE >= self.min_requests]
+        ranked.sort(key=lambda item: item[4], reverse=True)
+        return ranked[:MEMO_POOL_MAX_KEYS]
+
+    def _spend(self, gemini_calls=0, tts_chars=0):
+        """Take from this hour's budget; False (nothing taken) when it would go over."""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_started >= 3600:
+                self._window_started = now
+                self._window_gemini_calls = 0
+                self._window_tts_chars = 0
+            if gemini_calls and self._window_gemini_calls + gemini_calls > self.gemini_calls_per_hour:
+                return False
+            if tts_chars and self._window_tts_chars + tts_chars > self.prerender_chars_per_hour:
+                return False
+            self._window_gemini_calls += gemini_calls
+            self._window_tts_chars += tts_chars
+            return True
+
+    def _new_text(self, language, topic, value):
+        if self._stopping.is_set() or not self._spend(gemini_calls=1):
+            return None
+        text = self.generate(language, topic, value)
+        with self._lock:
+            if text:
+                self.generated += 1
+            else:
+                self.failures += 1
+        return text
+
+    def refill_once(self):
+        """One pass over the popular tuples, topping up their pools until the budget runs out."""
+        popular = self.popular()
+        keep = {item[0] for item in popular}
+        now = time.monotonic()
+        with self._lock:
+            # Pools of tuples that stopped being popular are released (their popularity is still tracked)
+            for key in [key for key in self._texts if key not in keep]:
+                del self._texts[key]
+            for key, profile in [k for k in self._rendered if k[0] not in keep]:
+                del self._rendered[(key, profile)]
+            for key, voices in self._voices.items():
+                for profile in [p for p, seen in voices.items() if now - seen > MEMO_POOL_VOICE_TTL_SECONDS]:
+                    del voices[profile]
+                    self._rendered.pop((key, profile), None)
+
+        for key, language, topic, value, _ in popular:
+            with self._lock:
+                texts = self._texts.setdefault(key, deque())
+                missing = self.variants - len(texts)
+                profiles = list(self._voices.get(key, {})) if self.render else []
+            for _ in range(missing):
+                text = self._new_text(language, topic, value)
+                if not text:
+                    return  # Out of budget, or Gemini is failing: try again on the next pass
+                with self._lock:
+                    texts.append((time.monotonic(), text))
+
+            for profile in profiles:
+                with self._lock:
+                    rendered = self._rendered.setdefault((key, profile), deque())
+                    missing = MEMO_POOL_PRERENDER_VARIANTS - len(rendered)
+                for _ in range(missing):
+                    with self._lock:
+                        text = self._pop_fresh(texts, time.monotonic())
+                    if text is None:
+                        text = self._new_text(language, topic, value)
+                        if not text:
+                            return
+                    if not self._spend(tts_chars=len(text)):
+                        with self._lock:
+                            texts.appendleft((time.monotonic(), text))
+                        return
+                    try:
+                        self.render(text, profile)
+                    except Exception as e:
+                        print(f"Memo pool pre-render failed for {key}: {e}")
+                        with self._lock:
+                            self.failures += 1
+                            texts.appendleft((time.monotonic(), text))
+                        return
+                    with self._lock:
+                        self.rendered += 1
+                        rendered.append((time.monotonic(), text))
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(MEMO_POOL_REFILL_SECONDS)
+            self._wake.clear()
+            if self._stopping.is_set():
+                return
+            try:
+                self.refill_once()
+            except Exception as e:
+                print(f"Memo pool refill failed: {e}")
+                traceback.print_exc()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="memo-pool", daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self, timeout=5.0):
+        """Let an upstream call in progress finish instead of cutting it off at interpreter exit."""
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "tracked": len(self._popularity),
+                "pooled_keys": len(self._texts),
+                "ready_texts": sum(len(texts) for texts in self._texts.values()),
+                "ready_audio": sum(len(rendered) for rendered in self._rendered.values()),
+                "hits": self.hits,
+                "prerendered_hits": self.prerendered_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "generated": self.generated,
+                "rendered": self.rendered,
+                "failures": self.failures,
+                "budget": {
+                    "gemini_calls": self._window_gemini_calls,
+                    "gemini_calls_per_hour": self.gemini_calls_per_hour,
+                    "prerender_chars": self._window_tts_chars,
+                    "prerender_chars_per_hour": self.prerender_chars_per_hour,
+                },
+            }
@@ -0,0 +1,267 @@
+import os
+import re
+import time
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from flask import g, has_request_context
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").strip().lower() in ("true", "1")
+# Server-Timing exposes internal stage durations to clients; turn it off if that is not wanted
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "true").strip().lower() in ("true", "1")
+
+# Seconds. Wide on purpose: Mongo lookups are milliseconds, Gemini/TTS are seconds.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_NAME_RE = re.compile(r"^[a-zA-Z_:][a-zA-Z0-9_:]*$")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        if not _NAME_RE.match(name):
+            raise ValueError(f"Invalid metric name: {name}")
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonic count per label set; by convention the name ends in _total."""
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """Point-in-time value per label set, set by whoever owns the number (e.g. refreshed on scrape)."""
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._values = {}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram per label set, as Prometheus expects it (le buckets, _sum, _count)."""
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # key -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self, **labels):
+        """(cumulative bucket counts, sum, count) for one label set; used by the benchmarks."""
+        with self._lock:
+            series = list(self._series.get(self._key(labels)) or [0] * len(self.buckets) + [0.0, 0])
+        cumulative, running = [], 0
+        for count in series[:len(self.buckets)]:
+            running += count
+            cumulative.append(running)
+        return cumulative, series[-2], series[-1]
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        lines = []
+        for key, series in items:
+            running = 0
+            for bound, count in zip(self.buckets, series):
+                running += count
+                labels = _format_labels(self.label_names, key, f'le="{_format_value(float(bound))}"')
+                lines.append(f"{self.name}_bucket{labels} {running}")
+            inf_labels = _format_labels(self.label_names, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf_labels} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {series[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """The metrics of one process.
+
+    Each gunicorn worker has its own registry, so a scrape of /metrics sees the worker that answered it.
+    Scrape every worker (or run a single worker per container) to get the full picture.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._add(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self._add(Gauge(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help_text, labels, buckets))
+
+    def add_collector(self, collect):
+        """`collect()` runs before each render, to refresh gauges from stats kept elsewhere."""
+        with self._lock:
+            self._collectors.append(collect)
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            collectors = list(self._collectors)
+            metrics = list(self._metrics)
+        for collect in collectors:
+            try:
+                collect()
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "voicememos_http_request_duration_seconds",
+    "Time from request start until the handler returned (streamed bodies are timed by the response_write stage)",
+    ("endpoint", "method", "status"))
+STAGE_SECONDS = REGISTRY.histogram(
+    "voicememos_stage_duration_seconds",
+    "Time spent in each stage of request handling and memo generation",
+    ("stage",))
+UPSTREAM_RESPONSES = REGISTRY.counter(
+    "voicememos_upstream_responses_total",
+    "Upstream calls by service and HTTP status (or 'error' when no response arrived)",
+    ("upstream", "status"))
+FALLBACKS = REGISTRY.counter(
+    "voicememos_fallbacks_total",
+    "Generations that used a canned text instead of Gemini output",
+    ("reason",))
+BYTES_STREAMED = REGISTRY.counter(
+    "voicememos_audio_bytes_sent_total",
+    "Audio bytes sent to clients, by delivery mode",
+    ("mode",))
+IN_FLIGHT = REGISTRY.gauge(
+    "voicememos_http_requests_in_flight",
+    "Requests currently being handled by this worker")
+
+
+def record_stage(stage, seconds):
+    """Observe a stage duration and, inside a request, add it to the Server-Timing header."""
+    if not METRICS_ENABLED:
+        return
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    if has_request_context():
+        timings = g.setdefault("server_timings", {})
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def stage_timer(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+
+def timed(stage):
+    """Decorator form of stage_timer."""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def server_timing_header(timings, total_seconds=None):
+    """Server-Timing value (durations in milliseconds) for the stages recorded during a request."""
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+    if total_seconds is not None:
+        entries.append(f"total;dur={total_seconds * 1000:.1f}")
+    return ", ".join(entries)
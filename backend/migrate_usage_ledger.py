@@ -0,0 +1,76 @@
+"""One-off migration of the monthly character counts from the user documents to the usage ledger.
+
+Copies each user's charCount into this month's ledger entry when lastCharReset falls in the current
+month (older counts belong to a finished month and start over anyway). Safe to run more than once,
+also while the new backend is already charging: entries are raised with $max, never lowered.
+
+    python migrate_usage_ledger.py
+    python migrate_usage_ledger.py --drop-legacy-fields   # afterwards, remove charCount/lastCharReset
+"""
+import sys
+import argparse
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+from activation_codes_cli import get_activation_codes_collection
+from quota import month_start, month_key, ensure_indexes
+
+BATCH_SIZE = 1000
+
+
+def migrate(db, batch_size=BATCH_SIZE, now=None):
+    """Returns the number of ledger entries written."""
+    now = now or datetime.utcnow()
+    ledger = db.usage_ledger
+    ensure_indexes(ledger)
+    # A missing lastCharReset counted as the current month under the old scheme
+    query = {"charCount": {"$gt": 0},
+             "$or": [{"lastCharReset": {"$gte": month_start(now)}}, {"lastCharReset": {"$exists": False}}]}
+    month = month_key(now)
+    written, ops = 0, []
+
+    def flush():
+        nonlocal written, ops
+        if ops:
+            result = ledger.bulk_write(ops, ordered=False)
+            written += result.upserted_count + result.modified_count
+            ops = []
+
+    for user in db.users.find(query, {"charCount": 1}):
+        ops.append(UpdateOne(
+            {"user_id": user["_id"], "month": month},
+            {"$max": {"chars": user["charCount"]}, "$setOnInsert": {"created_at": now}, "$set": {"updated_at": now}},
+            upsert=True,
+        ))
+        if len(ops) >= batch_size:
+            flush()
+    flush()
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move monthly character counts to the usage ledger")
+    parser.add_argument("--uri", help="MongoDB URI (defaults to MONGO_URI from .env)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--drop-legacy-fields", action="store_true",
+                        help="remove charCount/lastCharReset from every user after copying")
+    args = parser.parse_args(argv)
+
+    client, activation_codes = get_activation_codes_collection(args.uri)
+    try:
+        db = activation_codes.database
+        written = migrate(db, args.batch_size)
+        print(f"Usage ledger: {written} entries written for {month_key()}")
+        if args.drop_legacy_fields:
+            result = db.users.update_many(
+                {"$or": [{"charCount": {"$exists": True}}, {"lastCharReset": {"$exists": True}}]},
+                {"$unset": {"charCount": "", "lastCharReset": ""}})
+            print(f"Removed the legacy usage fields from {result.modified_count} users")
+    finally:
+        client.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+import bcrypt
+from cpu_pool import run_cpu_bound
+
+# bcrypt cost factor for new hashes. Changing it re-hashes existing passwords on their next login.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Processes doing bcrypt work per worker. 0 hashes inline on the request thread.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Hash operations allowed to wait or run at once; beyond this requests are refused (503) instead of queueing
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "32"))
+PASSWORD_HASH_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT", "10"))
+# How pool processes are started. Not "fork": the request worker is multithreaded, and a child forked while
+# another thread holds a lock (logging, pymongo, the pool's own queues) can hang forever.
+# forkserver/spawn children only import this module and bcrypt.
+PASSWORD_HASH_START_METHOD = os.getenv("PASSWORD_HASH_START_METHOD", "forkserver")
+# Under gevent (SERVING_MODE=async) the pool's result and feeder threads would be monkey-patched greenlets
+# sharing the hub with the requests. bcrypt releases the GIL, so there it runs on gevent's pool of native
+# threads instead: parallel, and the waiting greenlet yields.
+ASYNC_SERVING = os.getenv("SERVING_MODE", "sync").strip().lower() == "async"
+
+
+class PasswordHasherBusy(Exception):
+    """Too many password hash operations are already queued."""
+
+
+def _hash_password(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _check_password(password, hashed):
+    return bcrypt.checkpw(password, hashed)
+
+
+def hash_cost(hashed):
+    """Cost factor of a bcrypt hash ($2b$12$... -> 12), or None if it cannot be read."""
+    if isinstance(hashed, str):
+        hashed = hashed.encode("utf-8")
+    try:
+        return int(hashed.split(b"$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    """Runs bcrypt in a bounded process pool (native threads under gevent) so hashing bursts do not hold the request workers."""
+
+    def __init__(self, rounds=BCRYPT_ROUNDS, workers=PASSWORD_HASH_WORKERS,
+                 max_queue=PASSWORD_HASH_MAX_QUEUE, timeout=PASSWORD_HASH_TIMEOUT):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_queue)
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _get_executor(self):
+        # Created lazily and per process: a pool inherited through fork (gunicorn workers) is unusable
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                if ASYNC_SERVING:
+                    from gevent.threadpool import ThreadPoolExecutor
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers)
+                else:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers, mp_context=multiprocessing.get_context(PASSWORD_HASH_START_METHOD))
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PasswordHasherBusy("Too many password operations in progress")
+        with self._lock:
+            self._in_flight += 1
+        try:
+            if self.workers <= 0:
+                return run_cpu_bound(fn, *args)  # Inline, but never on the gevent hub
+            try:
+                return self._get_executor().submit(fn, *args).result(timeout=self.timeout)
+            except FutureTimeoutError:
+                raise PasswordHasherBusy("Password operation timed out")
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self.completed += 1
+            self._slots.release()
+
+    def hash(self, password):
+        """Hash a str password with the configured cost factor."""
+        return self._run(_hash_password, password.encode("utf-8"), self.rounds)
+
+    def check(self, password, hashed):
+        if isinstance(hashed, str):
+            hashed = hashed.encode("utf-8")
+        return self._run(_check_password, password.encode("utf-8"), hashed)
+
+    def needs_rehash(self, hashed):
+        return hash_cost(hashed) != self.rounds
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rounds": self.rounds,
+                "workers": self.workers,
+                "pool": "gevent_threads" if ASYNC_SERVING else PASSWORD_HASH_START_METHOD,
+                "max_queue": self.max_queue,
+                "in_flight": self._in_flight,
+                "completed": self.completed,
+                "rejected": self.rejected,
+            }
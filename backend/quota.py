@@ -0,0 +1,127 @@
+import os
+from datetime import datetime
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+MONTHLY_CHAR_LIMIT = int(os.getenv("MONTHLY_CHAR_LIMIT", "5000"))
+
+# Usage lives in a ledger collection, one document per user and calendar month (UTC):
+#   {"user_id": ..., "month": "2025-06", "chars": 1234, "created_at": ..., "updated_at": ...}
+# A new month is a new key, so nothing is ever reset and past months stay as history.
+
+
+def month_start(now):
+    return now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def month_key(now=None):
+    """'YYYY-MM' of `now` (UTC); sorts chronologically as a string."""
+    return (now or datetime.utcnow()).strftime("%Y-%m")
+
+
+def recent_month_keys(count, now=None):
+    """The `count` most recent month keys, current month first."""
+    now = now or datetime.utcnow()
+    year, month = now.year, now.month
+    keys = []
+    for _ in range(count):
+        keys.append(f"{year:04d}-{month:02d}")
+        year, month = (year - 1, 12) if month == 1 else (year, month - 1)
+    return keys
+
+
+def ensure_indexes(ledger):
+    # Point reads and charges by (user, month); the unique key also makes concurrent first charges safe
+    ledger.create_index([("user_id", ASCENDING), ("month", ASCENDING)], unique=True)
+    # Per-month reports: totals and heaviest users
+    ledger.create_index([("month", ASCENDING), ("chars", DESCENDING)])
+
+
+def usage_for(ledger, user_id, now=None):
+    """Characters `user_id` has used this month (one indexed point read)."""
+    entry = ledger.find_one({"user_id": user_id, "month": month_key(now)}, {"chars": 1, "_id": 0})
+    return entry.get("chars", 0) if entry else 0
+
+
+def charge_characters(ledger, user_id, chars, enforce_limit=True, now=None):
+    """Add `chars` to the user's entry for this month, creating it on the first charge.
+
+    One upserted $inc. With enforce_limit the entry only matches while it is still under
+    MONTHLY_CHAR_LIMIT, so concurrent requests can neither lose updates nor all pass a stale
+    check; on an entry already at the limit the upsert hits the unique index and is refused.
+    Returns (granted, used_before, used_after, month): a refund must name that month, the charge
+    may have been the last one before the month changed.
+    """
+    now = now or datetime.utcnow()
+    month = month_key(now)
+    key = {"user_id": user_id, "month": month}
+    update = {"$inc": {"chars": chars}, "$set": {"updated_at": now}, "$setOnInsert": {"created_at": now}}
+    if not enforce_limit:
+        entry = ledger.find_one_and_update(key, update, projection={"chars": 1, "_id": 0}, upsert=True,
+                                           return_document=ReturnDocument.AFTER)
+        return True, entry["chars"] - chars, entry["chars"], month
+
+    for _ in range(3):
+        try:
+            entry = ledger.find_one_and_update(
+                {**key, "chars": {"$lt": MONTHLY_CHAR_LIMIT}},
+                update,
+                projection={"chars": 1, "_id": 0},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+            return True, entry["chars"] - chars, entry["chars"], month
+        except DuplicateKeyError:
+            # Either the entry is at the limit, or another request created it first: look which
+            used = usage_for(ledger, user_id, now)
+            if used >= MONTHLY_CHAR_LIMIT:
+                return False, used, used, month
+    used = usage_for(ledger, user_id, now)
+    return False, used, used, month
+
+
+def refund_characters(ledger, user_id, chars, month, now=None):
+    """Give back characters charged for a generation that could not be delivered.
+
+    `month` is the key charge_characters returned: the refund goes to the month that was charged,
+    even when the month has changed since.
+    """
+    if chars:
+        # Never below zero, e.g. after an admin reset of that month (clear_month)
+        ledger.update_one({"user_id": user_id, "month": month, "chars": {"$gte": chars}},
+                          {"$inc": {"chars": -chars}, "$set": {"updated_at": now or datetime.utcnow()}})
+
+
+def clear_month(ledger, now=None):
+    """Drop every entry of the current month (admin reset). Returns how many users were reset."""
+    return ledger.delete_many({"month": month_key(now)}).deleted_count
+
+
+def usage_history(ledger, user_id, months=12, now=None):
+    """[{"month", "chars"}] for the user's last `months` months that have any usage, newest first."""
+    cursor = ledger.find(
+        {"user_id": user_id, "month": {"$gte": recent_month_keys(months, now)[-1]}},
+        {"month": 1, "chars": 1, "_id": 0},
+    ).sort("month", DESCENDING)
+    return list(cursor)
+
+
+def monthly_totals(ledger, months=6, now=None):
+    """Per-month totals for the last `months` months: active users, characters and users at the limit."""
+    pipeline = [
+        {"$match": {"month": {"$gte": recent_month_keys(months, now)[-1]}}},
+        {"$group": {
+            "_id": "$month",
+            "users": {"$sum": 1},
+            "chars": {"$sum": "$chars"},
+            "users_at_limit": {"$sum": {"$cond": [{"$gte": ["$chars", MONTHLY_CHAR_LIMIT]}, 1, 0]}},
+        }},
+        {"$sort": {"_id": -1}},
+    ]
+    return [{"month": row.pop("_id"), **row} for row in ledger.aggregate(pipeline)]
+
+
+def top_users(ledger, month, limit=20):
+    """[{"user_id", "chars"}] of the heaviest users in `month` (served by the month/chars index)."""
+    cursor = ledger.find({"month": month}, {"user_id": 1, "chars": 1, "_id": 0}).sort("chars", DESCENDING).limit(limit)
+    return list(cursor)
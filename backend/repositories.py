@@ -0,0 +1,156 @@
+import os
+from pymongo import ASCENDING, ReturnDocument
+
+# MongoClient pool and timeouts (0 leaves the driver default)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "0"))
+# A request thread waits this long for a free pooled connection before failing, instead of hanging
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "10000"))
+
+# Per-use-case projections: handlers only get the fields they read (never the password hash unless they check it)
+PROFILE_PROJECTION = {"username": 1, "email": 1, "settings": 1, "voice_clone_id": 1, "voice_ids": 1, "loggedIn": 1}
+LOGIN_PROJECTION = {"username": 1, "password": 1, "loggedIn": 1}
+SETTINGS_PROJECTION = {"settings": 1, "voice_ids": 1}
+LOGIN_STATUS_PROJECTION = {"loggedIn": 1}
+
+
+def mongo_client_options():
+    """Keyword arguments for MongoClient built from the MONGO_* settings above."""
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+    }
+    return {name: value for name, value in options.items() if value}
+
+
+class UserRepository:
+    """Every query the API runs against the users collection.
+
+    Each method asks for the fields its caller uses, and writes whose result is needed return the
+    updated document from the same round trip (find_one_and_update) instead of reading it back.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def ensure_indexes(self):
+        # Login looks a user up by email or username ($or): each branch is served by its unique index
+        self.collection.create_index("username", unique=True)
+        self.collection.create_index("email", unique=True)
+
+    def find_profile(self, user_id):
+        """The user as authenticated handlers see it (cached by token_required)."""
+        return self.collection.find_one({"_id": user_id}, PROFILE_PROJECTION)
+
+    def find_for_login(self, email_or_username):
+        return self.collection.find_one({"$or": [{"email": email_or_username}, {"username": email_or_username}]},
+                                        LOGIN_PROJECTION)
+
+    def create(self, user_data):
+        """Insert a new user; duplicate usernames/emails raise DuplicateKeyError from the unique indexes."""
+        self.collection.insert_one(user_data)
+
+    def mark_logged_in(self, user_id, password_hash=None):
+        """Set loggedIn, upgrading the stored hash in the same write when one is given."""
+        fields = {"loggedIn": True}
+        if password_hash is not None:
+            fields["password"] = password_hash
+        self.collection.update_one({"_id": user_id}, {"$set": fields})
+
+    def set_logged_out(self, user_id):
+        """Clear loggedIn. Returns the login status *before* the write, or None if there is no such user."""
+        return self.collection.find_one_and_update(
+            {"_id": user_id}, {"$set": {"loggedIn": False}},
+            projection=LOGIN_STATUS_PROJECTION, return_document=ReturnDocument.BEFORE)
+
+    def login_status(self, user_id):
+        return self.collection.find_one({"_id": user_id}, LOGIN_STATUS_PROJECTION)
+
+    def reset_password(self, email, password_hash):
+        """Store a new hash and log the user out everywhere. Returns {_id, username}, or None for an unknown email."""
+        return self.collection.find_one_and_update(
+            {"email": email}, {"$set": {"password": password_hash, "loggedIn": False}},
+            projection={"_id": 1, "username": 1})
+
+    def update_settings(self, user_id, fields):
+        """$set the given dotted settings fields and return the resulting settings and voice_ids."""
+        return self.collection.find_one_and_update(
+            {"_id": user_id}, {"$set": fields},
+            projection=SETTINGS_PROJECTION, return_document=ReturnDocument.AFTER)
+
+    def set_voice_clone(self, user_id, voice_id):
+        self.collection.update_one({"_id": user_id}, {"$set": {"voice_clone_id": voice_id}})
+
+    def clear_voice_clone(self, user_id):
+        self.collection.update_one({"_id": user_id}, {"$unset": {"voice_clone_id": ""}})
+
+    def usernames(self, user_ids):
+        """{user_id: username} for the given ids (one $in query)."""
+        return {user["_id"]: user.get("username")
+                for user in self.collection.find({"_id": {"$in": list(user_ids)}}, {"username": 1})}
+
+
+class ActivationCodeRepository:
+    """Every query run against the activation_codes collection (API, CLI and exports)."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def ensure_indexes(self):
+        self.collection.create_index("code", unique=True)
+        # Exports read the unused codes, optionally of one batch. Partial: used codes (most of them,
+        # over time) stay out of the index.
+        self.collection.create_index([("used", ASCENDING), ("batch", ASCENDING)],
+                                     partialFilterExpression={"used": False})
+
+    def exists(self, code):
+        return self.collection.find_one({"code": code}, {"_id": 1}) is not None
+
+    def find_status(self, code):
+        """{used} of a code, or None when it does not exist."""
+        return self.collection.find_one({"code": code}, {"_id": 0, "used": 1})
+
+    def claim_for_registration(self, code, user_id, now):
+        """Atomically flip an unused code to used. Returns {_id}, or None when unknown or already used."""
+        return self.collection.find_one_and_update(
+            {"code": code, "used": {"$ne": True}},
+            {"$set": {"used": True, "used_by": user_id, "used_at": now}},
+            projection={"_id": 1})
+
+    def release_registration(self, code_id, user_id):
+        """Undo claim_for_registration for a registration that did not complete."""
+        self.collection.update_one(
+            {"_id": code_id, "used_by": user_id},
+            {"$set": {"used": False}, "$unset": {"used_by": "", "used_at": ""}})
+
+    def claim_for_password_reset(self, code, claimed_at):
+        """One password reset per code. Returns {_id}, or None when unknown or already used for a reset."""
+        return self.collection.find_one_and_update(
+            {"code": code, "used_for_password_reset": {"$ne": True}},
+            {"$set": {"used_for_password_reset": True, "password_reset_at": claimed_at}},
+            projection={"_id": 1})
+
+    def release_password_reset(self, code_id, claimed_at):
+        self.collection.update_one(
+            {"_id": code_id, "password_reset_at": claimed_at},
+            {"$unset": {"used_for_password_reset": "", "password_reset_at": ""}})
+
+    def record_password_reset(self, code_id, user_id):
+        self.collection.update_one({"_id": code_id}, {"$set": {"password_reset_by": user_id}})
+
+    def unused(self, label=None, batch_size=None):
+        """Cursor over the unused codes (optionally of one batch label), served by the partial index."""
+        query = {"used": False}
+        if label:
+            query["batch"] = label
+        cursor = self.collection.find(query, {"_id": 0, "code": 1, "batch": 1, "created_at": 1})
+        return cursor.batch_size(batch_size) if batch_size else cursor
@@ -0,0 +1,314 @@
+import os
+import time
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+from contextlib import contextmanager
+from functools import wraps
+from metrics import REGISTRY
+
+# Time a memo request (or one batch item) may spend on upstream calls before giving up
+MEMO_DEADLINE_SECONDS = float(os.getenv("MEMO_DEADLINE_SECONDS", "25"))
+# Below this much time left an upstream call is not even started
+DEADLINE_MIN_CALL_SECONDS = float(os.getenv("DEADLINE_MIN_CALL_SECONDS", "0.25"))
+
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+
+GEMINI_HEDGE_ENABLED = os.getenv("GEMINI_HEDGE_ENABLED", "true").strip().lower() in ("true", "1")
+# A second Gemini call is sent once the first has taken longer than this percentile of recent calls
+GEMINI_HEDGE_PERCENTILE = float(os.getenv("GEMINI_HEDGE_PERCENTILE", "0.95"))
+GEMINI_HEDGE_MIN_SAMPLES = int(os.getenv("GEMINI_HEDGE_MIN_SAMPLES", "20"))
+# Used until enough latencies are known
+GEMINI_HEDGE_DEFAULT_DELAY = float(os.getenv("GEMINI_HEDGE_DEFAULT_DELAY", "3.0"))
+# At most this fraction of recent calls is hedged, so a general slowdown does not double the load
+GEMINI_HEDGE_MAX_RATIO = float(os.getenv("GEMINI_HEDGE_MAX_RATIO", "0.1"))
+GEMINI_HEDGE_WINDOW = int(os.getenv("GEMINI_HEDGE_WINDOW", "200"))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+CIRCUIT_STATE = REGISTRY.gauge(
+    "voicememos_circuit_state",
+    "Circuit breaker state per upstream (0 closed, 1 half-open, 2 open)",
+    ("upstream",))
+CIRCUIT_REJECTED = REGISTRY.counter(
+    "voicememos_circuit_rejected_total",
+    "Upstream calls refused without being sent because the circuit was open",
+    ("upstream",))
+HEDGED_CALLS = REGISTRY.counter(
+    "voicememos_hedged_calls_total",
+    "Hedged upstream calls by which attempt answered first",
+    ("upstream", "winner"))
+
+_deadline = contextvars.ContextVar("upstream_deadline", default=None)
+
+
+class UpstreamUnavailable(Exception):
+    """An upstream call was not made (or abandoned) to protect the service. `retry_after` is in seconds."""
+    status_code = 503
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    status_code = 503
+
+
+class DeadlineExceeded(UpstreamUnavailable):
+    status_code = 504
+
+
+@contextmanager
+def deadline(seconds):
+    """Upstream calls inside the block share `seconds` (an enclosing, tighter deadline still wins)."""
+    at = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(at if current is None else min(at, current))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def with_deadline(seconds):
+    """Decorator form of deadline()."""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            with deadline(seconds):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def bind_deadline(fn):
+    """`fn` wrapped to run under the caller's deadline, for work handed to another thread."""
+    at = _deadline.get()
+    if at is None:
+        return fn
+
+    @wraps(fn)
+    def bound(*args, **kwargs):
+        token = _deadline.set(at)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _deadline.reset(token)
+    return bound
+
+
+def remaining():
+    """Seconds left before the current deadline, or None when there is none."""
+    at = _deadline.get()
+    return None if at is None else at - time.monotonic()
+
+
+def call_timeout(timeout, upstream):
+    """`timeout` (seconds or a (connect, read) tuple) shortened to the time left; raises DeadlineExceeded."""
+    left = remaining()
+    if left is None:
+        return timeout
+    if left < DEADLINE_MIN_CALL_SECONDS:
+        raise DeadlineExceeded(f"No time left for the {upstream} call")
+    if isinstance(timeout, tuple):
+        return (min(timeout[0], left), min(timeout[1], left))
+    return left if timeout is None else min(timeout, left)
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker for one upstream.
+
+    After `failure_threshold` failures in a row calls are refused for `reset_seconds`; then a single
+    probe is let through (half-open) and its outcome closes or re-opens the circuit. Every allow()
+    that returns True must be followed by record_success(), record_failure() or release().
+    """
+
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.opened_count = 0
+        self.rejected = 0
+        CIRCUIT_STATE.set(0, upstream=name)
+
+    def _set_state_locked(self, state):
+        if state != self._state:
+            print(f"Circuit breaker '{self.name}': {self._state} -> {state}")
+            self._state = state
+            CIRCUIT_STATE.set(_STATE_VALUES[state], upstream=self.name)
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_seconds:
+                return HALF_OPEN
+            return self._state
+
+    def retry_after(self):
+        with self._lock:
+            if self._state != OPEN:
+                return 0
+            return max(0, int(self.reset_seconds - (time.monotonic() - self._opened_at)) + 1)
+
+    def allow(self):
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self._set_state_locked(HALF_OPEN)
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+        CIRCUIT_REJECTED.inc(upstream=self.name)
+        return False
+
+    def check(self):
+        """allow() that raises CircuitOpenError instead of returning False."""
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} is unavailable (circuit open)", self.retry_after() or 1)
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probe_in_flight = False
+            self._set_state_locked(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            was_probe = self._probe_in_flight
+            self._probe_in_flight = False
+            if was_probe or (self._state == CLOSED and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self.opened_count += 1
+                self._set_state_locked(OPEN)
+
+    def release(self):
+        """The call ended without saying anything about the upstream (e.g. cut short by our deadline)."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def stats(self):
+        state = self.state
+        with self._lock:
+            return {
+                "state": state,
+                "consecutive_failures": self._failures,
+                "times_opened": self.opened_count,
+                "rejected": self.rejected,
+            }
+
+
+class Hedger:
+    """Runs a call and, if it is slower than the recent `percentile` latency, a second identical call;
+    the first successful answer wins. `fn(timeout)` must be safe to run twice (a read-only request).
+
+    The calls run on `executor`; the slower attempt is left to finish (or time out) on its own.
+    """
+
+    def __init__(self, name, executor, enabled=GEMINI_HEDGE_ENABLED, percentile=GEMINI_HEDGE_PERCENTILE,
+                 min_samples=GEMINI_HEDGE_MIN_SAMPLES, default_delay=GEMINI_HEDGE_DEFAULT_DELAY,
+                 max_ratio=GEMINI_HEDGE_MAX_RATIO, window=GEMINI_HEDGE_WINDOW):
+        self.name = name
+        self.executor = executor
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.default_delay = default_delay
+        self.max_ratio = max_ratio
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self._recent_hedged = deque(maxlen=window)
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def hedge_delay(self):
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < self.min_samples:
+            return self.default_delay
+        return samples[min(len(samples) - 1, int(len(samples) * self.percentile))]
+
+    def _observe(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def _attempt(self, fn, ends_at, running=None):
+        # The budget counts from when a pool thread picks the attempt up, not from submit
+        started = time.monotonic()
+        if running is not None:
+            running.set()
+        if ends_at - started < DEADLINE_MIN_CALL_SECONDS:
+            raise DeadlineExceeded(f"{self.name}: no time left once the call could start")
+        result = fn(ends_at - started)
+        self._observe(time.monotonic() - started)
+        return result
+
+    def _may_hedge(self):
+        with self._lock:
+            return sum(self._recent_hedged) < self.max_ratio * max(1, len(self._recent_hedged))
+
+    def call(self, fn, timeout):
+        ends_at = time.monotonic() + timeout
+        running = threading.Event()
+        try:
+            first = self.executor.submit(bind_deadline(self._attempt), fn, ends_at, running)
+        except RuntimeError:
+            return self._attempt(fn, ends_at)  # Executor already shut down (process exiting): call inline
+        attempts = [first]
+        hedged = False
+        # The hedge delay runs from the moment the first attempt starts. Time queued for a pool thread says
+        # nothing about the upstream, and a hedge submitted then would only queue behind it.
+        if self.enabled and running.wait(timeout=max(0.0, ends_at - time.monotonic())):
+            done, _ = wait(attempts, timeout=max(0.0, min(self.hedge_delay(), ends_at - time.monotonic())))
+            left = ends_at - time.monotonic()
+            if not done and left >= DEADLINE_MIN_CALL_SECONDS and self._may_hedge():
+                hedged = True
+                attempts.append(self.executor.submit(bind_deadline(self._attempt), fn, ends_at))
+        with self._lock:
+            self.calls += 1
+            self._recent_hedged.append(1 if hedged else 0)
+            if hedged:
+                self.hedged += 1
+
+        pending, errors = set(attempts), []
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, ends_at - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                for attempt in pending:
+                    attempt.cancel()  # Still queued: never start it
+                raise DeadlineExceeded(f"{self.name} did not answer within {timeout:.1f}s")
+            for attempt in done:
+                if attempt.exception() is None:
+                    if hedged:
+                        winner = "hedge" if attempt is not first else "first"
+                        HEDGED_CALLS.inc(upstream=self.name, winner=winner)
+                        if winner == "hedge":
+                            with self._lock:
+                                self.hedge_wins += 1
+                    return attempt.result()
+                errors.append(attempt.exception())
+        raise errors[0]
+
+    def stats(self):
+        delay = self.hedge_delay()
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "hedge_delay_seconds": round(delay, 3),
+                "latency_samples": len(self._latencies),
+                "calls": self.calls,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+            }
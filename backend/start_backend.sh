@@ -31,7 +31,7 @@ if ! venv/bin/python3 -c "import pymongo" &> /dev/null; then
     exit 1
 fi
 
-# Install ffmpeg if not already installed (required by pydub)
+# Install ffmpeg if not already installed (voice clone preprocessing)
 if ! command -v ffmpeg &> /dev/null; then
     echo "Installing ffmpeg..."
     if [[ "$OSTYPE" == "darwin"* ]]; then
@@ -44,5 +44,10 @@ fi
 # Start the Python server using venv Python
 echo "Starting server on http://localhost:5002"
 echo "Make sure your Swift app is configured to connect to http://localhost:5002 or http://127.0.0.1:5002"
-venv/bin/python3 main.py
+if [[ "$SERVING_MODE" == "async" ]]; then
+    # Cooperative (gevent) workers: many in-flight memos per process, see gunicorn.conf.py
+    exec venv/bin/gunicorn -c gunicorn.conf.py main:app
+else
+    venv/bin/python3 main.py
+fi
 
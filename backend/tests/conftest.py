@@ -0,0 +1,85 @@
+import os
+import sys
+from datetime import datetime, timedelta
+
+import jwt
+import pytest
+
+# main.py reads its configuration at import time: an in-memory database, no real upstreams,
+# and nothing that needs an ffmpeg or a slow bcrypt. Set before the first import of main.
+os.environ.update({
+    "MONGO_URI": "mongomock://",
+    "ELEVEN_LABS_API_KEY": "test",
+    "ELEVENLABS_API_BASE": "http://127.0.0.1:9",
+    "GOOGLE_API_KEY": "",
+    "JWT_SECRET_KEY": "test-secret-for-the-backend-test-suite",
+    "BCRYPT_ROUNDS": "4",
+    "PASSWORD_HASH_WORKERS": "0",
+    "EMAIL_CHECK_DELIVERABILITY": "false",
+    "BACKGROUND_MIX_ENABLED": "false",
+    "MEMO_POOL_ENABLED": "false",
+    "TTS_CACHE_ENABLED": "false",
+    "ARTIFACTS_ENABLED": "false",
+    "ADMISSION_ENABLED": "false",
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def main_module():
+    import main
+    return main
+
+
+@pytest.fixture
+def client(main_module):
+    main_module.user_cache.clear()
+    return main_module.app.test_client()
+
+
+@pytest.fixture
+def make_user(main_module):
+    """Insert a user and return (user_id, Authorization headers)."""
+    created = []
+
+    def make(username="alice", password="secret", **fields):
+        document = {
+            "username": username,
+            "email": f"{username}@example.com",
+            "password": main_module.password_hasher.hash(password),
+            "settings": {"language": "english", "voice_similarity": 0.85, "stability": 0.7},
+            "loggedIn": False,
+            **fields,
+        }
+        user_id = main_module.users_collection.insert_one(document).inserted_id
+        created.append(user_id)
+        token = jwt.encode({"user_id": str(user_id), "username": username, "exp": datetime.utcnow() + timedelta(hours=1)},
+                           main_module.app.config["JWT_SECRET_KEY"], algorithm="HS256")
+        return user_id, {"Authorization": f"Bearer {token}"}
+
+    yield make
+    main_module.users_collection.delete_many({"_id": {"$in": created}})
+
+
+@pytest.fixture
+def real_mongo_db():
+    """A throwaway database on the MongoDB at TEST_MONGO_URI; skips when there is none.
+
+    For what mongomock cannot show: concurrency (it serializes every operation) and query plans.
+    """
+    from pymongo import MongoClient
+    from pymongo.errors import PyMongoError
+
+    uri = os.getenv("TEST_MONGO_URI")
+    if not uri:
+        pytest.skip("TEST_MONGO_URI not set")
+    mongo = MongoClient(uri, serverSelectionTimeoutMS=2000)
+    try:
+        mongo.admin.command("ping")
+    except PyMongoError as e:
+        mongo.close()
+        pytest.skip(f"No MongoDB at TEST_MONGO_URI: {e}")
+    name = f"voicememos_test_{os.getpid()}"
+    yield mongo[name]
+    mongo.drop_database(name)
+    mongo.close()
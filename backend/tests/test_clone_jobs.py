@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+from bson import ObjectId
+
+import clone_jobs
+from clone_jobs import CloneJobQueue, QUEUED, RUNNING, SUCCEEDED
+
+LONG_AGO = datetime.utcnow() - timedelta(seconds=clone_jobs.CLONE_JOB_STALE_SECONDS + 60)
+
+
+@pytest.fixture
+def collection():
+    return mongomock.MongoClient().db.clone_jobs
+
+
+@pytest.fixture
+def make_queue(collection, tmp_path):
+    queues = []
+
+    def make(directory=tmp_path):
+        handled = []
+
+        def handler(job, audio_path, set_stage):
+            handled.append(job["_id"])
+            return "voice-1"
+
+        queue = CloneJobQueue(collection, handler, directory=str(directory))
+        queue.handled = handled
+        queues.append(queue)
+        return queue
+
+    yield make
+    for queue in queues:
+        queue._executor.shutdown(wait=True)
+
+
+def insert_job(collection, directory, status=QUEUED, owner=None, updated_at=None, with_audio=True):
+    job_id = ObjectId()
+    collection.insert_one({"_id": job_id, "user_id": ObjectId(), "status": status, "stage": status, "owner": owner,
+                           "attempts": 0, "updated_at": updated_at or datetime.utcnow()})
+    if with_audio:
+        (directory / f"{job_id}.audio").write_bytes(b"ID3")
+    return job_id
+
+
+def run_requeue(queue):
+    requeued = queue.requeue_pending()
+    queue._executor.shutdown(wait=True)
+    return requeued
+
+
+def test_job_without_local_audio_is_left_to_its_host(collection, make_queue, tmp_path):
+    job_id = insert_job(collection, tmp_path, with_audio=False)
+    queue = make_queue()
+    assert run_requeue(queue) == 0
+    assert collection.find_one({"_id": job_id})["status"] == QUEUED  # Not failed for a missing file
+    assert queue.stats()["pending"] == 0
+
+
+def test_job_queued_by_a_live_process_is_not_requeued(collection, make_queue, tmp_path):
+    insert_job(collection, tmp_path, owner="other-host:1234")
+    queue = make_queue()
+    assert run_requeue(queue) == 0
+    assert queue.handled == []
+
+
+def test_stale_or_unowned_queued_jobs_are_adopted(collection, make_queue, tmp_path):
+    unowned = insert_job(collection, tmp_path)
+    stale = insert_job(collection, tmp_path, owner="gone-host:1234", updated_at=LONG_AGO)
+    queue = make_queue()
+    assert run_requeue(queue) == 2
+    assert sorted(queue.handled) == sorted([unowned, stale])
+    assert collection.count_documents({"status": SUCCEEDED}) == 2
+
+
+def test_job_of_a_dead_process_is_requeued_once(collection, make_queue, tmp_path):
+    job_id = insert_job(collection, tmp_path, status=RUNNING, owner="gone-host:1234", updated_at=LONG_AGO)
+    first, second = make_queue(), make_queue()
+    second.owner = lambda: "sibling-host:5678"  # Another worker starting at the same time
+    assert first.requeue_pending() + second.requeue_pending() == 1
+    first._executor.shutdown(wait=True)
+    second._executor.shutdown(wait=True)
+    assert first.handled + second.handled == [job_id]
@@ -0,0 +1,155 @@
+"""Every query of the data-access layer must be served by an index.
+
+Runs each UserRepository / ActivationCodeRepository method, the usage ledger functions (quota.py)
+and the user cache invalidation poll once against a scratch database, records the filters they
+send, and asks MongoDB for the winning plan of each. Needs a real MongoDB (TEST_MONGO_URI, see
+conftest.real_mongo_db): mongomock has no query planner.
+"""
+import json
+from datetime import datetime
+
+from bson import ObjectId
+
+import quota
+from repositories import UserRepository, ActivationCodeRepository
+from user_cache import UserCache
+
+RECORDED_METHODS = ("find", "find_one", "find_one_and_update", "update_one", "update_many", "delete_many",
+                    "count_documents")
+# Point lookups on _id skip the planner (IDHACK, or EXPRESS_* from MongoDB 8) but still use the _id index
+INDEX_STAGES = ("IXSCAN", "IDHACK", "EXPRESS_IXSCAN", "EXPRESS_IDHACK")
+
+
+class RecordingCollection:
+    """Wraps a collection and remembers the filter (or pipeline) of every query sent through it."""
+
+    def __init__(self, collection, log):
+        self._collection = collection
+        self._log = log
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name in RECORDED_METHODS:
+            def recorded(query=None, *args, **kwargs):
+                self._log.append((self._collection.name, name, {"filter": query or {}}))
+                return attr(query, *args, **kwargs)
+            return recorded
+        if name == "aggregate":
+            def recorded_aggregate(pipeline, *args, **kwargs):
+                self._log.append((self._collection.name, name, {"pipeline": pipeline}))
+                return attr(pipeline, *args, **kwargs)
+            return recorded_aggregate
+        return attr
+
+
+def seed(db, now):
+    """A few documents so every collection exists and the planner has real indexes to choose from."""
+    user_ids = [ObjectId() for _ in range(20)]
+    db.users.insert_many([{"_id": user_id, "username": f"user{i}", "email": f"user{i}@example.com",
+                           "password": b"x", "settings": {}, "loggedIn": False}
+                          for i, user_id in enumerate(user_ids)])
+    db.activation_codes.insert_many([{"code": f"CODE{i:04d}", "used": i % 2 == 0, "batch": f"batch{i % 3}",
+                                      "created_at": now} for i in range(50)])
+    db.usage_ledger.insert_many([{"user_id": user_id, "month": quota.month_key(now), "chars": i * 10}
+                                 for i, user_id in enumerate(user_ids)])
+    return user_ids
+
+
+def exercise(users, codes, ledger, cache, user_ids, now):
+    """Call every data-access function the backend uses, with realistic arguments."""
+    user_id = user_ids[0]
+    users.find_profile(user_id)
+    users.find_for_login("user1")
+    users.find_for_login("user1@example.com")
+    users.mark_logged_in(user_id)
+    users.set_logged_out(user_id)
+    users.login_status(user_id)
+    users.update_settings(user_id, {"settings.language": "spanish"})
+    users.set_voice_clone(user_id, "voice")
+    users.clear_voice_clone(user_id)
+    users.reset_password("user2@example.com", b"y")
+    users.usernames(user_ids[:5])
+
+    codes.exists("CODE0001")
+    codes.find_status("CODE0001")
+    claimed = codes.claim_for_registration("CODE0001", user_id, now)
+    codes.release_registration(claimed["_id"], user_id)
+    claimed = codes.claim_for_password_reset("CODE0003", now)
+    codes.release_password_reset(claimed["_id"], now)
+    codes.record_password_reset(claimed["_id"], user_id)
+    list(codes.unused())
+    list(codes.unused("batch1"))
+
+    quota.usage_for(ledger, user_id, now)
+    _, _, _, month = quota.charge_characters(ledger, user_id, 10, now=now)
+    quota.charge_characters(ledger, user_id, 10, enforce_limit=False, now=now)
+    quota.refund_characters(ledger, user_id, 10, month, now=now)
+    quota.usage_history(ledger, user_id, 6, now)
+    quota.monthly_totals(ledger, 6, now)
+    quota.top_users(ledger, quota.month_key(now), 5)
+    quota.clear_month(ledger, now)
+
+    cache.invalidate(user_id)
+    cache.get(user_id)  # Polls the invalidations
+
+
+def plan_stages(plan):
+    """Stage names of a winning plan, outermost first."""
+    if isinstance(plan, dict):
+        stages = [plan["stage"]] if "stage" in plan else []
+        for key in ("inputStage", "queryPlan"):
+            stages += plan_stages(plan.get(key))
+        for child in plan.get("inputStages", []):
+            stages += plan_stages(child)
+        return stages
+    return []
+
+
+def winning_plans(explain):
+    """Every winningPlan in an explain result (aggregations nest theirs under their $cursor stage)."""
+    if isinstance(explain, dict):
+        plans = [explain["winningPlan"]] if "winningPlan" in explain else []
+        for key, value in explain.items():
+            if key != "winningPlan":
+                plans += winning_plans(value)
+        return plans
+    if isinstance(explain, list):
+        return [plan for item in explain for plan in winning_plans(item)]
+    return []
+
+
+def explain(db, collection, method, query):
+    if method == "aggregate":
+        command = {"aggregate": collection, "pipeline": query["pipeline"], "cursor": {}}
+    else:
+        # Writes select documents with the same planner as a find on their filter
+        command = {"find": collection, "filter": query["filter"]}
+    return db.command("explain", command, verbosity="queryPlanner")
+
+
+def test_every_query_uses_an_index(real_mongo_db):
+    db = real_mongo_db
+    log = []
+    now = datetime.utcnow()
+    users = UserRepository(RecordingCollection(db.users, log))
+    codes = ActivationCodeRepository(RecordingCollection(db.activation_codes, log))
+    ledger = RecordingCollection(db.usage_ledger, log)
+    cache = UserCache(ttl_seconds=30, invalidations=RecordingCollection(db.user_cache_invalidations, log), sync_seconds=0)
+    users.ensure_indexes()
+    codes.ensure_indexes()
+    quota.ensure_indexes(ledger)
+    cache.ensure_indexes()
+    user_ids = seed(db, now)
+    exercise(users, codes, ledger, cache, user_ids, now)
+
+    plans = {}
+    for collection, method, query in log:
+        shape = f"{collection}.{method} {json.dumps(query, default=str, sort_keys=True)}"
+        if shape not in plans:
+            plans[shape] = [stage for plan in winning_plans(explain(db, collection, method, query))
+                            for stage in plan_stages(plan)]
+
+    collection_scans = {shape: stages for shape, stages in plans.items() if "COLLSCAN" in stages}
+    assert not collection_scans
+    unindexed = {shape: stages for shape, stages in plans.items() if not set(stages) & set(INDEX_STAGES)}
+    assert not unindexed
@@ -0,0 +1,130 @@
+import threading
+from datetime import datetime
+from unittest import mock
+
+import mongomock
+import pytest
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+import quota
+from quota import MONTHLY_CHAR_LIMIT, charge_characters, refund_characters, usage_for
+
+JUNE = datetime(2025, 6, 30, 23, 59, 59)
+JULY = datetime(2025, 7, 1, 0, 0, 1)
+
+
+@pytest.fixture
+def ledger():
+    collection = mongomock.MongoClient().db.usage_ledger
+    quota.ensure_indexes(collection)
+    return collection
+
+
+# --- Limit logic ---
+
+def test_charge_returns_the_charged_month(ledger):
+    user_id = ObjectId()
+    assert charge_characters(ledger, user_id, 100, now=JUNE) == (True, 0, 100, "2025-06")
+    assert charge_characters(ledger, user_id, 50, now=JUNE) == (True, 100, 150, "2025-06")
+
+
+def test_charge_is_granted_under_the_limit_and_refused_at_it(ledger):
+    # Crossing the limit in one charge is left to the real-MongoDB test below: mongomock answers
+    # ReturnDocument.AFTER with None once the updated entry no longer matches the $lt filter
+    user_id = ObjectId()
+    ledger.insert_one({"user_id": user_id, "month": "2025-06", "chars": MONTHLY_CHAR_LIMIT - 20})
+    assert charge_characters(ledger, user_id, 10, now=JUNE)[:3] == (True, MONTHLY_CHAR_LIMIT - 20, MONTHLY_CHAR_LIMIT - 10)
+    ledger.update_one({"user_id": user_id}, {"$set": {"chars": MONTHLY_CHAR_LIMIT}})
+    assert charge_characters(ledger, user_id, 10, now=JUNE) == (False, MONTHLY_CHAR_LIMIT, MONTHLY_CHAR_LIMIT, "2025-06")
+    assert usage_for(ledger, user_id, JUNE) == MONTHLY_CHAR_LIMIT
+
+
+def test_unenforced_charge_passes_the_limit(ledger):
+    user_id = ObjectId()
+    ledger.insert_one({"user_id": user_id, "month": "2025-06", "chars": MONTHLY_CHAR_LIMIT})
+    granted, _, after, _ = charge_characters(ledger, user_id, 10, enforce_limit=False, now=JUNE)
+    assert (granted, after) == (True, MONTHLY_CHAR_LIMIT + 10)
+
+
+def test_a_full_previous_month_does_not_count(ledger):
+    user_id = ObjectId()
+    ledger.insert_one({"user_id": user_id, "month": "2025-06", "chars": MONTHLY_CHAR_LIMIT})
+    assert charge_characters(ledger, user_id, 10, now=JULY) == (True, 0, 10, "2025-07")
+
+
+def test_duplicate_key_from_a_racing_first_charge_is_retried(ledger):
+    # Another request creates the entry between our filter miss and our insert
+    user_id = ObjectId()
+    real_update = ledger.find_one_and_update
+    calls = []
+
+    def racing_update(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 1:
+            ledger.insert_one({"user_id": user_id, "month": "2025-06", "chars": 5})
+            raise DuplicateKeyError("E11000")
+        return real_update(*args, **kwargs)
+
+    with mock.patch.object(ledger, "find_one_and_update", side_effect=racing_update):
+        assert charge_characters(ledger, user_id, 10, now=JUNE) == (True, 5, 15, "2025-06")
+    assert len(calls) == 2
+
+
+def test_duplicate_key_on_an_entry_at_the_limit_is_a_refusal(ledger):
+    user_id = ObjectId()
+    ledger.insert_one({"user_id": user_id, "month": "2025-06", "chars": MONTHLY_CHAR_LIMIT})
+    with mock.patch.object(ledger, "find_one_and_update", wraps=ledger.find_one_and_update) as update:
+        assert charge_characters(ledger, user_id, 10, now=JUNE)[0] is False
+    assert update.call_count == 1  # No pointless retries
+
+
+# --- Refunds ---
+
+def test_refund_goes_to_the_charged_month(ledger):
+    user_id = ObjectId()
+    _, _, _, month = charge_characters(ledger, user_id, 100, now=JUNE)
+    charge_characters(ledger, user_id, 30, now=JULY)
+    refund_characters(ledger, user_id, 100, month, now=JULY)  # The month changed in between
+    assert usage_for(ledger, user_id, JUNE) == 0
+    assert usage_for(ledger, user_id, JULY) == 30
+
+
+def test_refund_never_goes_below_zero(ledger):
+    user_id = ObjectId()
+    _, _, _, month = charge_characters(ledger, user_id, 100, now=JUNE)
+    quota.clear_month(ledger, JUNE)
+    ledger.insert_one({"user_id": user_id, "month": month, "chars": 20})
+    refund_characters(ledger, user_id, 100, month, now=JUNE)
+    assert usage_for(ledger, user_id, JUNE) == 20
+
+
+# --- Concurrency (real MongoDB only: mongomock serializes every operation) ---
+
+def test_concurrent_charges_lose_nothing_and_stop_at_the_limit(real_mongo_db):
+    ledger = real_mongo_db.usage_ledger
+    quota.ensure_indexes(ledger)
+    user_id = ObjectId()
+    chars = 7
+    granted = []
+    lock = threading.Lock()
+    start = threading.Barrier(16)
+
+    def worker():
+        start.wait()  # All first charges race to create the entry
+        while True:
+            ok, _, _, _ = charge_characters(ledger, user_id, chars)
+            if not ok:
+                return
+            with lock:
+                granted.append(chars)
+
+    threads = [threading.Thread(target=worker) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stored = usage_for(ledger, user_id)
+    assert stored == sum(granted)
+    assert MONTHLY_CHAR_LIMIT <= stored < MONTHLY_CHAR_LIMIT + chars
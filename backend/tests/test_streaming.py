@@ -0,0 +1,76 @@
+import threading
+from unittest import mock
+
+import pytest
+
+
+class FakeTTSResponse:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = 0
+
+    def iter_content(self, chunk_size=None):
+        yield from self.chunks
+
+    def close(self):
+        self.closed += 1
+
+
+@pytest.fixture
+def artifact():
+    return mock.Mock(artifact_id="artifact-1")
+
+
+# --- _relay_tts_stream ---
+
+def test_relay_closed_before_the_first_chunk_releases_everything(main_module, artifact):
+    tts_resp = FakeTTSResponse([b"a", b"b"])
+    with main_module.app.test_request_context():
+        response = main_module._relay_tts_stream(tts_resp, artifact=artifact)
+    response.close()  # What the WSGI server does when the client is already gone
+    assert tts_resp.closed == 1
+    artifact.abort.assert_called_once()
+    artifact.commit.assert_not_called()
+
+
+def test_relay_cleanup_runs_once_after_a_full_stream(main_module, artifact):
+    tts_resp = FakeTTSResponse([b"a", b"b"])
+    with main_module.app.test_request_context():
+        response = main_module._relay_tts_stream(tts_resp, artifact=artifact)
+    assert b"".join(response.response) == b"ab"
+    response.close()
+    assert tts_resp.closed == 1
+    artifact.commit.assert_called_once()
+    artifact.abort.assert_not_called()
+
+
+# --- _pipelined_memo_response ---
+
+def test_pipeline_closed_before_the_first_segment_stops_the_producer(main_module, artifact):
+    second_sentence_allowed = threading.Event()
+    sentences_closed = threading.Event()
+
+    def sentences():
+        try:
+            yield "Uno."
+            second_sentence_allowed.wait(5)
+            yield "Dos."
+            yield "Tres."
+        finally:
+            sentences_closed.set()
+
+    on_text_complete = mock.Mock()
+    with mock.patch.object(main_module.eleven_client, "post") as post:
+        post.return_value.content = b"mp3"
+        post.return_value.raise_for_status.return_value = None
+        with main_module.app.test_request_context():
+            response = main_module._pipelined_memo_response(sentences(), "voice", "model", {}, on_text_complete,
+                                                            artifact=artifact)
+        response.close()
+        second_sentence_allowed.set()
+        assert sentences_closed.wait(5)
+
+    assert post.call_count == 1  # Only the first sentence, awaited before answering
+    on_text_complete.assert_not_called()  # Nothing was delivered, nothing is charged
+    artifact.abort.assert_called_once()
+    artifact.commit.assert_not_called()
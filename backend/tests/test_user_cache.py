@@ -0,0 +1,235 @@
+from unittest import mock
+
+import pytest
+
+import user_cache as user_cache_module
+from user_cache import UserCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(user_cache_module.time, "monotonic", fake)
+    return fake
+
+
+# --- UserCache ---
+
+def test_entry_expires_after_ttl(clock):
+    cache = UserCache(ttl_seconds=30)
+    cache.set("u1", {"username": "alice"})
+
+    clock.now += 29.9
+    assert cache.get("u1") == {"username": "alice"}
+    clock.now += 0.1
+    assert cache.get("u1") is None
+    assert cache.stats()["entries"] == 0  # The expired entry is dropped on lookup
+
+
+def test_set_restarts_the_ttl(clock):
+    cache = UserCache(ttl_seconds=30)
+    cache.set("u1", {"username": "alice"})
+    clock.now += 20
+    cache.set("u1", {"username": "alice2"})
+    clock.now += 20
+    assert cache.get("u1") == {"username": "alice2"}
+
+
+def test_zero_ttl_disables_caching(clock):
+    cache = UserCache(ttl_seconds=0)
+    cache.set("u1", {"username": "alice"})
+    assert cache.get("u1") is None
+
+
+def test_get_returns_a_copy(clock):
+    cache = UserCache(ttl_seconds=30)
+    cache.set("u1", {"username": "alice"})
+    cache.get("u1")["username"] = "mallory"
+    assert cache.get("u1")["username"] == "alice"
+
+
+def test_nested_fields_are_not_shared(clock):
+    settings = {"language": "english"}
+    cache = UserCache(ttl_seconds=30)
+    cache.set("u1", {"settings": settings})
+    settings["language"] = "spanish"
+    cache.get("u1")["settings"]["language"] = "french"
+    assert cache.get("u1")["settings"]["language"] == "english"
+
+
+def test_keys_are_strings(clock):
+    from bson import ObjectId
+
+    user_id = ObjectId()
+    cache = UserCache(ttl_seconds=30)
+    cache.set(user_id, {"username": "alice"})
+    assert cache.get(str(user_id)) == {"username": "alice"}
+    cache.invalidate(str(user_id))
+    assert cache.get(user_id) is None
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = UserCache(ttl_seconds=30, max_entries=2)
+    cache.set("u1", {"n": 1})
+    cache.set("u2", {"n": 2})
+    cache.get("u1")
+    cache.set("u3", {"n": 3})
+    assert cache.get("u2") is None
+    assert cache.get("u1") == {"n": 1}
+    assert cache.get("u3") == {"n": 3}
+
+
+def test_stats_count_hits_misses_and_invalidations(clock):
+    cache = UserCache(ttl_seconds=30)
+    cache.set("u1", {"n": 1})
+    cache.get("u1")
+    cache.get("u2")
+    cache.invalidate("u1")
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["invalidations"], stats["hit_rate"]) == (1, 1, 1, 0.5)
+
+
+# --- Invalidation across workers (shared invalidations collection) ---
+
+@pytest.fixture
+def invalidations():
+    import mongomock
+
+    return mongomock.MongoClient().db.user_cache_invalidations
+
+
+def test_invalidation_reaches_other_workers(clock, invalidations):
+    worker_a = UserCache(ttl_seconds=30, invalidations=invalidations, sync_seconds=1)
+    worker_b = UserCache(ttl_seconds=30, invalidations=invalidations, sync_seconds=1)
+    worker_b.get("u1")  # First poll
+    worker_b.set("u1", {"voice_clone_id": "voice-1"})
+
+    worker_a.invalidate("u1")
+    assert worker_b.get("u1") == {"voice_clone_id": "voice-1"}  # Within the sync interval
+    clock.now += 1
+    assert worker_b.get("u1") is None
+    assert worker_b.stats()["invalidations_received"] == 1
+
+
+def test_invalidation_racing_a_set_is_still_applied(clock, invalidations):
+    worker_a = UserCache(ttl_seconds=30, invalidations=invalidations, sync_seconds=1)
+    worker_b = UserCache(ttl_seconds=30, invalidations=invalidations, sync_seconds=1)
+    worker_b.get("u1")
+    worker_a.invalidate("u1")  # Published after worker_b read the old profile but before it cached it
+    worker_b.set("u1", {"voice_clone_id": "voice-1"})
+    clock.now += 1
+    assert worker_b.get("u1") is None
+
+
+def test_failed_sync_drops_the_cache(clock, invalidations):
+    cache = UserCache(ttl_seconds=30, invalidations=invalidations, sync_seconds=1)
+    cache.set("u1", {"n": 1})
+    clock.now += 1
+    with mock.patch.object(invalidations, "find", side_effect=RuntimeError("down")):
+        assert cache.get("u1") is None
+
+
+# --- Projection: the password hash never reaches the cache ---
+
+def test_profile_projection_excludes_the_password_hash(main_module, make_user):
+    user_id, _ = make_user()
+    profile = main_module.users.find_profile(user_id)
+    assert profile["username"] == "alice"
+    assert "password" not in profile
+
+
+def test_token_required_caches_the_projected_profile(main_module, client, make_user):
+    user_id, headers = make_user()
+    assert client.get("/me", headers=headers).status_code == 200
+
+    cached = main_module.user_cache.get(user_id)
+    assert cached["username"] == "alice"
+    assert "password" not in cached
+
+
+def test_cached_profile_is_served_without_a_database_read(main_module, client, make_user):
+    user_id, headers = make_user()
+    client.get("/me", headers=headers)
+    with mock.patch.object(main_module.users, "find_profile") as find_profile:
+        assert client.get("/me", headers=headers).status_code == 200
+    find_profile.assert_not_called()
+
+
+# --- Every write path invalidates the user's entry ---
+
+@pytest.fixture
+def cached_user(main_module, client, make_user):
+    """A user whose profile token_required has just cached."""
+    user_id, headers = make_user()
+    client.get("/me", headers=headers)
+    assert main_module.user_cache.get(user_id) is not None
+    return user_id, headers
+
+
+def test_update_settings_invalidates(main_module, client, cached_user):
+    user_id, headers = cached_user
+    response = client.post("/update-settings", json={"language": "spanish"}, headers=headers)
+    assert response.status_code == 200
+    assert main_module.user_cache.get(user_id) is None
+    assert client.get("/me", headers=headers).get_json()["settings"]["language"] == "spanish"
+
+
+def test_login_invalidates(main_module, client, cached_user):
+    user_id, _ = cached_user
+    response = client.post("/login", json={"email": "alice", "password": "secret"})
+    assert response.status_code == 200
+    assert main_module.user_cache.get(user_id) is None
+
+
+@pytest.mark.parametrize("route", ["/logout", "/force-logout"])
+def test_logout_invalidates(main_module, client, cached_user, route):
+    user_id, headers = cached_user
+    assert client.post(route, headers=headers).status_code == 200
+    assert main_module.user_cache.get(user_id) is None
+
+
+def test_reset_password_invalidates(main_module, client, cached_user):
+    user_id, _ = cached_user
+    main_module.activation_codes_collection.insert_one({"code": "RESET0001", "used": True})
+    response = client.post("/reset-password", json={"email": "alice@example.com", "activation_code": "RESET0001",
+                                                    "new_password": "another"})
+    assert response.status_code == 200
+    assert main_module.user_cache.get(user_id) is None
+
+
+def test_delete_voice_clone_invalidates(main_module, client, make_user):
+    user_id, headers = make_user(voice_clone_id="voice-1")
+    client.get("/me", headers=headers)
+    with mock.patch.object(main_module.eleven_client, "delete") as delete:
+        delete.return_value.raise_for_status.return_value = None
+        assert client.delete("/delete-voice-clone", headers=headers).status_code == 200
+    assert main_module.user_cache.get(user_id) is None
+    assert "voice_clone_id" not in main_module.users.find_profile(user_id)
+
+
+def test_new_voice_clone_invalidates(main_module, client, cached_user):
+    user_id, _ = cached_user
+    user = main_module.users.find_profile(user_id)
+    with mock.patch.object(main_module.eleven_client, "post") as post:
+        post.return_value.json.return_value = {"voice_id": "voice-2"}
+        post.return_value.raise_for_status.return_value = None
+        assert main_module._create_voice_clone(user, "sample.mp3", "audio/mpeg", b"ID3") == "voice-2"
+    assert main_module.user_cache.get(user_id) is None
+
+
+def test_update_settings_invalidates_other_workers(main_module, client, cached_user):
+    user_id, headers = cached_user
+    other_worker = UserCache(ttl_seconds=30, invalidations=main_module.user_cache.invalidations, sync_seconds=0)
+    other_worker.get(user_id)
+    other_worker.set(user_id, main_module.users.find_profile(user_id))
+
+    assert client.post("/update-settings", json={"language": "spanish"}, headers=headers).status_code == 200
+    assert other_worker.get(user_id) is None
@@ -0,0 +1,142 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+TTS_CACHE_ENABLED = os.getenv("TTS_CACHE_ENABLED", "true").strip().lower() in ("true", "1")
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "voicememos_tts_cache"))
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))  # 256 MB
+
+CACHE_FILE_SUFFIX = ".audio"
+
+
+class TTSAudioCache:
+    """Content-addressed on-disk store for synthesized audio with an in-memory LRU index and a byte budget.
+
+    Entries are immutable files named after the request hash, so several worker processes can share
+    one directory: each keeps its own index and adopts files written by the others on lookup.
+    """
+
+    def __init__(self, directory=TTS_CACHE_DIR, max_bytes=TTS_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._index = OrderedDict()  # key -> size in bytes, least recently used first
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_index()
+
+    @staticmethod
+    def make_key(voice_id, model_id, text, stability, similarity_boost, **extra):
+        """Hash every parameter that changes the synthesized audio."""
+        material = json.dumps(
+            [voice_id, model_id, text, float(stability), float(similarity_boost), sorted(extra.items())],
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + CACHE_FILE_SUFFIX)
+
+    def _load_index(self):
+        """Rebuild the index from the files already on disk, oldest access first."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(CACHE_FILE_SUFFIX):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, name[:-len(CACHE_FILE_SUFFIX)], st.st_size))
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._total_bytes += size
+        with self._lock:
+            self._evict_locked()
+
+    def get(self, key):
+        """Return the cached audio bytes for `key`, or None on a miss."""
+        path = self._path(key)
+        with self._lock:
+            known = key in self._index
+            if known:
+                self._index.move_to_end(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            with self._lock:
+                if known and key in self._index:
+                    # Evicted by another worker sharing the directory
+                    self._total_bytes -= self._index.pop(key)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            if key not in self._index:
+                # Written by another worker: adopt it into this worker's index
+                self._index[key] = len(data)
+                self._total_bytes += len(data)
+                self._evict_locked()
+            self.hits += 1
+        try:
+            os.utime(path, None)  # Keep the on-disk recency in line with the index for restarts
+        except OSError:
+            pass
+        return data
+
+    def put(self, key, data):
+        """Store `data` under `key`, evicting least recently used entries beyond the byte budget."""
+        size = len(data)
+        if not data or size > self.max_bytes:
+            return False
+        path = self._path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)  # Atomic: readers never see a partial entry
+        except OSError as e:
+            print(f"TTS cache write failed for {key}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return False
+
+        with self._lock:
+            if key in self._index:
+                self._total_bytes -= self._index.pop(key)
+            self._index[key] = size
+            self._total_bytes += size
+            self._evict_locked()
+        return True
+
+    def _evict_locked(self):
+        while self._total_bytes > self.max_bytes and self._index:
+            old_key, old_size = self._index.popitem(last=False)
+            self._total_bytes -= old_size
+            self.evictions += 1
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._index),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
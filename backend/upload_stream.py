@@ -0,0 +1,132 @@
+import os
+import secrets
+from werkzeug.sansio.multipart import MultipartDecoder, NeedData, Field, File, Data, Epilogue
+from werkzeug.http import parse_options_header
+
+# Largest voice sample accepted, enforced while the upload streams through (also without Content-Length)
+CLONE_UPLOAD_MAX_BYTES = int(os.getenv("CLONE_UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+# Accepted part content types; entries ending in "/" are prefixes
+CLONE_UPLOAD_ALLOWED_TYPES = [
+    t.strip().lower() for t in os.getenv("CLONE_UPLOAD_ALLOWED_TYPES", "audio/,video/mp4,application/octet-stream").split(",") if t.strip()
+]
+UPLOAD_READ_CHUNK_SIZE = int(os.getenv("UPLOAD_READ_CHUNK_SIZE", str(64 * 1024)))
+# Plain form fields sent before the file are kept in memory, so they are small by definition
+MAX_FORM_FIELD_BYTES = 64 * 1024
+
+
+class UploadRejected(Exception):
+    """The upload broke a limit; status_code is the HTTP status to answer with."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def content_type_allowed(content_type, allowed=None):
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    for entry in allowed or CLONE_UPLOAD_ALLOWED_TYPES:
+        if content_type == entry or (entry.endswith("/") and content_type.startswith(entry)):
+            return True
+    return False
+
+
+class StreamingMultipartUpload:
+    """Reads a multipart/form-data request body incrementally with werkzeug's sans-IO decoder.
+
+    Nothing is spooled to disk: next_file() advances to a file part and iter_file_data() yields its
+    bytes as they are read from the client, at most `chunk_size` at a time.
+    """
+
+    def __init__(self, stream, content_type, max_bytes=CLONE_UPLOAD_MAX_BYTES, chunk_size=UPLOAD_READ_CHUNK_SIZE):
+        mimetype, options = parse_options_header(content_type or "")
+        if mimetype != "multipart/form-data" or not options.get("boundary"):
+            raise UploadRejected("Expected a multipart/form-data upload", 400)
+        self.stream = stream
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.fields = {}
+        self.bytes_received = 0
+        self._decoder = MultipartDecoder(options["boundary"].encode("latin-1"))
+        self._finished = False
+        self._pending_event = None
+
+    def _next_event(self):
+        if self._pending_event is not None:
+            event, self._pending_event = self._pending_event, None
+            return event
+        while True:
+            event = self._decoder.next_event()
+            if not isinstance(event, NeedData):
+                return event
+            if self._finished:
+                raise UploadRejected("Upload ended before the multipart body was complete", 400)
+            chunk = self.stream.read(self.chunk_size)
+            if not chunk:
+                self._finished = True
+                self._decoder.receive_data(None)
+                continue
+            self.bytes_received += len(chunk)
+            if self.bytes_received > self.max_bytes:
+                raise UploadRejected(f"Upload exceeds the {self.max_bytes / (1024 * 1024):g} MB limit", 413)
+            self._decoder.receive_data(chunk)
+
+    def next_file(self, field_name):
+        """Advance to the file part named `field_name` and return its (filename, content_type), or None.
+
+        Plain fields found on the way are collected into self.fields.
+        """
+        current_field = None
+        value = bytearray()
+        while True:
+            event = self._next_event()
+            if isinstance(event, Epilogue):
+                return None
+            if isinstance(event, File):
+                if event.name == field_name:
+                    return event.filename, event.headers.get("Content-Type", "application/octet-stream")
+                current_field = None
+            elif isinstance(event, Field):
+                current_field, value = event.name, bytearray()
+            elif isinstance(event, Data) and current_field is not None:
+                value += event.data
+                if len(value) > MAX_FORM_FIELD_BYTES:
+                    raise UploadRejected(f"Form field '{current_field}' is too large", 413)
+                if not event.more_data:
+                    self.fields[current_field] = value.decode("utf-8", "replace")
+                    current_field = None
+
+    def iter_file_data(self):
+        """Yield the current file part's bytes as they arrive."""
+        while True:
+            event = self._next_event()
+            if not isinstance(event, Data):
+                self._pending_event = event
+                return
+            if event.data:
+                yield event.data
+            if not event.more_data:
+                return
+
+
+def _quote(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\r", "").replace("\n", "")
+
+
+def multipart_body(fields, file_field, filename, content_type, file_chunks, boundary=None):
+    """Build an outgoing multipart/form-data body as a generator (sent with chunked transfer encoding).
+
+    Returns (content_type_header, body_iterator); the file bytes are pulled from `file_chunks` lazily.
+    """
+    boundary = boundary or f"----voicememos{secrets.token_hex(16)}"
+
+    def generate():
+        for name, value in fields:
+            yield (f'--{boundary}\r\nContent-Disposition: form-data; name="{_quote(name)}"\r\n\r\n').encode("utf-8")
+            yield str(value).encode("utf-8") + b"\r\n"
+        yield (f'--{boundary}\r\nContent-Disposition: form-data; name="{_quote(file_field)}"; '
+               f'filename="{_quote(filename)}"\r\nContent-Type: {content_type}\r\n\r\n').encode("utf-8")
+        for chunk in file_chunks:
+            yield chunk
+        yield f"\r\n--{boundary}--\r\n".encode("utf-8")
+
+    return f"multipart/form-data; boundary={boundary}", generate()
@@ -0,0 +1,131 @@
+import os
+import copy
+import time
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "30"))
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+# How often a worker reads the invalidations published by the others: the staleness bound across workers
+USER_CACHE_SYNC_SECONDS = float(os.getenv("USER_CACHE_SYNC_SECONDS", "1"))
+# Each poll reads back this far behind the previous one (clock skew between hosts, writes racing a set())
+SYNC_OVERLAP_SECONDS = 5
+
+
+class UserCache:
+    """In-process TTL cache of projected user documents keyed by user_id (repositories.PROFILE_PROJECTION).
+
+    Write paths that change a user must call invalidate(). With an `invalidations` collection the
+    invalidation is also published there, and every worker drops the entries other workers invalidated
+    at most USER_CACHE_SYNC_SECONDS later (one indexed query per interval, not per request). Without
+    it only the TTL bounds staleness across worker processes.
+    """
+
+    def __init__(self, ttl_seconds=USER_CACHE_TTL_SECONDS, max_entries=USER_CACHE_MAX_ENTRIES, invalidations=None,
+                 sync_seconds=USER_CACHE_SYNC_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.invalidations = invalidations
+        self.sync_seconds = sync_seconds
+        self._entries = OrderedDict()  # user_id -> (expires_at, document)
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._next_sync = 0.0
+        self._synced_at = datetime.utcnow()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations_published = 0
+        self.invalidations_received = 0
+
+    def ensure_indexes(self):
+        if self.invalidations is not None:
+            # Older invalidations only concern entries that have expired anyway
+            self.invalidations.create_index(
+                "at", expireAfterSeconds=int(self.ttl_seconds + self.sync_seconds + SYNC_OVERLAP_SECONDS) + 60)
+
+    def get(self, user_id):
+        """Return a deep copy of the cached document, or None if missing, expired or invalidated."""
+        self._sync()
+        key = str(user_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            document = entry[1]
+        return copy.deepcopy(document)  # Handlers may mutate nested fields (settings)
+
+    def set(self, user_id, document):
+        if self.ttl_seconds <= 0:
+            return
+        key = str(user_id)
+        document = copy.deepcopy(document)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, document)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        """Drop the user's entry here and, when shared, in every other worker."""
+        with self._lock:
+            self.invalidations_published += 1
+            self._entries.pop(str(user_id), None)
+        if self.invalidations is not None:
+            try:
+                self.invalidations.insert_one({"user_id": str(user_id), "at": datetime.utcnow()})
+            except Exception as e:
+                print(f"User cache invalidation for {user_id} not published: {e}")
+
+    def _sync(self):
+        """Drop the entries other workers invalidated since the last poll (at most once per sync_seconds)."""
+        if self.invalidations is None or time.monotonic() < self._next_sync:
+            return
+        if not self._sync_lock.acquire(blocking=False):
+            return  # Another request thread is polling
+        try:
+            if time.monotonic() < self._next_sync:
+                return
+            started_at = datetime.utcnow()
+            since = self._synced_at - timedelta(seconds=SYNC_OVERLAP_SECONDS)
+            try:
+                user_ids = {doc["user_id"] for doc in self.invalidations.find({"at": {"$gte": since}}, {"_id": 0, "user_id": 1})}
+            except Exception as e:
+                print(f"User cache sync failed: {e}")
+                user_ids = None
+            if user_ids is None:
+                # Cannot tell what changed: serve nothing stale, refill from the database
+                self.clear()
+            else:
+                with self._lock:
+                    for key in user_ids:
+                        if self._entries.pop(key, None) is not None:
+                            self.invalidations_received += 1
+                self._synced_at = started_at
+            self._next_sync = time.monotonic() + self.sync_seconds
+        finally:
+            self._sync_lock.release()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "ttl_seconds": self.ttl_seconds,
+                "shared_invalidation": self.invalidations is not None,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations_published,
+                "invalidations_received": self.invalidations_received,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,172 @@
+import os
+import time
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from cpu_pool import ASYNC_SERVING, run_cpu_bound
+
+# Off by default: preprocessing needs the whole sample, so the clone upload is buffered instead of streamed
+VOICE_PREPROCESS_ENABLED = os.getenv("VOICE_PREPROCESS_ENABLED", "false").strip().lower() in ("true", "1")
+VOICE_PREPROCESS_SAMPLE_RATE = int(os.getenv("VOICE_PREPROCESS_SAMPLE_RATE", "44100"))
+VOICE_PREPROCESS_BITRATE = os.getenv("VOICE_PREPROCESS_BITRATE", "96k")
+VOICE_PREPROCESS_MAX_SECONDS = float(os.getenv("VOICE_PREPROCESS_MAX_SECONDS", "180"))
+VOICE_PREPROCESS_SILENCE_DBFS = float(os.getenv("VOICE_PREPROCESS_SILENCE_DBFS", "-45"))
+VOICE_PREPROCESS_TARGET_DBFS = float(os.getenv("VOICE_PREPROCESS_TARGET_DBFS", "-20"))
+VOICE_PREPROCESS_WORKERS = int(os.getenv("VOICE_PREPROCESS_WORKERS", "2"))
+# Samples waiting or being processed per worker; more than this go to ElevenLabs untouched
+VOICE_PREPROCESS_MAX_QUEUE = int(os.getenv("VOICE_PREPROCESS_MAX_QUEUE", "4"))
+# Time budget per file (decode + processing + encode); past it the raw upload is used
+VOICE_PREPROCESS_TIMEOUT = float(os.getenv("VOICE_PREPROCESS_TIMEOUT", "20"))
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+# Never "fork" from the multithreaded request worker (a lock held by another thread is copied locked);
+# forkserver/spawn children import only this module, cpu_pool and numpy
+VOICE_PREPROCESS_START_METHOD = os.getenv("VOICE_PREPROCESS_START_METHOD", "forkserver")
+
+FRAME_SECONDS = 0.02  # Analysis window for silence detection
+SILENCE_PADDING_SECONDS = 0.25  # Kept around the speech so words are not clipped
+PEAK_CEILING = 10 ** (-1.0 / 20)  # -1 dBFS
+
+
+def _ffmpeg(args, stdin_data, deadline):
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError("Preprocessing time budget exhausted")
+    result = subprocess.run([FFMPEG_BINARY, "-v", "error", *args], input=stdin_data,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=remaining)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.decode('utf-8', 'replace')[-300:]}")
+    return result.stdout
+
+
+def decode_to_pcm(audio_bytes, suffix, sample_rate, deadline):
+    """Single decode: any input format to mono float32 samples at `sample_rate` (ffmpeg downmixes and resamples)."""
+    # MP4/M4A from iOS keeps its index at the end of the file, so ffmpeg needs a seekable input
+    with tempfile.NamedTemporaryFile(suffix=suffix) as source:
+        source.write(audio_bytes)
+        source.flush()
+        raw = _ffmpeg(["-i", source.name, "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(sample_rate), "-"],
+                      None, deadline)
+    return np.frombuffer(raw, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+def trim_silence(samples, sample_rate, threshold_dbfs=VOICE_PREPROCESS_SILENCE_DBFS):
+    """Drop leading and trailing frames quieter than `threshold_dbfs` (frame RMS)."""
+    frame = max(1, int(sample_rate * FRAME_SECONDS))
+    frames = len(samples) // frame
+    if frames == 0:
+        return samples
+    rms = np.sqrt(np.mean(np.square(samples[:frames * frame].reshape(frames, frame)), axis=1))
+    loud = np.flatnonzero(rms > 10 ** (threshold_dbfs / 20))
+    if len(loud) == 0:
+        return samples[:0]
+    padding = int(sample_rate * SILENCE_PADDING_SECONDS)
+    start = max(0, loud[0] * frame - padding)
+    end = min(len(samples), (loud[-1] + 1) * frame + padding)
+    return samples[start:end]
+
+
+def normalize_loudness(samples, target_dbfs=VOICE_PREPROCESS_TARGET_DBFS):
+    """Scale to the target RMS level without letting peaks exceed -1 dBFS."""
+    rms = float(np.sqrt(np.mean(np.square(samples)))) if len(samples) else 0.0
+    if rms <= 0:
+        return samples
+    gain = 10 ** (target_dbfs / 20) / rms
+    peak = float(np.max(np.abs(samples)))
+    if peak * gain > PEAK_CEILING:
+        gain = PEAK_CEILING / peak
+    return samples * gain
+
+
+def encode_mp3(samples, sample_rate, bitrate, deadline):
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16).tobytes()
+    return _ffmpeg(["-f", "s16le", "-ar", str(sample_rate), "-ac", "1", "-i", "-",
+                    "-codec:a", "libmp3lame", "-b:a", bitrate, "-f", "mp3", "-"], pcm, deadline)
+
+
+def _shape(samples, sample_rate, max_seconds):
+    samples = trim_silence(samples, sample_rate)
+    if len(samples) == 0:
+        raise ValueError("The recording is silent")
+    return normalize_loudness(samples[:int(max_seconds * sample_rate)])
+
+
+def preprocess_voice_sample(audio_bytes, suffix, sample_rate=VOICE_PREPROCESS_SAMPLE_RATE, bitrate=VOICE_PREPROCESS_BITRATE,
+                            max_seconds=VOICE_PREPROCESS_MAX_SECONDS, time_budget=VOICE_PREPROCESS_TIMEOUT):
+    """Decode once, trim silence, normalize, cap the duration and re-encode as mono MP3.
+
+    Returns (mp3_bytes, stats). Runs inside the worker processes, or inline when serving async.
+    """
+    deadline = time.monotonic() + time_budget
+    samples = decode_to_pcm(audio_bytes, suffix, sample_rate, deadline)
+    input_seconds = len(samples) / sample_rate
+    samples = run_cpu_bound(_shape, samples, sample_rate, max_seconds)
+    encoded = encode_mp3(samples, sample_rate, bitrate, deadline)
+    return encoded, {
+        "input_bytes": len(audio_bytes),
+        "output_bytes": len(encoded),
+        "input_seconds": round(input_seconds, 2),
+        "output_seconds": round(len(samples) / sample_rate, 2),
+    }
+
+
+class VoicePreprocessor:
+    """Runs preprocess_voice_sample in a bounded process pool; any failure means "send the original"."""
+
+    def __init__(self, workers=VOICE_PREPROCESS_WORKERS, max_queue=VOICE_PREPROCESS_MAX_QUEUE, timeout=VOICE_PREPROCESS_TIMEOUT):
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_queue)
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        self.processed = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def _get_executor(self):
+        # Per process, created on first use (gunicorn forks workers after import)
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context(VOICE_PREPROCESS_START_METHOD))
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def process(self, audio_bytes, filename):
+        """Return (mp3_bytes, stats) or None when the raw upload should be used instead."""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.skipped += 1
+            print("Voice preprocessing queue full, sending the original sample")
+            return None
+        try:
+            suffix = os.path.splitext(filename or "")[1] or ".audio"
+            if ASYNC_SERVING:
+                # No process pool under gevent: its feeder threads would be greenlets on the hub. ffmpeg runs
+                # through gevent's subprocess (the greenlet yields while it waits) and the numpy stages go to
+                # the hub's native threads; the slots above still bound how many run at once
+                result = preprocess_voice_sample(audio_bytes, suffix, time_budget=self.timeout)
+                with self._lock:
+                    self.processed += 1
+                return result
+            future = self._get_executor().submit(preprocess_voice_sample, audio_bytes, suffix, time_budget=self.timeout)
+            # Small margin over the in-worker budget for pickling and process start
+            result = future.result(timeout=self.timeout + 5)
+            with self._lock:
+                self.processed += 1
+            return result
+        except Exception as e:  # Includes the future timeout
+            with self._lock:
+                self.failed += 1
+            print(f"Voice preprocessing failed, sending the original sample: {e}")
+            return None
+        finally:
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {"workers": self.workers, "processed": self.processed, "skipped": self.skipped, "failed": self.failed}